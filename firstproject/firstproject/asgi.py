@@ -13,4 +13,20 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'firstproject.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+from testapp.websocket import chat_websocket  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # WebSocket chat (/ws/chat/<session_id>/) is served without the Django request cycle
+    if scope['type'] == 'websocket':
+        await chat_websocket(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
+
+
+if settings.STARTUP_WARMUP:
+    from testapp.warmup import warmup  # noqa: E402
+    warmup()
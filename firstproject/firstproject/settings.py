@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,12 +45,16 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'testapp.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'testapp.middleware.ConcurrencyLimitMiddleware',
+    'testapp.middleware.PrimaryPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'testapp.middleware.DisableCSRFForAPIMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'testapp.middleware.CachedAuthenticationMiddleware',
+    'testapp.middleware.UserSessionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -77,12 +82,43 @@ WSGI_APPLICATION = 'firstproject.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite is the default. Set DB_ENGINE=postgresql (plus the DB_* variables
+# below) to run against PostgreSQL; DB_REPLICA_HOSTS is a comma-separated list
+# of read replicas that serve catalog reads (see testapp.routers).
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'chatbot'),
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+        }
+    }
+    for index, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+        DATABASES[f'replica{index + 1}'] = {
+            **DATABASES['default'],
+            'HOST': host.strip(),
+            # Replicas mirror the primary in tests instead of getting their own test database
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            # A file rather than the default in-memory database, so tests that use
+            # several threads get SQLite's real locking (waiting on a busy database)
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
     }
-}
+
+DATABASE_ROUTERS = ['testapp.routers.PrimaryReplicaRouter']
 
 
 # Password validation
@@ -137,4 +173,116 @@ CSRF_COOKIE_SAMESITE = 'Lax'
 # Session settings for authentication
 SESSION_COOKIE_AGE = 86400  # 24 hours
 SESSION_COOKIE_HTTPONLY = True
-SESSION_COOKIE_SAMESITE = 'Lax'
\ No newline at end of file
+SESSION_COOKIE_SAMESITE = 'Lax'
+# Sessions are read from the cache and revocable on the server. Set SESSION_ENGINE to
+# django.contrib.sessions.backends.signed_cookies to skip the session store entirely,
+# at the cost of logouts not invalidating copies of the cookie.
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db')
+
+# Seconds a resolved User stays in the per-process cache, and a ChatSession in Django's cache
+AUTH_USER_CACHE_TTL = 60
+CHAT_SESSION_CACHE_TTL = 60
+# UserSession rows are written in the background, at most once per interval (seconds) per session
+USER_SESSION_TRACKING = True
+USER_SESSION_RECORD_INTERVAL = 60
+
+# Chat settings
+# Store a JSON snapshot of recommended products on bot messages so history reads skip the M2M join
+CHAT_PRODUCT_SNAPSHOTS = True
+
+# Maximum number of messages accepted by one /api/chat/batch/ request
+CHAT_BATCH_MAX_MESSAGES = 5000
+
+# Rate limiting: token buckets per scope and per user (or IP when anonymous).
+# capacity is the burst size, refill_per_second the sustained rate.
+# RATE_LIMIT_BACKEND is 'local' (per process) or 'cache' (shared through Django's cache).
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'local')
+RATE_LIMITS = {
+    'product_list': {'capacity': 30, 'refill_per_second': 2},
+    'product_search': {'capacity': 20, 'refill_per_second': 1},
+    'product_suggest': {'capacity': 60, 'refill_per_second': 10},
+    'chat': {'capacity': 30, 'refill_per_second': 1},
+    'chat_history': {'capacity': 60, 'refill_per_second': 5},
+    'chat_batch': {'capacity': 5, 'refill_per_second': 0.1},
+}
+
+# Maximum in-flight requests per path prefix before new ones are shed with 429
+CONCURRENCY_LIMITS = {
+    '/api/products/': 32,
+    '/api/chat/': 64,
+    '/ws/chat/': 1000,
+}
+CONCURRENCY_RETRY_AFTER = 1
+
+# Post-response work queue (testapp.tasks). TASK_QUEUE_MODE is 'thread' (in-process
+# workers), 'durable' (DeferredTask rows drained by `manage.py run_deferred_tasks`)
+# or 'sync' (run as soon as the request transaction commits).
+TASK_QUEUE_MODE = os.environ.get('TASK_QUEUE_MODE', 'thread')
+TASK_QUEUE_WORKERS = 2
+TASK_QUEUE_MAX_SIZE = 10000
+TASK_QUEUE_BATCH_SIZE = 500
+
+# ChatSession.updated_at bumps are buffered and written in one UPDATE every this many
+# seconds, which bounds how stale session ordering can be (0 writes through)
+SESSION_TOUCH_FLUSH_INTERVAL = 0.25
+
+# ChatMessage.content compression (testapp.fields.CompressedTextField): texts shorter
+# than the minimum length (in bytes) are stored uncompressed
+COMPRESSED_TEXT_MIN_LENGTH = 128
+COMPRESSED_TEXT_LEVEL = 6
+
+# Seconds before in-memory catalog indexes (spelling correction, ...) are rebuilt in the
+# background even without a local Product change, so edits made by other processes are picked up
+CATALOG_INDEX_MAX_AGE = 300
+
+# Catalog snapshot written by `manage.py build_catalog_snapshot` and memory-mapped by
+# every worker (testapp.snapshot). Unset to keep per-process in-memory indexes. Workers
+# look for a newly published file every CATALOG_SNAPSHOT_CHECK_INTERVAL seconds.
+CATALOG_SNAPSHOT_PATH = os.environ.get('CATALOG_SNAPSHOT_PATH')
+CATALOG_SNAPSHOT_CHECK_INTERVAL = 5
+
+# Build the chatbot and catalog indexes and load all views when the WSGI/ASGI application
+# is created (testapp.warmup), instead of on the first requests that need them
+STARTUP_WARMUP = os.environ.get('STARTUP_WARMUP', '') == '1'
+
+REST_FRAMEWORK = {
+    # orjson-backed JSON when orjson is installed (testapp.renderers)
+    'DEFAULT_RENDERER_CLASSES': [
+        'testapp.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # Reverse proxies in front of the app. Only then is X-Forwarded-For used to find
+    # anonymous clients' IPs for rate limiting; otherwise REMOTE_ADDR is.
+    'NUM_PROXIES': int(os.environ['NUM_PROXIES']) if os.environ.get('NUM_PROXIES') else None,
+}
+
+# API responses of at least this many bytes are compressed with brotli (if installed)
+# or gzip, as negotiated with Accept-Encoding (testapp.middleware.CompressionMiddleware)
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_BROTLI_QUALITY = 4
+
+# WebSocket chat (testapp.websocket): client frames queued per socket before it stops
+# reading, and seconds without a client frame before the socket is closed
+WEBSOCKET_MAX_PENDING = 8
+WEBSOCKET_IDLE_TIMEOUT = 300
+
+# Admin changelists stop counting matching rows past this many and show
+# "More than N" instead; unfiltered PostgreSQL tables report the planner estimate
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Chat exports (testapp.export): rows fetched per database round trip and written per batch
+CHAT_EXPORT_CHUNK_SIZE = 2000
+
+# Query analytics (testapp.analytics): heavy hitters kept per kind (intent, query,
+# search term, category, zero-result query), count-min sketch size, seconds between
+# writes of the in-process counts to QueryStat, and the count a key needs within
+# one such window to be written
+QUERY_ANALYTICS = True
+QUERY_ANALYTICS_TOP_K = 200
+QUERY_ANALYTICS_SKETCH_WIDTH = 2048
+QUERY_ANALYTICS_SKETCH_DEPTH = 4
+QUERY_ANALYTICS_FLUSH_INTERVAL = 300
+QUERY_ANALYTICS_MIN_COUNT = 2
+# Warmup replays this many of the most frequent queries of the last PREWARM_DAYS days
+PREWARM_TOP_QUERIES = 50
+PREWARM_DAYS = 7
@@ -0,0 +1,75 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import UserSession
+from .tasks import defer, task
+
+
+class UserSessionRecorder:
+    """
+    Throttles session activity so each session is written to UserSession at
+    most once per `interval` seconds. The writes themselves are deferred to
+    the work queue, which applies them in bulk off the request path.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._last_recorded = {}
+        self._lock = threading.Lock()
+
+    def record(self, user_id, session_key, ip_address, user_agent):
+        key = hashlib.sha1(session_key.encode('utf-8')).hexdigest()
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_recorded.get(key, -self.interval) < self.interval:
+                return
+            if len(self._last_recorded) > 10000:
+                # Forget throttle state of idle sessions so the map stays bounded
+                cutoff = now - self.interval
+                self._last_recorded = {k: at for k, at in self._last_recorded.items() if at > cutoff}
+            self._last_recorded[key] = now
+
+        defer('record_user_sessions', {
+            'user_id': user_id,
+            'session_key': key,
+            'ip_address': ip_address,
+            'user_agent': user_agent[:1000],
+            'seen_at': timezone.now().isoformat(),
+        })
+
+
+user_session_recorder = UserSessionRecorder(settings.USER_SESSION_RECORD_INTERVAL)
+
+
+@task('record_user_sessions')
+def record_user_sessions(payloads):
+    pending = {payload['session_key']: payload for payload in payloads}
+    existing = {
+        session.session_key: session
+        for session in UserSession.objects.filter(session_key__in=pending.keys())
+    }
+    created = []
+    for key, payload in pending.items():
+        seen_at = parse_datetime(payload['seen_at'])
+        session = existing.get(key)
+        if session is None:
+            created.append(UserSession(
+                user_id=payload['user_id'],
+                session_key=key,
+                created_at=seen_at,
+                last_activity=seen_at,
+                ip_address=payload['ip_address'],
+                user_agent=payload['user_agent'],
+            ))
+        else:
+            session.last_activity = seen_at
+            session.ip_address = payload['ip_address']
+            session.user_agent = payload['user_agent']
+
+    UserSession.objects.bulk_update(existing.values(), ['last_activity', 'ip_address', 'user_agent'])
+    UserSession.objects.bulk_create(created, ignore_conflicts=True)
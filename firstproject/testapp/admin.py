@@ -1,32 +1,62 @@
 from django.contrib import admin
 from django.contrib.auth.models import User
-from .models import Product, ChatSession, ChatMessage, UserSession
+from .admin_paging import ScalableAdminMixin
+from .models import Product, ChatSession, ChatMessage, ChatArchive, UserSession, QueryStat
+
+# Large tables use keyset pages and bounded counts (admin_paging), and list
+# columns that touch related rows are loaded with list_select_related.
+# Search fields are exact matches, or product names, which have a trigram
+# index on PostgreSQL; free-text description search is left to the API.
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['name', 'category', 'price', 'stock', 'rating']
     list_filter = ['category']
-    search_fields = ['name', 'description']
+    search_fields = ['name']
 
 @admin.register(ChatSession)
-class ChatSessionAdmin(admin.ModelAdmin):
+class ChatSessionAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['session_id', 'user', 'created_at', 'updated_at', 'is_active']
-    list_filter = ['is_active', 'created_at']
-    search_fields = ['user__username', 'session_id']
+    list_filter = ['is_active']
+    list_select_related = ['user']
+    date_hierarchy = 'created_at'
+    search_fields = ['=user__username', '=session_id']
+    raw_id_fields = ['user']
 
 @admin.register(ChatMessage)
-class ChatMessageAdmin(admin.ModelAdmin):
+class ChatMessageAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['session', 'message_type', 'content_preview', 'timestamp']
-    list_filter = ['message_type', 'timestamp']
-    
+    list_filter = ['message_type']
+    list_select_related = ['session__user']
+    date_hierarchy = 'timestamp'
+    raw_id_fields = ['session', 'related_products']
+
     def content_preview(self, obj):
         return obj.content[:50] + "..." if len(obj.content) > 50 else obj.content
     content_preview.short_description = "Content Preview"
 
+@admin.register(ChatArchive)
+class ChatArchiveAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ['session', 'message_count', 'first_timestamp', 'last_timestamp', 'archived_at']
+    list_filter = ['archived_at']
+    list_select_related = ['session__user']
+    raw_id_fields = ['session']
+    exclude = ['payload']
+
 @admin.register(UserSession)
-class UserSessionAdmin(admin.ModelAdmin):
+class UserSessionAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['user', 'session_key', 'created_at', 'last_activity']
-    list_filter = ['created_at', 'last_activity']
-    search_fields = ['user__username']
+    list_filter = ['last_activity']
+    list_select_related = ['user']
+    date_hierarchy = 'created_at'
+    search_fields = ['=user__username']
+    raw_id_fields = ['user']
+
+@admin.register(QueryStat)
+class QueryStatAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ['kind', 'key', 'day', 'count']
+    list_filter = ['kind']
+    date_hierarchy = 'day'
+    search_fields = ['=key']
 
 # User model is already registered by default in Django admin
@@ -0,0 +1,111 @@
+from django.conf import settings
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# Query string parameter holding the primary key the next keyset page starts below
+AFTER_VAR = 'after'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts more than ADMIN_EXACT_COUNT_LIMIT rows. An
+    unfiltered list of a large PostgreSQL table reports the planner's row
+    estimate (pg_class.reltuples); other lists count up to the limit and
+    report "more than" it.
+    """
+    estimated = False
+    capped = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] > limit:
+                self.estimated = True
+                return int(row[0])
+
+        count = queryset.order_by()[:limit + 1].count()
+        if count > limit:
+            self.capped = True
+            return limit
+        return count
+
+
+class KeysetChangeList(ChangeList):
+    """
+    ChangeList that pages by primary key while the list is in its default
+    newest-first order: ?after=<pk> shows the rows below <pk>, an index range
+    scan that costs the same on every page where OFFSET gets slower the
+    deeper it goes. Lists sorted by a column fall back to numbered pages.
+    """
+    keyset = False
+    after = None
+    next_page_url = None
+    first_page_url = None
+
+    def __init__(self, request, *args, **kwargs):
+        super().__init__(request, *args, **kwargs)
+        # Filter, sort and date links built from params start again from the newest rows
+        self.params.pop(AFTER_VAR, None)
+        self.filter_params.pop(AFTER_VAR, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(AFTER_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        self.keyset = (
+            ORDER_VAR not in self.params
+            and not self.show_all
+            and list(self.model_admin.get_ordering(request)) == ['-pk']
+        )
+        if not self.keyset:
+            return super().get_results(request)
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        queryset = self.queryset
+        try:
+            self.after = int(request.GET[AFTER_VAR])
+        except (KeyError, ValueError):
+            self.after = None
+        if self.after is not None:
+            queryset = queryset.filter(pk__lt=self.after)
+
+        rows = list(queryset[:self.list_per_page + 1])
+        self.result_list = rows[:self.list_per_page]
+        if len(rows) > self.list_per_page:
+            self.next_page_url = self.get_query_string({AFTER_VAR: self.result_list[-1].pk})
+        if self.after is not None:
+            self.first_page_url = self.get_query_string(remove=[AFTER_VAR])
+
+        self.result_count = paginator.count
+        self.show_full_result_count = self.model_admin.show_full_result_count
+        self.full_result_count = self.root_queryset.count() if self.show_full_result_count else None
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = bool(self.next_page_url or self.first_page_url)
+        self.paginator = paginator
+
+
+class ScalableAdminMixin:
+    """
+    ModelAdmin defaults for tables too large to count or OFFSET through:
+    newest first, keyset pages, bounded counts
+    """
+    ordering = ['-pk']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
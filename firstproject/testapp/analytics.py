@@ -0,0 +1,261 @@
+import atexit
+import hashlib
+import logging
+import threading
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+
+from .models import QueryStat
+from .tasks import defer, task
+
+KINDS = [kind for kind, _ in QueryStat.KINDS]
+# Intents that ask for products; answering them with none counts as a zero-result query
+SEARCH_INTENTS = {'category', 'search', 'price', 'unknown'}
+MAX_KEY_LENGTH = QueryStat._meta.get_field('key').max_length
+
+logger = logging.getLogger(__name__)
+
+
+class CountMinSketch:
+    """
+    Approximate count of any key in `depth` rows of `width` counters. Each key
+    increments one counter per row and its estimate is the smallest of them,
+    so estimates never undercount and overcount by a few collisions at most.
+    """
+
+    def __init__(self, width, depth):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('Q', bytes(8 * width)) for _ in range(depth)]
+
+    def _columns(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        first = int.from_bytes(digest[:4], 'little')
+        step = int.from_bytes(digest[4:], 'little') | 1
+        return [(first + row * step) % self.width for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        """
+        Count `key` and return its new estimate
+        """
+        estimate = None
+        for row, column in zip(self.rows, self._columns(key)):
+            row[column] += count
+            if estimate is None or row[column] < estimate:
+                estimate = row[column]
+        return estimate
+
+    def estimate(self, key):
+        return min(row[column] for row, column in zip(self.rows, self._columns(key)))
+
+
+class HeavyHitters:
+    """
+    The `capacity` keys with the highest estimates offered so far. Once full,
+    a new key only displaces the smallest tracked one when its estimate is
+    higher, which for the long tail of rare keys is a single comparison.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        # Smallest tracked count when last computed; counts only grow, so it never overstates
+        self.floor = 0
+
+    def offer(self, key, estimate):
+        if key in self.counts:
+            self.counts[key] = estimate
+            return
+        if len(self.counts) >= self.capacity:
+            if estimate <= self.floor:
+                return
+            smallest = min(self.counts, key=self.counts.get)
+            if estimate <= self.counts[smallest]:
+                self.floor = self.counts[smallest]
+                return
+            del self.counts[smallest]
+        self.counts[key] = estimate
+        if len(self.counts) >= self.capacity:
+            self.floor = min(self.counts.values())
+
+    def top(self, limit=None):
+        """
+        [(key, count)], largest count first
+        """
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+class QueryObservation:
+    """
+    What the chatbot made of one message; ChatbotService fills it in while
+    answering and QueryAnalytics.record() counts it
+    """
+    __slots__ = ('query', 'intent', 'terms', 'categories')
+
+    def __init__(self, message):
+        self.query = ' '.join(message.lower().split())[:MAX_KEY_LENGTH]
+        self.intent = 'unknown'
+        self.terms = []
+        self.categories = []
+
+    def keys(self, products):
+        keys = [('intent', self.intent), ('query', self.query)]
+        keys += [('term', term[:MAX_KEY_LENGTH]) for term in self.terms]
+        keys += [('category', category) for category in self.categories]
+        if self.intent in SEARCH_INTENTS and not products:
+            keys.append(('zero_result', self.query))
+        return keys
+
+
+class QueryAnalytics:
+    """
+    Streaming counts of chatbot queries per kind in fixed memory: a
+    count-min sketch estimates how often any key was seen and HeavyHitters
+    keeps the keys with the highest estimates. Every `interval` seconds a
+    background thread hands the window's heavy hitters to the work queue to
+    be added to today's QueryStat rows, and a new window starts.
+    Keys seen fewer than `min_count` times in a window are not stored, so
+    one-off queries do not each become a row.
+    """
+
+    def __init__(self, top_k, width, depth, interval, min_count):
+        self.top_k = top_k
+        self.width = width
+        self.depth = depth
+        self.interval = interval
+        self.min_count = min_count
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self._start_window()
+
+    def _start_window(self):
+        self._window = {kind: (CountMinSketch(self.width, self.depth), HeavyHitters(self.top_k)) for kind in KINDS}
+
+    def record(self, observation, products, count=1):
+        """
+        Count `observation` as `count` messages that got `products`
+        """
+        if not settings.QUERY_ANALYTICS:
+            return
+        with self._lock:
+            for kind, key in observation.keys(products):
+                sketch, heavy_hitters = self._window[kind]
+                heavy_hitters.offer(key, sketch.add(key, count))
+            if self._thread is None and not self._stopped.is_set():
+                self._thread = threading.Thread(target=self._run, name='query-analytics', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to write query analytics")
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        """
+        Stop the background flushes; the current window is left unwritten
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def flush(self):
+        """
+        Write the current window now, e.g. at exit
+        """
+        with self._lock:
+            window = self._window
+            self._start_window()
+        self._write(window)
+
+    def _write(self, window):
+        counts = [
+            [kind, key, count]
+            for kind, (_, heavy_hitters) in window.items()
+            for key, count in heavy_hitters.top()
+            if count >= self.min_count
+        ]
+        if counts:
+            defer('record_query_stats', {'day': timezone.localdate().isoformat(), 'counts': counts})
+
+
+query_analytics = QueryAnalytics(
+    top_k=settings.QUERY_ANALYTICS_TOP_K,
+    width=settings.QUERY_ANALYTICS_SKETCH_WIDTH,
+    depth=settings.QUERY_ANALYTICS_SKETCH_DEPTH,
+    interval=settings.QUERY_ANALYTICS_FLUSH_INTERVAL,
+    min_count=settings.QUERY_ANALYTICS_MIN_COUNT,
+)
+atexit.register(query_analytics.flush)
+
+
+@task('record_query_stats')
+def record_query_stats(payloads):
+    totals = {}
+    for payload in payloads:
+        for kind, key, count in payload['counts']:
+            group = totals.setdefault((payload['day'], kind), {})
+            group[key] = group.get(key, 0) + count
+
+    QueryStat.objects.bulk_create([
+        QueryStat(day=day, kind=kind, key=key)
+        for (day, kind), counts in totals.items()
+        for key in counts
+    ], ignore_conflicts=True)
+    # Add in the database so concurrent writers never lose each other's counts
+    for (day, kind), counts in totals.items():
+        QueryStat.objects.filter(day=day, kind=kind, key__in=counts).update(count=F('count') + Case(
+            *[When(key=key, then=Value(count)) for key, count in counts.items()],
+            default=Value(0),
+        ))
+
+
+def heavy_hitters(kind, days, limit):
+    """
+    [(key, count)] of the most frequent `kind` keys over the last `days` days
+    """
+    since = timezone.localdate() - timedelta(days=days - 1)
+    return list(
+        QueryStat.objects.filter(kind=kind, day__gte=since)
+        .values_list('key')
+        .annotate(total=Sum('count'))
+        .order_by('-total', 'key')[:limit]
+    )
+
+
+def prewarm(limit=None, days=None):
+    """
+    Replay the most frequent recent queries through the chatbot, filling the
+    spelling, category and product card caches, and look up every typeahead
+    prefix of the top search terms. Returns (queries, prefixes) replayed.
+    """
+    from .chatbot_service import get_chatbot
+    from .suggest import suggest_index
+
+    limit = settings.PREWARM_TOP_QUERIES if limit is None else limit
+    days = days or settings.PREWARM_DAYS
+    if limit <= 0:
+        return 0, 0
+
+    chatbot = get_chatbot()
+    queries = heavy_hitters('query', days, limit)
+    for query, _ in queries:
+        chatbot.generate_response(query, track=False)
+
+    prefixes = {
+        term[:length]
+        for term, _ in heavy_hitters('term', days, limit)
+        for length in range(1, len(term) + 1)
+    }
+    for prefix in prefixes:
+        suggest_index.suggest(prefix)
+    return len(queries), len(prefixes)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class TestappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'testapp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        # Import modules that register deferred task handlers
+        from . import activity, analytics, tasks  # noqa: F401
@@ -0,0 +1,114 @@
+import json
+import zlib
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .caching import forget_chat_session
+from .models import ChatArchive, ChatMessage, ChatSession, Product
+
+
+def archivable_sessions(days):
+    """
+    Sessions untouched for `days` days that still have messages in the hot table
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    return ChatSession.objects.filter(updated_at__lt=cutoff, messages__isnull=False).distinct()
+
+
+def _dump_messages(messages):
+    rows = [
+        {
+            'id': message.pk,
+            'message_type': message.message_type,
+            'content': message.content,
+            'timestamp': message.timestamp.isoformat(),
+            'related_products': [product.pk for product in message.related_products.all()],
+            'product_snapshot': message.product_snapshot,
+        }
+        for message in messages
+    ]
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def _load_messages(payload):
+    return json.loads(zlib.decompress(bytes(payload)).decode('utf-8'))
+
+
+def archive_session(session):
+    """
+    Move all messages of a session into a single compressed ChatArchive row.
+    Returns the number of messages archived.
+    """
+    with transaction.atomic():
+        messages = list(session.messages.order_by('timestamp', 'pk').prefetch_related('related_products'))
+        if not messages:
+            return 0
+
+        ChatArchive.objects.create(
+            session=session,
+            payload=_dump_messages(messages),
+            message_count=len(messages),
+            first_timestamp=messages[0].timestamp,
+            last_timestamp=messages[-1].timestamp,
+        )
+        # Deleting the messages also clears their related_products rows
+        ChatMessage.objects.filter(pk__in=[message.pk for message in messages]).delete()
+        ChatSession.objects.filter(pk=session.pk).update(is_archived=True)
+        session.is_archived = True
+    forget_chat_session(session)
+    return len(messages)
+
+
+def rehydrate_session(session):
+    """
+    Restore archived messages of a session into ChatMessage.
+    Returns the number of messages restored.
+
+    Concurrent calls for the same session (the frontend loads session detail
+    and messages at once) each try to clear is_archived with a conditional
+    UPDATE. Only the call whose UPDATE changed the row restores the
+    messages; the others see it already claimed and do nothing. The UPDATE
+    is the transaction's first statement, so it also takes SQLite's write
+    lock before any read.
+    """
+    if not session.is_archived:
+        return 0
+
+    Through = ChatMessage.related_products.through
+    restored = 0
+    with transaction.atomic():
+        claimed = ChatSession.objects.filter(pk=session.pk, is_archived=True).update(is_archived=False)
+        session.is_archived = False
+        forget_chat_session(session)
+        if claimed != 1:
+            return 0
+
+        for archive in ChatArchive.objects.filter(session_id=session.pk):
+            rows = _load_messages(archive.payload)
+            product_ids = {product_id for row in rows for product_id in row['related_products']}
+            # Products deleted since archiving are dropped from the restored messages
+            existing = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+            ChatMessage.objects.bulk_create([
+                ChatMessage(
+                    pk=row['id'],
+                    session=session,
+                    message_type=row['message_type'],
+                    content=row['content'],
+                    timestamp=parse_datetime(row['timestamp']),
+                    product_snapshot=row.get('product_snapshot'),
+                )
+                for row in rows
+            ])
+            Through.objects.bulk_create([
+                Through(chatmessage_id=row['id'], product_id=product_id)
+                for row in rows
+                for product_id in row['related_products']
+                if product_id in existing
+            ], ignore_conflicts=True)
+            restored += len(rows)
+
+        ChatArchive.objects.filter(session_id=session.pk).delete()
+    return restored
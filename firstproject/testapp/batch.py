@@ -0,0 +1,126 @@
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .chatbot_service import get_chatbot
+from .models import ChatMessage, ChatSession
+from .suggest import suggest_index
+
+
+def normalize_query(content):
+    """
+    Lowercase and collapse whitespace so equivalent messages share one bot
+    response. Only used to find duplicates; the chatbot answers the text as sent.
+    """
+    return ' '.join(content.lower().split())
+
+
+def process_chat_batch(user, items):
+    """
+    Answer many chat messages for one user in a single pass.
+
+    `items` is a list of dicts with `content` and an optional `session_id`.
+    Messages without a session go to one new session created for the batch.
+    Messages that differ only in case and spacing are answered once, from
+    the first one's text, though query analytics still counts every message.
+    All messages and product links are written with bulk inserts.
+    """
+    started = time.perf_counter()
+
+    requested_ids = {item['session_id'] for item in items if item.get('session_id')}
+    sessions = {
+        session.session_id: session
+        for session in ChatSession.objects.filter(user=user, session_id__in=requested_ids)
+    }
+
+    results = []
+    accepted = []
+    batch_session = None
+    for item in items:
+        session_id = item.get('session_id')
+        if session_id:
+            session = sessions.get(session_id)
+            if session is None:
+                results.append({'session_id': session_id, 'error': 'Session not found'})
+                continue
+        else:
+            if batch_session is None:
+                batch_session = ChatSession.objects.create(user=user, session_id=str(uuid.uuid4()))
+                sessions[batch_session.session_id] = batch_session
+            session = batch_session
+
+        result = {'session_id': session.session_id}
+        results.append(result)
+        accepted.append((session, item['content'], normalize_query(item['content']), result))
+
+    chatbot = get_chatbot()
+    query_counts = Counter(query for _, _, query, _ in accepted)
+    first_contents = {}
+    for _, content, query, _ in accepted:
+        first_contents.setdefault(query, content)
+    responses = {
+        query: chatbot.generate_response(first_contents[query], user, count=count)
+        for query, count in query_counts.items()
+    }
+    pairs = [(session, content, responses[query], result) for session, content, query, result in accepted]
+
+    _persist_pairs(pairs)
+
+    elapsed = time.perf_counter() - started
+    processed = len(pairs)
+    return {
+        'results': results,
+        'stats': {
+            'messages': processed,
+            'distinct_queries': len(responses),
+            'elapsed_ms': round(elapsed * 1000, 2),
+            'messages_per_sec': round(processed / elapsed, 1) if elapsed else None,
+        },
+    }
+
+
+def _persist_pairs(pairs):
+    if not pairs:
+        return
+
+    Through = ChatMessage.related_products.through
+    now = timezone.now()
+    snapshots = {}
+    messages = []
+    for index, (session, content, (bot_response, products), _) in enumerate(pairs):
+        # Spread timestamps by a microsecond so history keeps the submitted order
+        timestamp = now + timedelta(microseconds=2 * index)
+        snapshot = None
+        if settings.CHAT_PRODUCT_SNAPSHOTS:
+            key = id(products)
+            if key not in snapshots:
+                snapshots[key] = [product.snapshot(now) for product in products]
+            snapshot = snapshots[key]
+        messages.append(ChatMessage(session=session, message_type='user', content=content, timestamp=timestamp))
+        messages.append(ChatMessage(
+            session=session,
+            message_type='bot',
+            content=bot_response,
+            timestamp=timestamp + timedelta(microseconds=1),
+            product_snapshot=snapshot,
+        ))
+
+    with transaction.atomic():
+        ChatMessage.objects.bulk_create(messages, batch_size=500)
+        links = []
+        for index, (_, _, (_, products), result) in enumerate(pairs):
+            user_message, bot_message = messages[2 * index], messages[2 * index + 1]
+            result['user_message_id'] = user_message.pk
+            result['bot_message_id'] = bot_message.pk
+            result['response'] = bot_message.content
+            result['product_ids'] = [product.pk for product in products]
+            links.extend(Through(chatmessage_id=bot_message.pk, product_id=product.pk) for product in products)
+        Through.objects.bulk_create(links, batch_size=1000)
+        ChatSession.objects.filter(pk__in={session.pk for session, _, _, _ in pairs}).update(updated_at=now)
+
+    suggest_index.record_links([link.product_id for link in links])
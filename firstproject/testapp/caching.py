@@ -0,0 +1,111 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY, get_user
+from django.core.cache import cache
+
+from .models import ChatSession
+
+
+class TTLCache:
+    """
+    Small thread-safe per-process cache whose entries expire after `ttl` seconds.
+    The least recently used entry is evicted once `maxsize` is reached.
+    """
+
+    def __init__(self, ttl, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# user id -> (session auth hash, User)
+user_cache = TTLCache(settings.AUTH_USER_CACHE_TTL)
+
+
+def get_cached_user(request):
+    """
+    Same result as django.contrib.auth.get_user(), without a User query when the
+    session's user was resolved recently. The entry only matches while the
+    session carries the same auth hash, so a password change is picked up.
+    """
+    user_id = request.session.get(SESSION_KEY)
+    session_hash = request.session.get(HASH_SESSION_KEY)
+    if user_id and session_hash:
+        cached = user_cache.get(user_id)
+        if cached is not None and cached[0] == session_hash:
+            return cached[1]
+
+    user = get_user(request)
+    if user.is_authenticated:
+        # get_user() may have rotated the hash, so re-read it from the session
+        user_cache.set(request.session.get(SESSION_KEY), (request.session.get(HASH_SESSION_KEY), user))
+    return user
+
+
+def forget_user(user_id):
+    user_cache.pop(str(user_id))
+
+
+def _chat_session_key(user_id, session_id):
+    # session_id comes from the URL; hash it into a key every cache backend accepts
+    return f'chat_session:{user_id}:{hashlib.md5(session_id.encode("utf-8")).hexdigest()}'
+
+
+def get_chat_session(user, session_id):
+    """
+    Return the user's ChatSession with this session_id, or None if it does not
+    exist or belongs to someone else. Found sessions are kept in Django's
+    cache for CHAT_SESSION_CACHE_TTL seconds, so a hit needs no query.
+    Archiving, restoring, saving and deleting a session clear its entry
+    (forget_chat_session); updated_at may lag by up to the TTL.
+    """
+    key = _chat_session_key(user.pk, session_id)
+    session = cache.get(key)
+    if session is None:
+        try:
+            session = ChatSession.objects.get(session_id=session_id, user=user)
+        except ChatSession.DoesNotExist:
+            return None
+        cache.set(key, session, settings.CHAT_SESSION_CACHE_TTL)
+    session.user = user
+    return session
+
+
+def forget_chat_session(session):
+    cache.delete(_chat_session_key(session.user_id, session.session_id))
@@ -0,0 +1,93 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_version = 0
+_lock = threading.Lock()
+
+
+def catalog_version():
+    """
+    Counter bumped whenever a Product is saved or deleted in this process
+    """
+    return _version
+
+
+def catalog_changed():
+    global _version
+    with _lock:
+        _version += 1
+
+
+class BackgroundRefresh:
+    """
+    Runs `refresh` in a daemon thread, at most one run at a time. Indexes
+    past their maximum age use it to rebuild while requests keep reading the
+    current version.
+    """
+
+    def __init__(self, name, refresh):
+        self.name = name
+        self.refresh = refresh
+        self.thread = None
+        self._running = threading.Lock()
+
+    def start(self):
+        if not self._running.acquire(blocking=False):
+            return
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Failed to refresh %s", self.name)
+        finally:
+            close_old_connections()
+            self._running.release()
+
+
+class CatalogIndex:
+    """
+    Lazily built structure derived from the product catalog. It is built on
+    first use and rebuilt on the next use after a Product change in this
+    process. Every CATALOG_INDEX_MAX_AGE seconds it is also rebuilt in the
+    background to pick up changes made by other processes; lookups meanwhile
+    keep using the current version. Subclasses implement build().
+    """
+
+    def __init__(self):
+        self._value = None
+        self._version = None
+        self._built_at = 0
+        self._lock = threading.Lock()
+        self._refresh = BackgroundRefresh(f'{type(self).__name__}-refresh', self._refresh_expired)
+
+    def build(self):
+        raise NotImplementedError
+
+    def get(self):
+        if self._value is None or self._version != catalog_version():
+            with self._lock:
+                if self._value is None or self._version != catalog_version():
+                    self._rebuild()
+        elif time.monotonic() - self._built_at > settings.CATALOG_INDEX_MAX_AGE:
+            self._refresh.start()
+        return self._value
+
+    def _rebuild(self):
+        version = catalog_version()
+        self._value = self.build()
+        self._version = version
+        self._built_at = time.monotonic()
+
+    def _refresh_expired(self):
+        with self._lock:
+            if time.monotonic() - self._built_at > settings.CATALOG_INDEX_MAX_AGE:
+                self._rebuild()
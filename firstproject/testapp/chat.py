@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.utils import timezone
+
+from .chatbot_service import get_chatbot
+from .models import ChatMessage
+from .tasks import defer
+from .touches import session_touches
+
+
+def product_snapshot(products):
+    """
+    Product card snapshots to store on a bot message, or None when snapshots are disabled
+    """
+    if not settings.CHAT_PRODUCT_SNAPSHOTS:
+        return None
+    captured_at = timezone.now()
+    return [product.snapshot(captured_at) for product in products]
+
+
+def post_chat_message(session, user, content):
+    """
+    Store a user message and the bot's reply in `session`. Shared by the HTTP
+    and WebSocket chat transports. Returns (user_message, bot_message).
+    """
+    user_message = ChatMessage.objects.create(
+        session=session,
+        message_type='user',
+        content=content
+    )
+
+    bot_response, related_products = get_chatbot().generate_response(content, user)
+
+    bot_message = ChatMessage.objects.create(
+        session=session,
+        message_type='bot',
+        content=bot_response,
+        product_snapshot=product_snapshot(related_products)
+    )
+
+    # Link related products after the response; history is served from the snapshot
+    if related_products:
+        if bot_message.product_snapshot is None:
+            bot_message.related_products.set(related_products)
+        else:
+            defer('link_related_products', {
+                'message_id': bot_message.pk,
+                'product_ids': [product.pk for product in related_products],
+            })
+
+    session.updated_at = timezone.now()
+    session_touches.touch(session.pk, session.updated_at)
+    return user_message, bot_message
@@ -1,8 +1,89 @@
 import re
+import threading
 from django.db.models import Q
 from .models import Product
+from .analytics import QueryObservation, query_analytics
+from .catalog import CatalogIndex
+from .fuzzy import SpellingIndex
 import random
 
+# Category mappings for broader searches
+CATEGORY_MAPPINGS = {
+    'electronics': ['laptops', 'mobile-accessories'],
+    'technology': ['laptops', 'mobile-accessories'],
+    'tech': ['laptops', 'mobile-accessories'],
+    'computers': ['laptops'],
+    'mobile': ['mobile-accessories'],
+    'phones': ['mobile-accessories'],
+    'clothing': ['mens-shirts', 'mens-shoes'],
+    'fashion': ['mens-shirts', 'mens-shoes', 'mens-watches'],
+    'mens': ['mens-shirts', 'mens-shoes', 'mens-watches'],
+    'shoes': ['mens-shoes'],
+    'shirts': ['mens-shirts'],
+    'watches': ['mens-watches'],
+    'accessories': ['mobile-accessories', 'mens-watches'],
+    'home': ['furniture', 'home-decoration', 'kitchen-accessories'],
+    'kitchen': ['kitchen-accessories'],
+    'beauty': ['beauty', 'fragrances'],
+    'cosmetics': ['beauty', 'fragrances'],
+}
+
+STOP_WORDS = {'i', 'am', 'looking', 'for', 'find', 'search', 'show', 'me', 'can', 'you', 'the', 'a', 'an', 'and', 'or', 'but', 'want', 'need'}
+
+# Words the chatbot reacts to; spelling correction treats them as known words
+KEYWORDS = STOP_WORDS | set(CATEGORY_MAPPINGS) | {
+    'hello', 'greetings', 'goodbye', 'thanks', 'thank', 'help', 'assist', 'support',
+    'price', 'cost', 'cheap', 'expensive', 'budget', 'premium', 'under', 'between',
+    'products', 'product',
+}
+
+spelling_index = SpellingIndex(KEYWORDS)
+
+# Rendered markdown block per product id, stored with the updated_at it was
+# rendered from; saving a product bumps updated_at and the block is re-rendered.
+_product_cards = {}
+PRODUCT_CARD_CACHE_SIZE = 10000
+
+
+def render_product_card(product):
+    """
+    Return the markdown block for one product, rendering it only when the product changed
+    """
+    cached = _product_cards.get(product.pk)
+    if cached is not None and cached[0] == product.updated_at:
+        return cached[1]
+
+    if product.stock > 0:
+        stock_line = f"   Stock: {product.stock} available\n"
+    else:
+        stock_line = "   Status: Out of stock\n"
+    card = "".join([
+        f"🔸 **{product.name}**\n",
+        f"   Category: {product.category.replace('-', ' ').title()}\n",
+        f"   Price: ${product.price}\n",
+        f"   Rating: {product.rating}/5.0\n",
+        stock_line,
+        "\n",
+    ])
+
+    if len(_product_cards) >= PRODUCT_CARD_CACHE_SIZE:
+        _product_cards.clear()
+    _product_cards[product.pk] = (product.updated_at, card)
+    return card
+
+
+class ProductCategories(CatalogIndex):
+    """
+    Distinct product categories
+    """
+
+    def build(self):
+        return list(Product.objects.values_list('category', flat=True).distinct())
+
+
+product_categories = ProductCategories()
+
+
 class ChatbotService:
     def __init__(self):
         self.greetings = [
@@ -18,52 +99,49 @@ class ChatbotService:
         ]
         
         # Category mappings for broader searches
-        self.category_mappings = {
-            'electronics': ['laptops', 'mobile-accessories'],
-            'technology': ['laptops', 'mobile-accessories'],
-            'tech': ['laptops', 'mobile-accessories'],
-            'computers': ['laptops'],
-            'mobile': ['mobile-accessories'],
-            'phones': ['mobile-accessories'],
-            'clothing': ['mens-shirts', 'mens-shoes'],
-            'fashion': ['mens-shirts', 'mens-shoes', 'mens-watches'],
-            'mens': ['mens-shirts', 'mens-shoes', 'mens-watches'],
-            'shoes': ['mens-shoes'],
-            'shirts': ['mens-shirts'],
-            'watches': ['mens-watches'],
-            'accessories': ['mobile-accessories', 'mens-watches'],
-            'home': ['furniture', 'home-decoration', 'kitchen-accessories'],
-            'kitchen': ['kitchen-accessories'],
-            'beauty': ['beauty', 'fragrances'],
-            'cosmetics': ['beauty', 'fragrances'],
-        }
-
-    def generate_response(self, message, user=None):
-        """
-        Generate a response based on user message
+        self.category_mappings = CATEGORY_MAPPINGS
+
+    def generate_response(self, message, user=None, track=True, count=1):
         """
+        Generate a response based on user message. Unless `track` is False the
+        query is counted by query analytics, as `count` messages when one
+        response answers several identical ones.
+        """
+        observation = QueryObservation(message)
+        response, products = self._respond(message, observation)
+        if track:
+            query_analytics.record(observation, products, count)
+        return response, products
+
+    def _respond(self, message, observation):
         message_lower = message.lower().strip()
         
         # Handle greetings
         if any(greeting in message_lower for greeting in ['hello', 'hi', 'hey', 'greetings']):
+            observation.intent = 'greeting'
             return random.choice(self.greetings), []
         
         # Handle farewells
         if any(farewell in message_lower for farewell in ['bye', 'goodbye', 'thanks', 'thank you']):
+            observation.intent = 'farewell'
             return random.choice(self.farewells), []
         
         # Handle help requests
         if any(help_word in message_lower for help_word in ['help', 'assist', 'support']):
+            observation.intent = 'help'
             return self._get_help_response(), []
         
         # Handle product searches and category browsing (combined for better matching)
-        return self._handle_comprehensive_search(message)
+        return self._handle_comprehensive_search(message, observation)
 
-    def _handle_comprehensive_search(self, message):
+    def _handle_comprehensive_search(self, message, observation):
         """
         Handle both product searches and category browsing in one method
         """
-        message_lower = message.lower().strip()
+        # Typos ("laptpo", "shrits") are fixed against the catalog vocabulary for
+        # matching only; replies and analytics keep the user's own words
+        search_message = spelling_index.correct(message)
+        message_lower = search_message.lower().strip()
         
         # First, try to match category mappings
         matched_categories = []
@@ -72,8 +150,7 @@ class ChatbotService:
                 matched_categories.extend(specific_categories)
         
         # Also check for direct category matches
-        all_categories = Product.objects.values_list('category', flat=True).distinct()
-        for category in all_categories:
+        for category in self._get_categories():
             if category.lower() in message_lower or category.replace('-', ' ').lower() in message_lower:
                 matched_categories.append(category)
         
@@ -82,26 +159,35 @@ class ChatbotService:
         
         # If we found category matches, get products from those categories
         if matched_categories:
+            observation.intent = 'category'
+            observation.categories = matched_categories
             return self._get_products_by_categories(matched_categories, message_lower)
         
         # If no category matches, try general product search
         if any(search_word in message_lower for search_word in ['find', 'search', 'looking for', 'need', 'want', 'show me']):
-            return self._handle_product_search(message)
+            observation.intent = 'search'
+            return self._handle_product_search(message, search_message, observation)
         
         # Handle price-related queries
         if any(price_word in message_lower for price_word in ['price', 'cost', 'cheap', 'expensive', 'budget']):
-            return self._handle_price_query(message)
+            observation.intent = 'price'
+            return self._handle_price_query(search_message)
         
         # Try a general search as fallback
-        search_terms = self._extract_search_terms(message)
+        search_terms = self._extract_search_terms(search_message)
+        observation.terms = self._extract_search_terms(message)
         if search_terms:
             products = self._search_products(search_terms)
             if products:
+                observation.intent = 'search'
                 return self._format_product_response(products, f"I found products matching your search:")
         
         # Default response for unrecognized input
         return self._get_default_response(message), []
 
+    def _get_categories(self):
+        return product_categories.get()
+
     def _get_products_by_categories(self, categories, original_message):
         """
         Get products from specific categories
@@ -135,27 +221,17 @@ class ChatbotService:
         """
         Format product list into a response
         """
-        response = f"{intro_text}\n\n"
-        
-        for product in products:
-            response += f"🔸 **{product.name}**\n"
-            response += f"   Category: {product.category.replace('-', ' ').title()}\n"
-            response += f"   Price: ${product.price}\n"
-            response += f"   Rating: {product.rating}/5.0\n"
-            if product.stock > 0:
-                response += f"   Stock: {product.stock} available\n"
-            else:
-                response += f"   Status: Out of stock\n"
-            response += "\n"
-        
-        return response, list(products)
+        products = list(products)
+        response = "".join([f"{intro_text}\n\n", *map(render_product_card, products)])
+        return response, products
 
-    def _handle_product_search(self, message):
+    def _handle_product_search(self, message, search_message, observation):
         """
-        Handle product search queries
+        Handle product search queries; `search_message` is the spelling-corrected message
         """
         # Extract search terms from message
-        search_terms = self._extract_search_terms(message)
+        search_terms = self._extract_search_terms(search_message)
+        observation.terms = self._extract_search_terms(message)
         
         if not search_terms:
             return "I'd be happy to help you find products! Could you tell me what specific item you're looking for?", []
@@ -166,7 +242,7 @@ class ChatbotService:
         if products:
             return self._format_product_response(products[:6], f"I found {len(products)} product(s) matching your search:")
         else:
-            return f"I couldn't find any products matching '{' '.join(search_terms)}'. Try searching for electronics, clothing, beauty products, or furniture.", []
+            return f"I couldn't find any products matching '{' '.join(observation.terms)}'. Try searching for electronics, clothing, beauty products, or furniture.", []
 
     def _handle_price_query(self, message):
         """
@@ -197,9 +273,8 @@ class ChatbotService:
         Extract meaningful search terms from user message
         """
         # Remove common words and extract meaningful terms
-        stop_words = {'i', 'am', 'looking', 'for', 'find', 'search', 'show', 'me', 'can', 'you', 'the', 'a', 'an', 'and', 'or', 'but', 'want', 'need'}
         words = re.findall(r'\b\w+\b', message.lower())
-        search_terms = [word for word in words if word not in stop_words and len(word) > 2]
+        search_terms = [word for word in words if word not in STOP_WORDS and len(word) > 2]
         return search_terms
 
     def _search_products(self, search_terms):
@@ -244,4 +319,22 @@ Just type what you're looking for and I'll help you find it!"""
             "Let me help you find what you need! What are you shopping for today?",
             "I'd be happy to help you find products. What can I assist you with?",
         ]
-        return random.choice(responses)
\ No newline at end of file
+        return random.choice(responses)
+
+
+_chatbot = None
+_chatbot_lock = threading.Lock()
+
+
+def get_chatbot():
+    """
+    Shared ChatbotService, created on first use. The service keeps no
+    per-request state, so one instance serves every request in the process.
+    """
+    global _chatbot
+    if _chatbot is None:
+        # Threads serving the first requests together must not each build one
+        with _chatbot_lock:
+            if _chatbot is None:
+                _chatbot = ChatbotService()
+    return _chatbot
@@ -0,0 +1,61 @@
+"""
+Common English words that spelling correction must never rewrite. Catalog
+vocabulary is small, so a correctly spelled word such as "mother" or
+"please" is often within one or two edits of a product word ("other",
+"plate"); these words, and their inflections (see fuzzy.dictionary_forms),
+are taken as spelled the way the user meant them.
+"""
+
+ENGLISH_WORDS = frozenset("""
+able about above absolutely accept according account across act action actually add
+address adult after afternoon again against age ago agree air all allow almost alone
+along already also alternative although always amazing among amount anniversary
+another answer any anybody anyone anything anyway anywhere appear apply appreciate
+area around arrive article ask available average avoid away awesome baby back bad
+bag balance bank base basic beautiful because become bed been before begin behind
+believe below best better between big bigger birthday bit black blue body book both
+bottom box boy boyfriend brand bring brother brown budget build business busy buy
+buyer call came campus card care carry case cash catalog cause cell center certain
+chance change charge cheap check child children choice choose christmas city class
+classic clean clear close cold college color colour come comfortable common company
+compare complete condition consider contact continue cool correct cost could count
+country couple course cousin cover create credit current customer cut daily dark
+date daughter day dear decide deep default deliver delivery dentist describe design
+detail different difficult dinner direct discount do doctor does dollar done door
+double down dress drive during each early easy eight either else email end enough
+entire especially even evening event ever every everyone everything exact example
+excellent except exchange expect experience explain extra eye face fact fair family
+famous fancy far fast father favorite favourite feature feel few field fill final
+finally fine finish first fit five floor follow food foot forget form formal four
+free fresh friend from front full fun funny gave gender general get gift girl
+girlfriend give glad go good got grand grandfather grandmother great green group
+grow guess guy hair half hand handle happen happy hard has have he head hear heavy
+hello her here high him his hold holiday home honest hope hot hour house how however
+human hundred husband idea if important include income indeed inside instead
+interest interested into item its job just keep kid kind know lady large last late
+later least leave left less let letter level life light like likely line list little
+live long look lose lot love lovely low made main make man many market match matter
+may maybe mean meet member men message middle might mind minute miss model modern
+mom moment money month more morning most mother move much mum must my name near
+nearly need neighbor nephew never new next nice niece night nine no nobody none nor
+normal not nothing notice now number of off offer office often old older on once one
+only open option order other our out outside over own pack page pair parent part
+party pay people per perfect perhaps person personal pick piece place plain plan
+play please plenty plus point popular possible prefer present pretty probably
+problem provide purchase purpose put quality question quick quickly quite rather
+reach read ready real really reason receive recent recommend recommendation red
+regular relative remember reply request require rest return review rich right room
+round run safe said sale same save say school second see seem select sell send
+sense set seven several share she short should side similar simple since single
+sister six size small smart so some somebody someone something sometimes son soon
+sorry sort special spend sport spring start stay still stop store student style
+such suggest suggestion suitable summer sure surprise sweet take talk teacher teen
+teenager tell ten than thank that their them then there these they thing think this
+those though thought three through time tiny to today together told tomorrow too
+top total toward town travel tried true try turn twin two type uncle understand
+unit until up upon us use useful usual usually value very visit wait walk wall warm
+was way we wear wedding week weekend weight welcome well went were what whatever
+when where whether which while white who whole whom whose why wife will winter wish
+with within without woman women wonder wonderful word work world worth would write
+wrong year yellow yes yet young your yours
+""".split())
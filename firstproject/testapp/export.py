@@ -0,0 +1,311 @@
+import csv
+import datetime
+import io
+import json
+import random
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .archive import _load_messages
+from .models import ChatArchive, ChatMessage
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional dependency
+    pyarrow = None
+
+EXPORT_FORMATS = ('jsonl', 'csv', 'parquet')
+COLUMNS = ['id', 'session_id', 'user', 'message_type', 'content', 'timestamp', 'related_products', 'product_snapshot']
+CONTENT_TYPES = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+# Archives hold a whole session each, so far fewer of them are fetched per query
+ARCHIVES_PER_QUERY = 20
+
+
+def export_database():
+    """
+    Exports tolerate replication lag, so they read from a replica when one is configured
+    """
+    replicas = [alias for alias in settings.DATABASES if alias != 'default']
+    return random.choice(replicas) if replicas else 'default'
+
+
+def parse_export_time(value):
+    """
+    Datetime for a --start/--end style bound given as YYYY-MM-DD or an ISO
+    datetime; naive values are in the current time zone. Raises ValueError.
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date {value!r}, expected YYYY-MM-DD or an ISO datetime")
+        moment = datetime.datetime.combine(day, datetime.time())
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _apply_filters(queryset, prefix, start, end, user):
+    if start is not None:
+        queryset = queryset.filter(**{f'{prefix}__gte': start})
+    if end is not None:
+        queryset = queryset.filter(**{f'{prefix}__lt': end})
+    if user is not None:
+        queryset = queryset.filter(session__user__username=user)
+    return queryset
+
+
+def message_batches(start=None, end=None, user=None, message_type=None, after=0, chunk_size=None, using=None):
+    """
+    Yield (rows, cursor) for ChatMessage rows with a primary key above `after`,
+    in primary key order, `chunk_size` rows at a time. `cursor` is the last
+    primary key in `rows`; pass it back as `after` to resume. `start` is
+    inclusive and `end` exclusive.
+    """
+    chunk_size = chunk_size or settings.CHAT_EXPORT_CHUNK_SIZE
+    queryset = _apply_filters(ChatMessage.objects.using(using or export_database()), 'timestamp', start, end, user)
+    if message_type:
+        queryset = queryset.filter(message_type=message_type)
+    # values_list skips model instances; content stays compressed until str()
+    rows = queryset.filter(pk__gt=after).order_by('pk').values_list(
+        'pk', 'session__session_id', 'session__user__username', 'message_type',
+        'content', 'timestamp', 'product_snapshot',
+    ).iterator(chunk_size=chunk_size)
+
+    Through = ChatMessage.related_products.through
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        # Messages stored without a snapshot get their product ids from the M2M
+        # table, one query per chunk
+        linked = {}
+        unsnapshotted = [row[0] for row in chunk if row[6] is None and row[3] == 'bot']
+        if unsnapshotted:
+            links = Through.objects.using(queryset.db).filter(chatmessage_id__in=unsnapshotted)
+            for message_id, product_id in links.values_list('chatmessage_id', 'product_id'):
+                linked.setdefault(message_id, []).append(product_id)
+
+        yield [
+            {
+                'id': pk,
+                'session_id': session_id,
+                'user': username,
+                'message_type': kind,
+                'content': str(content),
+                'timestamp': timestamp,
+                'related_products': (
+                    linked.get(pk, []) if snapshot is None else [product['id'] for product in snapshot]
+                ),
+                'product_snapshot': snapshot,
+            }
+            for pk, session_id, username, kind, content, timestamp, snapshot in chunk
+        ], chunk[-1][0]
+
+
+def archive_batches(start=None, end=None, user=None, message_type=None, after=0, chunk_size=None, using=None):
+    """
+    Like message_batches, for messages moved into ChatArchive. Rows come in
+    archive order and `cursor` is the primary key of the last archive read.
+    """
+    chunk_size = chunk_size or settings.CHAT_EXPORT_CHUNK_SIZE
+    queryset = _apply_filters(ChatArchive.objects.using(using or export_database()), 'first_timestamp', None, end, user)
+    if start is not None:
+        queryset = queryset.filter(last_timestamp__gte=start)
+    archives = queryset.filter(pk__gt=after).order_by('pk').values_list(
+        'pk', 'session__session_id', 'session__user__username', 'payload',
+    ).iterator(chunk_size=ARCHIVES_PER_QUERY)
+
+    batch = []
+    for pk, session_id, username, payload in archives:
+        for message in _load_messages(payload):
+            timestamp = parse_datetime(message['timestamp'])
+            if (start is not None and timestamp < start) or (end is not None and timestamp >= end):
+                continue
+            if message_type and message['message_type'] != message_type:
+                continue
+            batch.append({
+                'id': message['id'],
+                'session_id': session_id,
+                'user': username,
+                'message_type': message['message_type'],
+                'content': message['content'],
+                'timestamp': timestamp,
+                'related_products': message['related_products'],
+                'product_snapshot': message.get('product_snapshot'),
+            })
+        # Archives are never split across batches, so the cursor is always exact
+        if len(batch) >= chunk_size:
+            yield batch, pk
+            batch = []
+    if batch:
+        yield batch, pk
+
+
+class JSONLWriter:
+    """
+    One JSON object per line
+    """
+
+    def __init__(self, stream, header=True):
+        self.stream = stream
+
+    def write(self, rows):
+        self.stream.write(''.join(
+            json.dumps({**row, 'timestamp': row['timestamp'].isoformat()}, ensure_ascii=False) + '\n'
+            for row in rows
+        ).encode('utf-8'))
+
+    def close(self):
+        pass
+
+
+class CSVWriter:
+    """
+    CSV with a header row; list and snapshot columns hold JSON
+    """
+
+    def __init__(self, stream, header=True):
+        self.stream = stream
+        if header:
+            self._write_lines([COLUMNS])
+
+    def _write_lines(self, lines):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(lines)
+        self.stream.write(buffer.getvalue().encode('utf-8'))
+
+    def write(self, rows):
+        self._write_lines(
+            [
+                row['id'], row['session_id'], row['user'], row['message_type'], row['content'],
+                row['timestamp'].isoformat(), json.dumps(row['related_products']),
+                '' if row['product_snapshot'] is None else json.dumps(row['product_snapshot']),
+            ]
+            for row in rows
+        )
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    """
+    Parquet file with one row group per batch (requires pyarrow). `stream`
+    may also be a path. The snapshot column holds JSON, since its fields vary
+    between messages.
+    """
+
+    def __init__(self, stream, header=True):
+        self.schema = pyarrow.schema([
+            ('id', pyarrow.int64()),
+            ('session_id', pyarrow.string()),
+            ('user', pyarrow.string()),
+            ('message_type', pyarrow.string()),
+            ('content', pyarrow.string()),
+            ('timestamp', pyarrow.timestamp('us', tz='UTC')),
+            ('related_products', pyarrow.list_(pyarrow.int64())),
+            ('product_snapshot', pyarrow.string()),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(stream, self.schema, compression='zstd')
+
+    def write(self, rows):
+        columns = {name: [row[name] for row in rows] for name in COLUMNS}
+        columns['product_snapshot'] = [
+            None if snapshot is None else json.dumps(snapshot) for snapshot in columns['product_snapshot']
+        ]
+        self.writer.write_table(pyarrow.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {'jsonl': JSONLWriter, 'csv': CSVWriter, 'parquet': ParquetWriter}
+
+
+def check_format(export_format):
+    """
+    Raise ImportError if `export_format` needs a library that is not installed
+    """
+    if export_format == 'parquet' and pyarrow is None:
+        raise ImportError("Parquet export requires pyarrow (pip install pyarrow)")
+
+
+def get_writer(export_format, stream, header=True):
+    """
+    Writer for `export_format` on a binary stream. `header` is False when
+    appending to an interrupted CSV export.
+    """
+    check_format(export_format)
+    return WRITERS[export_format](stream, header=header)
+
+
+class _Chunks:
+    """
+    Write-only stream that hands back what was written since the last drain()
+    """
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def stream_export(export_format, batches):
+    """
+    Encode (rows, cursor) batches for a streaming response, one chunk per batch
+    """
+    sink = _Chunks()
+    writer = get_writer(export_format, sink)
+    for rows, _cursor in batches:
+        writer.write(rows)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+async def astream_export(chunks):
+    """
+    Async iterator over the chunks of stream_export() for ASGI servers. Each
+    chunk is produced in the request's sync thread, where its database
+    connection lives, so the export is streamed instead of being collected
+    into a list first, as Django does with a sync iterator under ASGI.
+    """
+    produce = sync_to_async(next, thread_sensitive=True)
+    done = object()
+    try:
+        while True:
+            chunk = await produce(chunks, done)
+            if chunk is done:
+                return
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=True)()
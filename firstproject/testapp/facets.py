@@ -0,0 +1,79 @@
+from django.db.models import Count, Q
+
+from .catalog import CatalogIndex
+from .models import Product
+from .snapshot import catalog_snapshot
+
+# (label, lower bound inclusive, upper bound exclusive or None)
+PRICE_BUCKETS = [
+    ('Under $50', 0, 50),
+    ('$50 - $100', 50, 100),
+    ('$100 - $500', 100, 500),
+    ('$500 and up', 500, None),
+]
+
+# (label, minimum rating)
+RATING_BANDS = [
+    ('4.5 & up', 4.5),
+    ('4 & up', 4),
+    ('3 & up', 3),
+]
+
+
+def compute_facets(queryset):
+    """
+    Facet counts for a product queryset: one aggregate query for totals,
+    price buckets, rating bands and stock, and one grouped query for categories
+    """
+    aggregates = {
+        'total': Count('pk'),
+        'in_stock': Count('pk', filter=Q(stock__gt=0)),
+    }
+    for index, (_, low, high) in enumerate(PRICE_BUCKETS):
+        condition = Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        aggregates[f'price_{index}'] = Count('pk', filter=condition)
+    for index, (_, minimum) in enumerate(RATING_BANDS):
+        aggregates[f'rating_{index}'] = Count('pk', filter=Q(rating__gte=minimum))
+
+    totals = queryset.order_by().aggregate(**aggregates)
+    categories = queryset.order_by().values('category').annotate(count=Count('pk')).order_by('-count', 'category')
+
+    return {
+        'total': totals['total'],
+        'categories': [{'value': row['category'], 'count': row['count']} for row in categories],
+        'price': [
+            {'label': label, 'min': low, 'max': high, 'count': totals[f'price_{index}']}
+            for index, (label, low, high) in enumerate(PRICE_BUCKETS)
+        ],
+        'rating': [
+            {'label': label, 'min': minimum, 'count': totals[f'rating_{index}']}
+            for index, (label, minimum) in enumerate(RATING_BANDS)
+        ],
+        'stock': {
+            'in_stock': totals['in_stock'],
+            'out_of_stock': totals['total'] - totals['in_stock'],
+        },
+    }
+
+
+class CatalogFacets(CatalogIndex):
+    """
+    Precomputed facets for the unfiltered catalog, with and without the in-stock filter
+    """
+
+    def build(self):
+        products = Product.objects.all()
+        return {
+            False: compute_facets(products),
+            True: compute_facets(products.filter(stock__gt=0)),
+        }
+
+    def for_catalog(self, in_stock_only):
+        snapshot = catalog_snapshot.current()
+        facets = snapshot.facets if snapshot is not None else self.get()
+        return facets[bool(in_stock_only)]
+
+
+catalog_facets = CatalogFacets()
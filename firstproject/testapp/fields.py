@@ -0,0 +1,174 @@
+import struct
+import threading
+import time
+import zlib
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+# Stored values start with a one-byte format tag
+RAW = b'\x00'        # UTF-8 text, too short to be worth compressing
+ZLIB = b'\x01'       # zlib stream
+ZLIB_DICT = b'\x02'  # 4-byte CompressionDictionary id, then a zlib stream using that dictionary
+
+
+class DictionaryRegistry:
+    """
+    Per-process cache of CompressionDictionary rows. The active dictionary is
+    re-read every `refresh_interval` seconds so newly trained ones are picked up.
+    """
+
+    def __init__(self, refresh_interval=300):
+        self.refresh_interval = refresh_interval
+        self._by_id = {}
+        self._active = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _model(self):
+        return apps.get_model('testapp', 'CompressionDictionary')
+
+    def get(self, dictionary_id):
+        data = self._by_id.get(dictionary_id)
+        if data is None:
+            data = bytes(self._model().objects.get(pk=dictionary_id).data)
+            self._by_id[dictionary_id] = data
+        return data
+
+    def active(self):
+        """
+        Return (id, data) of the active dictionary, or None
+        """
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at > self.refresh_interval:
+            with self._lock:
+                row = self._model().objects.filter(is_active=True).order_by('-pk').first()
+                self._active = (row.pk, bytes(row.data)) if row else None
+                if row:
+                    self._by_id[row.pk] = self._active[1]
+                self._checked_at = now
+        return self._active
+
+    def reset(self):
+        self._active = None
+        self._checked_at = None
+
+
+dictionaries = DictionaryRegistry()
+
+
+_ACTIVE = object()
+
+
+def compress_text(text, dictionary=_ACTIVE):
+    """
+    Encode text for a CompressedTextField. `dictionary` is an (id, data) pair
+    or None for plain zlib; by default the active trained dictionary is used
+    when there is one.
+    """
+    raw = text.encode('utf-8')
+    if len(raw) < settings.COMPRESSED_TEXT_MIN_LENGTH:
+        return RAW + raw
+
+    if dictionary is _ACTIVE:
+        dictionary = dictionaries.active()
+    if dictionary is not None:
+        dictionary_id, zdict = dictionary
+        compressor = zlib.compressobj(settings.COMPRESSED_TEXT_LEVEL, zdict=zdict)
+        encoded = ZLIB_DICT + struct.pack('>I', dictionary_id) + compressor.compress(raw) + compressor.flush()
+    else:
+        encoded = ZLIB + zlib.compress(raw, settings.COMPRESSED_TEXT_LEVEL)
+
+    # Incompressible text is cheaper to store and read as-is
+    return encoded if len(encoded) < len(raw) + 1 else RAW + raw
+
+
+def decompress_text(value):
+    """
+    Decode a stored CompressedTextField value back to text. Values written
+    before the column held compressed bytes (text, or untagged UTF-8 bytes)
+    are returned as they are.
+    """
+    if isinstance(value, str):
+        return value
+    value = bytes(value)
+    tag = value[:1]
+    if tag == RAW:
+        return value[1:].decode('utf-8')
+    if tag == ZLIB:
+        return zlib.decompress(value[1:]).decode('utf-8')
+    if tag == ZLIB_DICT:
+        (dictionary_id,) = struct.unpack('>I', value[1:5])
+        decompressor = zlib.decompressobj(zdict=dictionaries.get(dictionary_id))
+        return (decompressor.decompress(value[5:]) + decompressor.flush()).decode('utf-8')
+    # Text never starts with the control characters used as tags
+    return value.decode('utf-8')
+
+
+class CompressedText:
+    """
+    Undecoded value loaded from the database. Model instances decode it on
+    first attribute access; values()/values_list() return it as-is and
+    str() decodes it.
+    """
+    __slots__ = ('raw',)
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def __str__(self):
+        return decompress_text(self.raw)
+
+    def __len__(self):
+        return len(self.raw)
+
+
+class CompressedTextDescriptor(DeferredAttribute):
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, CompressedText):
+            value = decompress_text(value.raw)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.TextField):
+    """
+    TextField stored as compressed bytes in a binary column. Text is written
+    with zlib (using the active trained dictionary, if any) and decompressed
+    lazily the first time the attribute is read. Substring lookups such as
+    icontains do not work on the stored bytes.
+    """
+    descriptor_class = CompressedTextDescriptor
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return CompressedText(value)
+
+    def to_python(self, value):
+        if isinstance(value, CompressedText):
+            return decompress_text(value.raw)
+        return super().to_python(value)
+
+    def get_prep_value(self, value):
+        value = self.to_python(value)
+        if value is None:
+            return None
+        return compress_text(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if value is not None:
+            return connection.Database.Binary(value)
+        return value
@@ -0,0 +1,173 @@
+import re
+from collections import Counter, defaultdict
+
+from .catalog import CatalogIndex
+from .english_words import ENGLISH_WORDS
+from .models import Product
+from .snapshot import catalog_snapshot
+
+WORD_RE = re.compile(r'\b\w+\b')
+# Inflection endings stripped to find a word's dictionary form, longest first
+SUFFIXES = ('ies', 'est', 'ing', 'es', 'er', 'ed', 'ly', 's')
+
+
+def dictionary_forms(word):
+    """
+    `word` and the forms it may be an inflection of: "options" -> "option",
+    "cheaper" -> "cheap", "nicer" -> "nice", "bigger" -> "big", "stories" -> "story"
+    """
+    forms = {word}
+    for suffix in SUFFIXES:
+        if not word.endswith(suffix) or len(word) - len(suffix) < 2:
+            continue
+        stem = word[:-len(suffix)]
+        forms.update((stem, stem + 'e'))
+        if suffix == 'ies':
+            forms.add(stem + 'y')
+        if len(stem) > 2 and stem[-1] == stem[-2]:
+            forms.add(stem[:-1])
+    return forms
+
+
+def osa_distance(a, b, max_distance):
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent
+    transpositions), or max_distance + 1 once it is known to be larger
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class SymSpell:
+    """
+    Symmetric-delete spelling corrector. Every vocabulary word is indexed under
+    all strings reachable by deleting up to `max_distance` characters from its
+    first `prefix_length` characters. A lookup generates the same deletes for
+    the query, so candidates are found with dictionary lookups instead of
+    comparing against the whole vocabulary.
+    """
+
+    def __init__(self, word_counts, max_distance=2, prefix_length=7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.words = dict(word_counts)
+        self.deletes = defaultdict(set)
+        for word in self.words:
+            for variant in self._deletes(word[:prefix_length]):
+                self.deletes[variant].add(word)
+
+    @classmethod
+    def from_tables(cls, words, deletes, max_distance, prefix_length):
+        """
+        Corrector over prebuilt vocabulary and delete tables, such as those of a catalog snapshot
+        """
+        instance = cls.__new__(cls)
+        instance.max_distance = max_distance
+        instance.prefix_length = prefix_length
+        instance.words = words
+        instance.deletes = deletes
+        return instance
+
+    def _deletes(self, word):
+        variants = {word}
+        frontier = {word}
+        for _ in range(self.max_distance):
+            frontier = {item[:i] + item[i + 1:] for item in frontier for i in range(len(item))}
+            variants |= frontier
+        return variants
+
+    def lookup(self, term, max_distance=None):
+        """
+        Return the closest vocabulary word to `term` (most frequent on ties), or None
+        """
+        if term in self.words:
+            return term
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+
+        best = None
+        best_key = None
+        candidates = set()
+        for variant in self._deletes(term[:self.prefix_length]):
+            candidates.update(self.deletes.get(variant, ()))
+        for candidate in candidates:
+            distance = osa_distance(term, candidate, max_distance)
+            if distance > max_distance:
+                continue
+            key = (distance, -self.words[candidate])
+            if best_key is None or key < best_key:
+                best, best_key = candidate, key
+        return best
+
+
+class SpellingIndex(CatalogIndex):
+    """
+    SymSpell index over words from product names, descriptions and categories,
+    plus words the chatbot itself understands
+    """
+
+    def __init__(self, known_words, dictionary_words=ENGLISH_WORDS):
+        super().__init__()
+        self.known_words = set(known_words)
+        # Correctly spelled words that are never corrected, even when close to a catalog word
+        self.dictionary_words = self.known_words | set(dictionary_words)
+        self._snapshot_index = (None, None)
+
+    def build(self):
+        counts = Counter()
+        for name, description, category in Product.objects.values_list('name', 'description', 'category'):
+            counts.update(WORD_RE.findall(name.lower()))
+            counts.update(WORD_RE.findall(description.lower()))
+            counts.update(category.lower().split('-'))
+        for word in self.known_words:
+            counts[word] += 1
+        return SymSpell({word: count for word, count in counts.items() if not word.isdigit()})
+
+    def get(self):
+        snapshot = catalog_snapshot.current()
+        if snapshot is None:
+            return super().get()
+        if self._snapshot_index[0] is not snapshot:
+            self._snapshot_index = (snapshot, SymSpell.from_tables(
+                snapshot.words, snapshot.deletes, snapshot.spelling_max_distance, snapshot.spelling_prefix_length
+            ))
+        return self._snapshot_index[1]
+
+    def is_known(self, word, index):
+        """
+        Whether `word`, or a form it is an inflection of, is a catalog or dictionary word
+        """
+        return any(form in index.words or form in self.dictionary_words for form in dictionary_forms(word))
+
+    def correct(self, text):
+        """
+        Replace misspelled words in `text` with their closest catalog word,
+        keeping everything else as written. Only words that are neither
+        catalog words nor dictionary words are corrected; short words and
+        words containing digits are left alone.
+        """
+        index = self.get()
+
+        def replace(match):
+            word = match.group(0)
+            if len(word) < 4 or any(char.isdigit() for char in word):
+                return word
+            lowered = word.lower()
+            if self.is_known(lowered, index):
+                return word
+            # One typo allowed in short words, two in longer ones
+            return index.lookup(lowered, 1 if len(word) < 6 else 2) or word
+
+        return WORD_RE.sub(replace, text)
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from testapp.archive import archivable_sessions, archive_session
+
+
+class Command(BaseCommand):
+    help = "Move messages of sessions inactive for N days into compressed ChatArchive rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90,
+                            help="Archive sessions not updated for this many days (default: 90)")
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Number of sessions loaded per batch (default: 100)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many sessions would be archived")
+
+    def handle(self, *args, **options):
+        sessions = archivable_sessions(options['days'])
+
+        if options['dry_run']:
+            self.stdout.write(f"{sessions.count()} session(s) would be archived")
+            return
+
+        archived_sessions = archived_messages = 0
+        last_pk = 0
+        while True:
+            # Walk sessions by primary key so each batch is a cheap index range
+            batch = list(sessions.filter(pk__gt=last_pk).order_by('pk')[:options['batch_size']])
+            if not batch:
+                break
+            for session in batch:
+                archived_messages += archive_session(session)
+                archived_sessions += 1
+            last_pk = batch[-1].pk
+            self.stdout.write(f"Archived {archived_sessions} session(s), {archived_messages} message(s) so far")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived_messages} message(s) from {archived_sessions} session(s)"
+        ))
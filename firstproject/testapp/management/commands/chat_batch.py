@@ -0,0 +1,94 @@
+import json
+import sys
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from testapp.batch import process_chat_batch
+from testapp.models import ChatSession
+
+
+class Command(BaseCommand):
+    help = (
+        "Answer chat messages in bulk. Input is JSONL with {\"content\": ..., \"session_id\": ...} "
+        "objects or one plain-text message per line."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', nargs='?', default='-',
+                            help="Input file, or - for stdin (default)")
+        parser.add_argument('--user', required=True, help="Username the messages are sent as")
+        parser.add_argument('--session-id',
+                            help="Session for lines that do not name one (default: a new session)")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Messages processed per batch (default: 1000)")
+        parser.add_argument('--output', help="Write one JSON result per message to this file")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['user']}' does not exist")
+
+        session_id = options['session_id']
+        if not session_id:
+            session_id = ChatSession.objects.create(user=user, session_id=str(uuid.uuid4())).session_id
+
+        source = sys.stdin if options['input'] == '-' else open(options['input'], encoding='utf-8')
+        output = open(options['output'], 'w', encoding='utf-8') if options['output'] else None
+
+        total = 0
+        started = time.perf_counter()
+        try:
+            chunk = []
+            for line in source:
+                item = self._parse_line(line, session_id)
+                if item is None:
+                    continue
+                chunk.append(item)
+                if len(chunk) >= options['chunk_size']:
+                    total += self._run(user, chunk, output)
+                    chunk = []
+            if chunk:
+                total += self._run(user, chunk, output)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if output:
+                output.close()
+
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {total} message(s) in {elapsed:.2f}s: {rate:.1f} messages/sec"
+        ))
+
+    def _parse_line(self, line, default_session_id):
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            item = json.loads(line)
+        except ValueError:
+            item = None
+        if not isinstance(item, dict):
+            item = {'content': line}
+        if not item.get('content'):
+            return None
+        if not item.get('session_id'):
+            item['session_id'] = default_session_id
+        return item
+
+    def _run(self, user, chunk, output):
+        result = process_chat_batch(user, chunk)
+        stats = result['stats']
+        if output:
+            for row in result['results']:
+                output.write(json.dumps(row) + '\n')
+        self.stdout.write(
+            f"Chunk of {stats['messages']} message(s), {stats['distinct_queries']} distinct: "
+            f"{stats['messages_per_sec']} messages/sec"
+        )
+        return stats['messages']
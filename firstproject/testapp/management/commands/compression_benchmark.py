@@ -0,0 +1,56 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from testapp.fields import compress_text, decompress_text, dictionaries
+from testapp.models import ChatMessage
+
+
+class Command(BaseCommand):
+    help = "Compare stored size and encode/decode throughput of message content: raw, zlib, zlib + dictionary"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=5000,
+                            help="Number of recent messages to measure (default: 5000)")
+
+    def handle(self, *args, **options):
+        texts = [
+            message.content
+            for message in ChatMessage.objects.order_by('-pk').only('content')[:options['sample']]
+        ]
+        if not texts:
+            self.stdout.write("No messages to measure")
+            return
+
+        raw_size = sum(len(text.encode('utf-8')) for text in texts)
+        megabytes = raw_size / 1e6
+        self.stdout.write(f"{len(texts)} message(s), {raw_size} bytes of text, "
+                          f"min length {settings.COMPRESSED_TEXT_MIN_LENGTH}, level {settings.COMPRESSED_TEXT_LEVEL}")
+        self.stdout.write(f"{'format':<18}{'bytes':>12}{'ratio':>8}{'encode MB/s':>14}{'decode MB/s':>14}")
+        self.stdout.write(f"{'raw':<18}{raw_size:>12}{1:>8.2f}{'-':>14}{'-':>14}")
+
+        variants = [('zlib', lambda text: compress_text(text, None))]
+        active = dictionaries.active()
+        if active:
+            variants.append((f'zlib + dict {active[0]}', lambda text: compress_text(text, active)))
+
+        for name, encode in variants:
+            started = time.perf_counter()
+            encoded = [encode(text) for text in texts]
+            encode_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for value in encoded:
+                decompress_text(value)
+            decode_time = time.perf_counter() - started
+
+            size = sum(len(value) for value in encoded)
+            self.stdout.write(
+                f"{name:<18}{size:>12}{raw_size / size:>8.2f}"
+                f"{megabytes / encode_time:>14.1f}{megabytes / decode_time:>14.1f}"
+            )
+
+        if not active:
+            self.stdout.write("No trained dictionary yet; run `manage.py train_compression_dictionary` to compare one.")
+
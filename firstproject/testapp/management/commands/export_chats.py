@@ -0,0 +1,156 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from testapp.export import (
+    EXPORT_FORMATS, archive_batches, check_format, export_database, get_writer, message_batches,
+    parse_export_time,
+)
+from testapp.models import ChatMessage
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream chat messages to a JSONL or CSV file, or a directory of Parquet files, "
+        "in constant memory. With --cursor an interrupted export resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', required=True,
+                            help="File to write; for parquet, a directory of part-NNNNN.parquet files")
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl', help="Output format (default: jsonl)")
+        parser.add_argument('--start', help="Only messages at or after this date/datetime")
+        parser.add_argument('--end', help="Only messages before this date/datetime")
+        parser.add_argument('--user', help="Only sessions of this username")
+        parser.add_argument('--message-type', choices=[kind for kind, _ in ChatMessage.MESSAGE_TYPES])
+        parser.add_argument('--archived', action='store_true',
+                            help="Export messages stored in ChatArchive instead of the ChatMessage table")
+        parser.add_argument('--cursor',
+                            help="Progress file, updated after every written batch. If it exists the export resumes "
+                                 "from it; running again after completion appends messages added since.")
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help="Rows per query and per written batch (default: settings.CHAT_EXPORT_CHUNK_SIZE)")
+        parser.add_argument('--rows-per-file', type=int, default=1000000,
+                            help="Rows per Parquet part file (default: 1000000)")
+        parser.add_argument('--database', default=None,
+                            help="Database alias to read from (default: a replica if configured, else default)")
+
+    def handle(self, *args, **options):
+        try:
+            check_format(options['format'])
+        except ImportError as exc:
+            raise CommandError(str(exc))
+        try:
+            filters = {
+                'start': parse_export_time(options['start']) if options['start'] else None,
+                'end': parse_export_time(options['end']) if options['end'] else None,
+                'user': options['user'],
+                'message_type': options['message_type'],
+            }
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        # Everything that must match for a cursor file to be resumed
+        job = {
+            'source': 'archives' if options['archived'] else 'messages',
+            'format': options['format'],
+            'output': os.path.abspath(options['output']),
+            'filters': {
+                name: value.isoformat() if hasattr(value, 'isoformat') else value
+                for name, value in filters.items()
+            },
+        }
+        state = {'after': 0, 'rows': 0, 'size': 0, 'part': 0}
+        if options['cursor'] and os.path.exists(options['cursor']):
+            with open(options['cursor']) as f:
+                saved = json.load(f)
+            if saved['job'] != job:
+                raise CommandError(
+                    f"{options['cursor']} belongs to a different export: {saved['job']}. "
+                    f"Use a new cursor file or the same options."
+                )
+            state = saved['state']
+            self.stdout.write(f"Resuming after id {state['after']} ({state['rows']} row(s) already written)")
+
+        batches = (archive_batches if options['archived'] else message_batches)(
+            after=state['after'],
+            chunk_size=options['chunk_size'],
+            using=options['database'] or export_database(),
+            **filters,
+        )
+
+        started = time.perf_counter()
+        if options['format'] == 'parquet':
+            written = self._export_parquet(batches, state, job, options)
+        else:
+            written = self._export_file(batches, state, job, options)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {written} message(s) to {options['output']} in {elapsed:.1f}s "
+            f"({state['rows']} in total, last cursor {state['after']})"
+        ))
+
+    def _export_file(self, batches, state, job, options):
+        path = options['output']
+        if state['size'] and not os.path.exists(path):
+            raise CommandError(f"{path} is missing; it cannot be resumed")
+        with open(path, 'r+b' if state['size'] else 'wb') as stream:
+            # Drop anything written after the last checkpoint
+            stream.truncate(state['size'])
+            stream.seek(state['size'])
+            writer = get_writer(options['format'], stream, header=not state['size'])
+            written = 0
+            for rows, cursor in batches:
+                writer.write(rows)
+                stream.flush()
+                os.fsync(stream.fileno())
+                written += len(rows)
+                state.update(after=cursor, rows=state['rows'] + len(rows), size=stream.tell())
+                self._checkpoint(job, state, options)
+            writer.close()
+            if not state['size']:
+                # Nothing exported: keep the CSV header
+                state['size'] = stream.tell()
+                self._checkpoint(job, state, options)
+        return written
+
+    def _export_parquet(self, batches, state, job, options):
+        if os.path.isfile(options['output']):
+            raise CommandError(f"{options['output']} is a file; parquet output is a directory")
+        os.makedirs(options['output'], exist_ok=True)
+        writer = None
+        written = part_rows = 0
+        for rows, cursor in batches:
+            if writer is None:
+                # A part left unfinished by an interrupted run is overwritten
+                part_path = os.path.join(options['output'], f"part-{state['part']:05d}.parquet")
+                writer = get_writer('parquet', part_path)
+            writer.write(rows)
+            written += len(rows)
+            part_rows += len(rows)
+            if part_rows >= options['rows_per_file']:
+                writer.close()
+                writer = None
+                state.update(after=cursor, rows=state['rows'] + part_rows, part=state['part'] + 1)
+                part_rows = 0
+                self._checkpoint(job, state, options)
+        if writer is not None:
+            writer.close()
+            state.update(after=cursor, rows=state['rows'] + part_rows, part=state['part'] + 1)
+            self._checkpoint(job, state, options)
+        return written
+
+    def _checkpoint(self, job, state, options):
+        if options['verbosity'] > 1:
+            self.stdout.write(f"  {state['rows']} row(s), cursor {state['after']}")
+        if not options['cursor']:
+            return
+        temporary = f"{options['cursor']}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump({'job': job, 'state': state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, options['cursor'])
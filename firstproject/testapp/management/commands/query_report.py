@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from testapp.analytics import heavy_hitters
+from testapp.models import QueryStat
+
+SECTIONS = [
+    ('query', "Top queries"),
+    ('zero_result', "Zero-result queries"),
+    ('term', "Top search terms"),
+    ('category', "Top categories"),
+    ('intent', "Intents"),
+]
+
+
+class Command(BaseCommand):
+    help = "List the most frequent chatbot queries, search terms, categories and zero-result queries recorded by query analytics"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help="Days to include, today included (default: 7)")
+        parser.add_argument('--limit', type=int, default=20, help="Rows per section (default: 20)")
+        parser.add_argument('--kind', choices=[kind for kind, _ in QueryStat.KINDS], help="Only this section")
+
+    def handle(self, *args, **options):
+        # Every message has exactly one intent, so intent counts add up to the messages seen
+        total = sum(count for _, count in heavy_hitters('intent', options['days'], None))
+        self.stdout.write(f"{total} message(s) in the last {options['days']} day(s)")
+
+        for kind, title in SECTIONS:
+            if options['kind'] and kind != options['kind']:
+                continue
+            rows = heavy_hitters(kind, options['days'], options['limit'])
+            self.stdout.write('')
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            if not rows:
+                self.stdout.write("  (none)")
+            for key, count in rows:
+                share = f"{count / total:6.1%}" if total else ''
+                self.stdout.write(f"  {count:>8}  {share}  {key}")
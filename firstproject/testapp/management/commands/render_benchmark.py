@@ -0,0 +1,66 @@
+import gzip
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from rest_framework.renderers import JSONRenderer
+
+from testapp.middleware import brotli
+from testapp.models import ChatSession, Product
+from testapp.renderers import FastJSONRenderer, orjson
+from testapp.serializers import ChatMessageSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare serialization, JSON rendering and compressed size for the chat history and product list responses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50,
+                            help="Renders per measurement; the mean is reported (default: 50)")
+        parser.add_argument('--session-id',
+                            help="Chat session to render (default: the one with the most messages)")
+
+    def handle(self, *args, **options):
+        if options['session_id']:
+            session = ChatSession.objects.filter(session_id=options['session_id']).first()
+        else:
+            session = ChatSession.objects.annotate(count=Count('messages')).order_by('-count').first()
+        if session is None:
+            raise CommandError("No chat session to render")
+
+        payloads = [
+            (f'messages ({session.session_id[:8]})', lambda: ChatMessageSerializer(session.messages.all(), many=True).data),
+            ('products', lambda: ProductSerializer(Product.objects.all(), many=True).data),
+        ]
+        renderers = [('drf json', JSONRenderer())]
+        if orjson is not None:
+            renderers.append(('fast json', FastJSONRenderer()))
+        else:
+            self.stdout.write("orjson is not installed; FastJSONRenderer falls back to the DRF renderer")
+        iterations = options['iterations']
+
+        self.stdout.write(
+            f"{'endpoint':<22}{'serialize ms':>13}{'renderer':>11}{'render ms':>11}"
+            f"{'bytes':>9}{'gzip':>8}{'brotli':>8}"
+        )
+        for name, serialize in payloads:
+            started = time.perf_counter()
+            for _ in range(iterations):
+                data = serialize()
+            serialize_ms = (time.perf_counter() - started) * 1000 / iterations
+
+            for renderer_name, renderer in renderers:
+                started = time.perf_counter()
+                for _ in range(iterations):
+                    content = renderer.render(data)
+                render_ms = (time.perf_counter() - started) * 1000 / iterations
+
+                gzip_size = len(gzip.compress(content, compresslevel=6))
+                brotli_size = len(brotli.compress(content, quality=settings.COMPRESSION_BROTLI_QUALITY)) if brotli else '-'
+                self.stdout.write(
+                    f"{name:<22}{serialize_ms:>13.2f}{renderer_name:>11}{render_ms:>11.3f}"
+                    f"{len(content):>9}{gzip_size:>8}{brotli_size:>8}"
+                )
+
+        self.stdout.write(f"Responses of at least {settings.COMPRESSION_MIN_SIZE} bytes are compressed when the client accepts it.")
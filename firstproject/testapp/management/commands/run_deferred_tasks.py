@@ -0,0 +1,82 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from testapp.models import DeferredTask
+from testapp.tasks import run_tasks
+
+
+def claim_tasks(batch_size, max_attempts, lease):
+    """
+    Claim up to `batch_size` runnable tasks for `lease` seconds and return
+    them. The claim is a conditional UPDATE, so when several runners pick the
+    same rows each row goes to exactly one of them.
+    """
+    now = timezone.now()
+    free = Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)
+    candidates = list(
+        DeferredTask.objects.filter(free, attempts__lt=max_attempts).values_list('pk', flat=True)[:batch_size]
+    )
+    if not candidates:
+        return '', []
+    claim = uuid.uuid4().hex
+    DeferredTask.objects.filter(free, pk__in=candidates).update(
+        claim=claim, claimed_until=now + timedelta(seconds=lease)
+    )
+    return claim, list(DeferredTask.objects.filter(claim=claim))
+
+
+class Command(BaseCommand):
+    help = "Run post-response work stored as DeferredTask rows (TASK_QUEUE_MODE='durable')"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Tasks run per batch (default: 500)")
+        parser.add_argument('--max-attempts', type=int, default=5,
+                            help="Skip tasks that already failed this many times (default: 5)")
+        parser.add_argument('--lease', type=float, default=300,
+                            help="Seconds a claimed batch is reserved for this runner; tasks of a runner "
+                                 "that died are picked up again after it (default: 300)")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep polling for new tasks instead of exiting when none are left")
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds between polls with --loop (default: 1)")
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            claim, batch = claim_tasks(options['batch_size'], options['max_attempts'], options['lease'])
+            if not batch:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+                continue
+
+            try:
+                self._run(claim, batch)
+            except Exception:
+                # Retry one by one so a single bad task does not hold back the batch
+                for deferred in batch:
+                    try:
+                        self._run(claim, [deferred])
+                    except Exception as exc:
+                        DeferredTask.objects.filter(pk=deferred.pk, claim=claim).update(
+                            attempts=F('attempts') + 1, last_error=repr(exc), claim='', claimed_until=None
+                        )
+                        self.stderr.write(f"Task {deferred.pk} ({deferred.name}) failed: {exc!r}")
+                        continue
+                    processed += 1
+            else:
+                processed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Ran {processed} deferred task(s)"))
+
+    def _run(self, claim, batch):
+        with transaction.atomic():
+            run_tasks([(deferred.name, deferred.payload) for deferred in batch])
+            DeferredTask.objects.filter(pk__in=[deferred.pk for deferred in batch], claim=claim).delete()
@@ -0,0 +1,166 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: load the application, then time one request per path twice
+PROBE = r'''
+import io, json, sys, time
+started = time.perf_counter()
+server, paths = sys.argv[1], sys.argv[2:]
+
+def split(path):
+    path, _, query = path.partition('?')
+    return path, query
+
+if server == 'wsgi':
+    from firstproject.wsgi import application
+
+    def request(path):
+        path, query = split(path)
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+            'REMOTE_ADDR': '127.0.0.1', 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr, 'wsgi.version': (1, 0), 'wsgi.multithread': True,
+            'wsgi.multiprocess': True, 'wsgi.run_once': False,
+        }
+        statuses = []
+        response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        b''.join(response)
+        response.close()
+        return int(statuses[0].split()[0])
+else:
+    import asyncio
+    from firstproject.asgi import application
+
+    async def handle(path):
+        path, query = split(path)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 0),
+            'server': ('localhost', 80),
+        }
+        pending = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        statuses = []
+
+        async def receive():
+            if pending:
+                return pending.pop()
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+
+        await application(scope, receive, send)
+        return statuses[0]
+
+    def request(path):
+        return asyncio.run(handle(path))
+
+ready = time.perf_counter()
+result = {'ready_ms': (ready - started) * 1000, 'paths': []}
+for index, path in enumerate(paths):
+    timings = []
+    for _ in range(2):
+        begun = time.perf_counter()
+        status = request(path)
+        timings.append((time.perf_counter() - begun) * 1000)
+        if index == 0 and 'first_response_at' not in result:
+            result['first_response_at'] = time.time()
+    result['paths'].append({'path': path, 'status': status, 'first_ms': timings[0], 'repeat_ms': timings[1]})
+print(json.dumps(result))
+'''
+
+
+class Command(BaseCommand):
+    help = "Profile module import time at startup and measure time-to-first-request for WSGI and ASGI"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3,
+                            help="Fresh processes per configuration; medians are reported (default: 3)")
+        parser.add_argument('--path', action='append', dest='paths',
+                            help="Path to request, repeatable (default: product list and suggestions)")
+        parser.add_argument('--top', type=int, default=15,
+                            help="Number of slowest imports to list (default: 15)")
+        parser.add_argument('--max-import-ms', type=float,
+                            help="Fail if loading the WSGI application takes longer than this")
+
+    def _env(self, warmup):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'firstproject.settings'))
+        env['STARTUP_WARMUP'] = '1' if warmup else '0'
+        return env
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or ['/api/products/', '/api/products/suggest/?q=lap']
+        total_import_ms = self._import_profile(options['top'])
+
+        self.stdout.write(f"\nTime to first request, median of {options['runs']} fresh process(es)")
+        header = f"{'server':<8}{'warmup':<8}{'app ready':>11}{'1st response':>14}"
+        for path in paths:
+            header += f"  {path[:28]:>28} 1st/repeat"
+        self.stdout.write(header)
+
+        for server in ('wsgi', 'asgi'):
+            for warmup in (False, True):
+                runs = [self._probe(server, warmup, paths) for _ in range(options['runs'])]
+                line = (
+                    f"{server:<8}{'on' if warmup else 'off':<8}"
+                    f"{statistics.median(run['ready_ms'] for run in runs):>9.0f}ms"
+                    f"{statistics.median(run['ttfr_ms'] for run in runs):>12.0f}ms"
+                )
+                for index, path in enumerate(paths):
+                    first = statistics.median(run['paths'][index]['first_ms'] for run in runs)
+                    repeat = statistics.median(run['paths'][index]['repeat_ms'] for run in runs)
+                    status = runs[0]['paths'][index]['status']
+                    line += f"  {f'{first:.1f} / {repeat:.1f} ms ({status})':>39}"
+                self.stdout.write(line)
+        self.stdout.write("'1st response' is measured from process spawn, including interpreter startup.")
+
+        if options['max_import_ms'] is not None and total_import_ms > options['max_import_ms']:
+            raise CommandError(
+                f"Loading the WSGI application took {total_import_ms:.0f} ms, over the {options['max_import_ms']:.0f} ms budget"
+            )
+
+    def _import_profile(self, top):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import firstproject.wsgi'],
+            cwd=settings.BASE_DIR, env=self._env(False), capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"Loading the WSGI application failed:\n{result.stderr[-2000:]}")
+
+        imports = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, module = line[len('import time:'):].split('|')
+            imports.append((int(self_us), int(cumulative_us), module.strip()))
+        total_ms = next(cumulative for _, cumulative, module in imports if module == 'firstproject.wsgi') / 1000
+
+        self.stdout.write(f"Loading firstproject.wsgi (python -X importtime): {total_ms:.0f} ms, {len(imports)} modules")
+        self.stdout.write(f"{'self ms':>9}{'cumulative ms':>15}  module")
+        for self_us, cumulative_us, module in sorted(imports, reverse=True)[:top]:
+            self.stdout.write(f"{self_us / 1000:>9.1f}{cumulative_us / 1000:>15.1f}  {module}")
+        app_modules = [module for _, _, module in imports if module.startswith('testapp')]
+        self.stdout.write(f"testapp modules loaded at startup: {', '.join(app_modules) or 'none'}")
+        return total_ms
+
+    def _probe(self, server, warmup, paths):
+        spawned = time.time()
+        result = subprocess.run(
+            [sys.executable, '-c', PROBE, server, *paths],
+            cwd=settings.BASE_DIR, env=self._env(warmup), capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"{server} probe failed:\n{result.stderr[-2000:]}")
+        run = json.loads(result.stdout.strip().splitlines()[-1])
+        run['ttfr_ms'] = (run['first_response_at'] - spawned) * 1000
+        return run
@@ -0,0 +1,57 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from testapp.fields import dictionaries
+from testapp.models import ChatMessage, CompressionDictionary
+
+# zlib only looks back 32 KB, so a larger dictionary would not help
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+
+class Command(BaseCommand):
+    help = "Train a zlib preset dictionary from recent bot messages and make it the active one"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=5000,
+                            help="Number of recent bot messages to learn from (default: 5000)")
+        parser.add_argument('--size', type=int, default=MAX_DICTIONARY_SIZE,
+                            help=f"Dictionary size in bytes (default and maximum: {MAX_DICTIONARY_SIZE})")
+
+    def handle(self, *args, **options):
+        size = min(options['size'], MAX_DICTIONARY_SIZE)
+        messages = ChatMessage.objects.filter(message_type='bot').order_by('-pk').only('content')
+        sample = list(messages[:options['sample']])
+        if not sample:
+            raise CommandError("No bot messages to train on")
+
+        # Bot replies repeat whole lines (product blocks, intros), so frequent lines make good dictionary content
+        lines = Counter()
+        for message in sample:
+            lines.update(line + '\n' for line in message.content.split('\n') if line.strip())
+
+        chosen = []
+        used = 0
+        for line, count in sorted(lines.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+            if count < 2:
+                continue
+            encoded = line.encode('utf-8')
+            if used + len(encoded) > size:
+                continue
+            chosen.append(encoded)
+            used += len(encoded)
+        if not chosen:
+            raise CommandError("Sample has no repeated content to build a dictionary from")
+
+        # zlib favours matches near the end of the dictionary, so the most valuable lines go last
+        data = b''.join(reversed(chosen))
+        with transaction.atomic():
+            CompressionDictionary.objects.filter(is_active=True).update(is_active=False)
+            dictionary = CompressionDictionary.objects.create(data=data, sample_count=len(sample), is_active=True)
+        dictionaries.reset()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Dictionary {dictionary.pk}: {len(data)} bytes from {len(sample)} message(s), now active. "
+            f"Workers pick it up within {dictionaries.refresh_interval}s."
+        ))
@@ -1,7 +1,166 @@
+import re
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
+from django.utils.text import compress_string
+from rest_framework.permissions import SAFE_METHODS
+
+from .activity import user_session_recorder
+from .caching import get_cached_user
+from .routers import end_request, pin_to_primary, start_request
+from .throttling import concurrency_limiter
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+ACCEPT_ENCODING_RE = re.compile(r'\s*([\w*]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*')
 
 class DisableCSRFForAPIMiddleware(MiddlewareMixin):
     def process_request(self, request):
         if request.path.startswith('/api/'):
             setattr(request, '_dont_enforce_csrf_checks', True)
-        return None 
\ No newline at end of file
+        return None 
+
+def _get_user(request):
+    if not hasattr(request, '_cached_user'):
+        request._cached_user = get_cached_user(request)
+    return request._cached_user
+
+async def _auser(request):
+    return await sync_to_async(_get_user)(request)
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """
+    AuthenticationMiddleware that resolves request.user through the per-process
+    user cache instead of querying the User table on every request
+    """
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: _get_user(request))
+        request.auser = partial(_auser, request)
+
+class UserSessionMiddleware(MiddlewareMixin):
+    """
+    Hands authenticated requests to the UserSession recorder, which writes them
+    in the background instead of during the request
+    """
+    def process_response(self, request, response):
+        if not settings.USER_SESSION_TRACKING:
+            return response
+        user = getattr(request, 'user', None)
+        session_key = getattr(getattr(request, 'session', None), 'session_key', None)
+        if user is not None and session_key and user.is_authenticated:
+            user_session_recorder.record(
+                user.pk,
+                session_key,
+                request.META.get('REMOTE_ADDR'),
+                request.META.get('HTTP_USER_AGENT', ''),
+            )
+        return response
+
+class ConcurrencyLimitMiddleware(MiddlewareMixin):
+    """
+    Sheds requests with 429 once a path prefix has CONCURRENCY_LIMITS requests in flight.
+    A streaming response keeps its slot until the server has sent it and closed it.
+    """
+    def process_request(self, request):
+        slot = concurrency_limiter.acquire(request.path)
+        if slot is None:
+            response = JsonResponse({'error': 'Server busy, please retry shortly'}, status=429)
+            response['Retry-After'] = str(settings.CONCURRENCY_RETRY_AFTER)
+            return response
+        request._concurrency_slot = slot
+        return None
+
+    def process_response(self, request, response):
+        if response.streaming:
+            # Servers close the response after sending its last chunk, or when the client goes away
+            response._resource_closers.append(partial(self._release, request))
+        else:
+            self._release(request)
+        return response
+
+    def _release(self, request):
+        slot = getattr(request, '_concurrency_slot', None)
+        if slot:
+            concurrency_limiter.release(slot)
+            request._concurrency_slot = None
+
+class PrimaryPinningMiddleware(MiddlewareMixin):
+    """
+    Tells PrimaryReplicaRouter which requests must read from the primary:
+    unsafe methods and admin pages from the start, any other request from
+    its first write on
+    """
+    def process_request(self, request):
+        start_request(primary_only=request.method not in SAFE_METHODS)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.resolver_match and request.resolver_match.app_name == 'admin':
+            pin_to_primary()
+
+    def process_response(self, request, response):
+        end_request()
+        return response
+
+def _accepted_encodings(header):
+    """
+    Content codings from an Accept-Encoding header that the client did not refuse with q=0
+    """
+    accepted = set()
+    for part in header.split(','):
+        match = ACCEPT_ENCODING_RE.fullmatch(part)
+        if not match:
+            continue
+        try:
+            quality = float(match.group(2) or 1)
+        except ValueError:
+            continue
+        if quality > 0:
+            accepted.add(match.group(1).lower())
+    return accepted
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses API responses of at least COMPRESSION_MIN_SIZE bytes with
+    brotli (when installed) or gzip, whichever the client accepts. Gzip
+    output gets the same random padding as Django's GZipMiddleware to
+    mitigate BREACH.
+    """
+    max_random_bytes = 100
+
+    def process_response(self, request, response):
+        if not request.path.startswith('/api/') or response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accepted = _accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in accepted:
+            encoding = 'br'
+            compressed = brotli.compress(response.content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+        elif 'gzip' in accepted:
+            encoding = 'gzip'
+            compressed = compress_string(response.content, max_random_bytes=self.max_random_bytes)
+        else:
+            return response
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The encoded body differs from the uncompressed one, so a strong ETag no longer matches it
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+# Django compiles icontains on PostgreSQL to UPPER("col"::text) LIKE UPPER(%s),
+# so the trigram indexes are built over the same expression to be usable.
+TRIGRAM_COLUMNS = ['name', 'description', 'category']
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for column in TRIGRAM_COLUMNS:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS testapp_product_{column}_trgm '
+            f'ON testapp_product USING gin (UPPER({column}::text) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for column in TRIGRAM_COLUMNS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS testapp_product_{column}_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0003_auto_20250607_1952'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
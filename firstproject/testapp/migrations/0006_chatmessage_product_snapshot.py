@@ -0,0 +1,66 @@
+# Generated by Django 5.2.2 on 2026-10-19 19:18
+
+from django.db import migrations, models
+from django.utils import timezone
+
+BATCH_SIZE = 500
+
+
+def _isoformat(moment):
+    value = timezone.localtime(moment).isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def backfill_product_snapshots(apps, schema_editor):
+    """
+    Give existing bot messages the snapshot Product.snapshot() would have
+    stored: every ProductSerializer field plus the capture time
+    """
+    ChatMessage = apps.get_model('testapp', 'ChatMessage')
+    captured_at = timezone.now().isoformat()
+    pending = ChatMessage.objects.filter(message_type='bot', product_snapshot__isnull=True).order_by('pk')
+
+    last_pk = 0
+    while True:
+        batch = list(pending.filter(pk__gt=last_pk).prefetch_related('related_products')[:BATCH_SIZE])
+        if not batch:
+            break
+        for message in batch:
+            message.product_snapshot = [
+                {
+                    'id': product.pk,
+                    'name': product.name,
+                    'category': product.category,
+                    'price': f'{product.price:.2f}',
+                    'description': product.description,
+                    'stock': product.stock,
+                    'rating': product.rating,
+                    'image_url': product.image_url,
+                    'updated_at': _isoformat(product.updated_at),
+                    'captured_at': captured_at,
+                }
+                for product in message.related_products.all()
+            ]
+        ChatMessage.objects.bulk_update(batch, ['product_snapshot'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0005_chat_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='product_snapshot',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_product_snapshots, migrations.RunPython.noop),
+    ]
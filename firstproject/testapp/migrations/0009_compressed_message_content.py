@@ -0,0 +1,83 @@
+# Generated by Django 5.2.2 on 2026-10-19 19:25
+
+import django.utils.timezone
+import testapp.fields
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def compress_existing_content(apps, schema_editor):
+    ChatMessage = apps.get_model('testapp', 'ChatMessage')
+    messages = ChatMessage.objects.order_by('pk').only('pk', 'content')
+
+    last_pk = 0
+    while True:
+        batch = list(messages.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            break
+        for message in batch:
+            message.content_compressed = message.content
+        ChatMessage.objects.bulk_update(batch, ['content_compressed'])
+        last_pk = batch[-1].pk
+
+
+def decompress_content(apps, schema_editor):
+    ChatMessage = apps.get_model('testapp', 'ChatMessage')
+    messages = ChatMessage.objects.order_by('pk').only('pk', 'content_compressed')
+
+    last_pk = 0
+    while True:
+        batch = list(messages.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            break
+        for message in batch:
+            message.content = message.content_compressed
+        ChatMessage.objects.bulk_update(batch, ['content'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0008_deferred_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompressionDictionary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField()),
+                ('sample_count', models.IntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('is_active', models.BooleanField(default=False)),
+            ],
+        ),
+        # Copy into a new binary column in batches, then swap it in for the text column
+        migrations.AddField(
+            model_name='chatmessage',
+            name='content_compressed',
+            field=testapp.fields.CompressedTextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='content',
+            field=models.TextField(null=True),
+        ),
+        migrations.RunPython(compress_existing_content, decompress_content),
+        migrations.RemoveField(
+            model_name='chatmessage',
+            name='content',
+        ),
+        migrations.RenameField(
+            model_name='chatmessage',
+            old_name='content_compressed',
+            new_name='content',
+        ),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='content',
+            field=testapp.fields.CompressedTextField(),
+        ),
+    ]
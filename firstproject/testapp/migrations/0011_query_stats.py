@@ -0,0 +1,27 @@
+# Generated by Django 5.2.2 on 2026-10-19 19:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0010_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('intent', 'Intent'), ('query', 'Query'), ('term', 'Search term'), ('category', 'Category'), ('zero_result', 'Zero-result query')], max_length=20)),
+                ('key', models.CharField(max_length=200)),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-day', '-count'],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'day', 'key'), name='unique_query_stat')],
+            },
+        ),
+    ]
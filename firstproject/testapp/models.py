@@ -2,8 +2,45 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from .catalog import catalog_changed
+from .fields import CompressedTextField
+
 # Create your models here.
 
+def _isoformat(moment):
+    """
+    Datetime in the format of DRF's DateTimeField output
+    """
+    if moment is None:
+        return None
+    value = timezone.localtime(moment).isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+class ProductQuerySet(models.QuerySet):
+    """
+    Bulk updates skip auto_now and the post_save signal, so they bump
+    updated_at (which keys the product card cache) and the catalog version
+    themselves
+    """
+
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_at', timezone.now())
+        updated = super().update(**kwargs)
+        catalog_changed()
+        return updated
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        objs = list(objs)
+        now = timezone.now()
+        for obj in objs:
+            obj.updated_at = now
+        if 'updated_at' not in fields:
+            fields = [*fields, 'updated_at']
+        updated = super().bulk_update(objs, fields, batch_size=batch_size)
+        catalog_changed()
+        return updated
+
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     category = models.CharField(max_length=50)
@@ -12,19 +49,46 @@ class Product(models.Model):
     stock = models.IntegerField()
     rating = models.FloatField()
     image_url = models.URLField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    def snapshot(self, captured_at=None):
+        """
+        Copy of the product as ProductSerializer renders it, plus the capture
+        time, stored on bot messages
+        """
+        return {
+            'id': self.pk,
+            'name': self.name,
+            'category': self.category,
+            'price': f'{self.price:.2f}',
+            'description': self.description,
+            'stock': self.stock,
+            'rating': self.rating,
+            'image_url': self.image_url,
+            'updated_at': _isoformat(self.updated_at),
+            'captured_at': (captured_at or timezone.now()).isoformat(),
+        }
+
 class ChatSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     session_id = models.CharField(max_length=100, unique=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    # Set while older messages live in ChatArchive rather than ChatMessage
+    is_archived = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['updated_at']),
+        ]
 
     def __str__(self):
         return f"Chat Session {self.session_id} - {self.user.username}"
@@ -38,18 +102,42 @@ class ChatMessage(models.Model):
 
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
     message_type = models.CharField(max_length=10, choices=MESSAGE_TYPES)
-    content = models.TextField()
+    content = CompressedTextField()
     timestamp = models.DateTimeField(default=timezone.now)
     
     # For bot responses that include product recommendations
     related_products = models.ManyToManyField(Product, blank=True)
+    # Product.snapshot() of related_products at send time; history reads use it instead of the M2M join
+    product_snapshot = models.JSONField(null=True, blank=True)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['timestamp']),
+            models.Index(fields=['session', 'timestamp']),
+        ]
 
     def __str__(self):
         return f"{self.message_type}: {self.content[:50]}..."
 
+class ChatArchive(models.Model):
+    """
+    Compressed batch of messages moved out of ChatMessage by archive_chats
+    """
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='archives')
+    # zlib-compressed JSON list of messages, see testapp.archive
+    payload = models.BinaryField()
+    message_count = models.IntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['first_timestamp']
+
+    def __str__(self):
+        return f"Archive of {self.message_count} messages - {self.session.session_id}"
+
 class UserSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     session_key = models.CharField(max_length=40, unique=True)
@@ -58,5 +146,71 @@ class UserSession(models.Model):
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['last_activity']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.session_key}"
+
+class DeferredTask(models.Model):
+    """
+    Post-response work persisted when TASK_QUEUE_MODE is 'durable'. A
+    runner claims a row by writing its claim token and a lease expiry; the
+    row is free again once the lease runs out.
+    """
+    name = models.CharField(max_length=100)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    claim = models.CharField(max_length=32, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.name} ({self.attempts} attempts)"
+
+
+class CompressionDictionary(models.Model):
+    """
+    zlib preset dictionary trained from existing messages, used by CompressedTextField
+    """
+    data = models.BinaryField()
+    sample_count = models.IntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+    is_active = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"Dictionary {self.pk} ({len(self.data)} bytes)"
+
+
+class QueryStat(models.Model):
+    """
+    Daily count of a chat query, intent, search term or category, written by testapp.analytics
+    """
+    KINDS = (
+        ('intent', 'Intent'),
+        ('query', 'Query'),
+        ('term', 'Search term'),
+        ('category', 'Category'),
+        ('zero_result', 'Zero-result query'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    key = models.CharField(max_length=200)
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-day', '-count']
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'day', 'key'], name='unique_query_stat'),
+        ]
+
     def __str__(self):
-        return f"{self.user.username} - {self.session_key}"
\ No newline at end of file
+        return f"{self.kind} {self.key!r} on {self.day}: {self.count}"
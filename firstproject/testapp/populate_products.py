@@ -1,30 +1,36 @@
 import os
 import sys
 import django
-import random 
-import requests
 
 # Add the parent directory to the Python path so Django can find the firstproject module
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'firstproject.settings')
-django.setup()
 
-from testapp.models import Product
+def main():
+    # Imported here so merely importing this module neither sets up Django nor loads requests
+    import requests
 
-response = requests.get("https://dummyjson.com/products?limit=100")
-data = response.json()['products']
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'firstproject.settings')
+    django.setup()
 
-for item in data:
-    Product.objects.create(
-        name= item['title'],
-        category=item['category'],
-        price=item['price'],
-        description=item['description'],
-        stock=item['stock'],
-        rating=item['rating'],
-        image_url=item['thumbnail']
-    )
+    from testapp.models import Product
 
+    response = requests.get("https://dummyjson.com/products?limit=100")
+    data = response.json()['products']
 
-print("100 mock products added")
\ No newline at end of file
+    for item in data:
+        Product.objects.create(
+            name= item['title'],
+            category=item['category'],
+            price=item['price'],
+            description=item['description'],
+            stock=item['stock'],
+            rating=item['rating'],
+            image_url=item['thumbnail']
+        )
+
+    print("100 mock products added")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import contextvars
+import random
+
+from django.conf import settings
+
+
+class _RequestRouting:
+    __slots__ = ('primary_only',)
+
+    def __init__(self, primary_only):
+        self.primary_only = primary_only
+
+
+# Routing state of the request being handled, set by PrimaryPinningMiddleware
+_request_routing = contextvars.ContextVar('request_routing', default=None)
+
+
+def start_request(primary_only=False):
+    _request_routing.set(_RequestRouting(primary_only))
+
+
+def end_request():
+    _request_routing.set(None)
+
+
+def pin_to_primary():
+    """
+    Send the remaining reads of the current request to the primary
+    """
+    routing = _request_routing.get()
+    if routing is not None:
+        routing.primary_only = True
+
+
+class PrimaryReplicaRouter:
+    """
+    Route catalog reads to read replicas and everything else to the primary.
+
+    Products change rarely, so the product list, product search and the
+    chatbot lookups can tolerate replication lag. Chat sessions and messages
+    are read right after they are written, so they always use the primary.
+    Requests that write (unsafe methods, admin pages, or any request once it
+    has written) read from the primary too, so they never read a replica
+    that has not caught up with their own writes.
+    """
+
+    catalog_models = {'product'}
+
+    def _replicas(self):
+        return [alias for alias in settings.DATABASES if alias != 'default']
+
+    def db_for_read(self, model, **hints):
+        routing = _request_routing.get()
+        if routing is not None and routing.primary_only:
+            return 'default'
+        if model._meta.app_label == 'testapp' and model._meta.model_name in self.catalog_models:
+            replicas = self._replicas()
+            if replicas:
+                return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
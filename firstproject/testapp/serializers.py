@@ -2,12 +2,16 @@ from rest_framework import serializers
 from .models import Product, ChatSession, ChatMessage, UserSession
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
+from django.conf import settings
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = '__all__'
 
+# Fields ProductSerializer returns; product snapshots are served with exactly these keys
+PRODUCT_FIELDS = [field.name for field in Product._meta.concrete_fields]
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, min_length=8)
     password_confirm = serializers.CharField(write_only=True)
@@ -63,13 +67,25 @@ class ChatSessionSerializer(serializers.ModelSerializer):
         return obj.messages.count()
 
 class ChatMessageSerializer(serializers.ModelSerializer):
-    related_products = ProductSerializer(many=True, read_only=True)
+    related_products = serializers.SerializerMethodField()
     timestamp_formatted = serializers.SerializerMethodField()
 
     class Meta:
         model = ChatMessage
         fields = ['id', 'message_type', 'content', 'timestamp', 'timestamp_formatted', 'related_products']
 
+    def get_related_products(self, obj):
+        if obj.product_snapshot is not None:
+            # Snapshots also keep captured_at; older ones may lack later-added fields
+            return [
+                {field: product.get(field) for field in PRODUCT_FIELDS}
+                for product in obj.product_snapshot
+            ]
+        # Only bot messages carry products; skip the M2M query for everything else
+        if obj.message_type != 'bot':
+            return []
+        return ProductSerializer(obj.related_products.all(), many=True).data
+
     def get_timestamp_formatted(self, obj):
         return obj.timestamp.strftime('%Y-%m-%d %H:%M:%S')
 
@@ -78,10 +94,22 @@ class ChatMessageCreateSerializer(serializers.ModelSerializer):
         model = ChatMessage
         fields = ['content']
 
+class ChatBatchItemSerializer(serializers.Serializer):
+    content = serializers.CharField()
+    session_id = serializers.CharField(max_length=100, required=False)
+
+class ChatBatchSerializer(serializers.Serializer):
+    messages = serializers.ListField(
+        child=ChatBatchItemSerializer(),
+        allow_empty=False,
+        max_length=settings.CHAT_BATCH_MAX_MESSAGES
+    )
+
 class ProductSearchSerializer(serializers.Serializer):
-    query = serializers.CharField(max_length=255)
+    query = serializers.CharField(max_length=255, required=False, allow_blank=True)
     category = serializers.CharField(max_length=50, required=False)
     min_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
     max_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
     min_rating = serializers.FloatField(required=False)
-    in_stock_only = serializers.BooleanField(default=True)
\ No newline at end of file
+    in_stock_only = serializers.BooleanField(default=True)
+    include_facets = serializers.BooleanField(default=True)
\ No newline at end of file
@@ -0,0 +1,22 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import forget_chat_session, forget_user
+from .catalog import catalog_changed
+from .models import ChatSession, Product
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=ChatSession)
+def invalidate_cached_chat_session(sender, instance, **kwargs):
+    forget_chat_session(instance)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_catalog_indexes(sender, **kwargs):
+    catalog_changed()
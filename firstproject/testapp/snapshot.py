@@ -0,0 +1,340 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from bisect import bisect_left
+
+from django.conf import settings
+
+from .catalog import catalog_version
+
+logger = logging.getLogger(__name__)
+
+# File layout: header, section directory, then the sections back to back
+MAGIC = b'CATSNAP\x00'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('>8sHHQd')       # magic, format version, section count, generation, built_at
+SECTION = struct.Struct('>16sQQ')       # name, offset, length
+
+# Sorted table section: record count, one offset per record, then records of
+# key length, key, value length, value. Keys are UTF-8 and sorted bytewise.
+# Hash table section: record count, bucket count (a power of two), one record
+# offset per bucket (0 when empty, linear probing on crc32 of the key), then records.
+COUNT = struct.Struct('>I')
+HASH_HEADER = struct.Struct('>II')
+KEY_LENGTH = struct.Struct('>H')
+VALUE_LENGTH = struct.Struct('>I')
+
+# Suggest table values: -weight, product id (0 for categories), kind, then the label
+SUGGESTION = struct.Struct('>dQc')
+KINDS = {'product': b'p', 'category': b'c'}
+KIND_NAMES = {code: kind for kind, code in KINDS.items()}
+
+
+def _pack_table(items):
+    """
+    Encode (key, value) byte pairs, already sorted by key, as a sorted table section
+    """
+    offsets = []
+    records = []
+    position = COUNT.size + 4 * len(items)
+    for key, value in items:
+        offsets.append(position)
+        record = KEY_LENGTH.pack(len(key)) + key + VALUE_LENGTH.pack(len(value)) + value
+        records.append(record)
+        position += len(record)
+    return COUNT.pack(len(items)) + struct.pack(f'>{len(offsets)}I', *offsets) + b''.join(records)
+
+
+def _pack_hash_table(items):
+    """
+    Encode (key, value) byte pairs with unique keys as a hash table section
+    """
+    bucket_count = 1
+    while bucket_count < 2 * len(items):
+        bucket_count *= 2
+    buckets = [0] * bucket_count
+    records = []
+    position = HASH_HEADER.size + 4 * bucket_count
+    for key, value in items:
+        bucket = zlib.crc32(key) & (bucket_count - 1)
+        while buckets[bucket]:
+            bucket = (bucket + 1) & (bucket_count - 1)
+        buckets[bucket] = position
+        record = KEY_LENGTH.pack(len(key)) + key + VALUE_LENGTH.pack(len(value)) + value
+        records.append(record)
+        position += len(record)
+    return HASH_HEADER.pack(len(items), bucket_count) + struct.pack(f'>{bucket_count}I', *buckets) + b''.join(records)
+
+
+def _read_record(buffer, offset):
+    (key_length,) = KEY_LENGTH.unpack_from(buffer, offset)
+    offset += KEY_LENGTH.size
+    key = bytes(buffer[offset:offset + key_length])
+    offset += key_length
+    (length,) = VALUE_LENGTH.unpack_from(buffer, offset)
+    offset += VALUE_LENGTH.size
+    return key, bytes(buffer[offset:offset + length])
+
+
+class HashTable:
+    """
+    Read-only view of a hash table section, for exact-key lookups in one or two probes
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._count, self._bucket_count = HASH_HEADER.unpack_from(buffer, 0)
+
+    def __len__(self):
+        return self._count
+
+    def get(self, key):
+        mask = self._bucket_count - 1
+        bucket = zlib.crc32(key) & mask
+        while True:
+            (offset,) = struct.unpack_from('>I', self._buffer, HASH_HEADER.size + 4 * bucket)
+            if not offset:
+                return None
+            (key_length,) = KEY_LENGTH.unpack_from(self._buffer, offset)
+            start = offset + KEY_LENGTH.size
+            if key_length == len(key) and self._buffer[start:start + key_length] == key:
+                return _read_record(self._buffer, offset)[1]
+            bucket = (bucket + 1) & mask
+
+
+class SortedTable:
+    """
+    Read-only view of a sorted table section. Lookups bisect over the mapped
+    bytes directly, so nothing is copied into the process until a record is read.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        (self._count,) = COUNT.unpack_from(buffer, 0)
+
+    def __len__(self):
+        return self._count
+
+    def _offset(self, index):
+        return struct.unpack_from('>I', self._buffer, COUNT.size + 4 * index)[0]
+
+    def key(self, index):
+        offset = self._offset(index)
+        (length,) = KEY_LENGTH.unpack_from(self._buffer, offset)
+        start = offset + KEY_LENGTH.size
+        return bytes(self._buffer[start:start + length])
+
+    def item(self, index):
+        return _read_record(self._buffer, self._offset(index))
+
+    def prefix_range(self, prefix):
+        """
+        Indexes of the records whose key starts with `prefix`
+        """
+        start = bisect_left(range(self._count), prefix, key=self.key)
+        # 0xff never occurs in UTF-8, so it sorts after every continuation of the prefix
+        end = bisect_left(range(self._count), prefix + b'\xff', start, key=self.key)
+        return range(start, end)
+
+
+class TableMapping:
+    """
+    Dict-like access to a hash table with str keys and decoded values
+    """
+
+    def __init__(self, table, decode):
+        self._table = table
+        self._decode = decode
+
+    def get(self, key, default=None):
+        value = self._table.get(key.encode('utf-8'))
+        return default if value is None else self._decode(value)
+
+    def __getitem__(self, key):
+        value = self._table.get(key.encode('utf-8'))
+        if value is None:
+            raise KeyError(key)
+        return self._decode(value)
+
+    def __contains__(self, key):
+        return self._table.get(key.encode('utf-8')) is not None
+
+    def __len__(self):
+        return len(self._table)
+
+
+class CatalogSnapshot:
+    """
+    Catalog data and search structures read from a file written by
+    `manage.py build_catalog_snapshot`. The file is mapped read-only, so every
+    worker on the host shares one copy through the OS page cache.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mapped)
+
+        magic, format_version, section_count, self.generation, self.built_at = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} catalog snapshot")
+
+        sections = {}
+        for index in range(section_count):
+            name, offset, length = SECTION.unpack_from(buffer, HEADER.size + index * SECTION.size)
+            if offset + length > len(buffer):
+                raise ValueError(f"{path} is truncated")
+            sections[name.rstrip(b'\x00').decode('ascii')] = buffer[offset:offset + length]
+
+        meta = json.loads(bytes(sections['meta']))
+        self.spelling_max_distance = meta['spelling']['max_distance']
+        self.spelling_prefix_length = meta['spelling']['prefix_length']
+        self.suggest = SortedTable(sections['suggest'])
+        self.words = TableMapping(HashTable(sections['words']), lambda value: int.from_bytes(value, 'big'))
+        self.deletes = TableMapping(HashTable(sections['deletes']), lambda value: value.decode('utf-8').split('\n'))
+        facets = json.loads(bytes(sections['facets']))
+        self.facets = {False: facets['all'], True: facets['in_stock']}
+
+    def suggestions(self, prefix):
+        """
+        Suggest entries, as (key, -weight, label, kind, product_id) tuples, whose key starts with `prefix`
+        """
+        entries = []
+        for index in self.suggest.prefix_range(prefix.encode('utf-8')):
+            key, value = self.suggest.item(index)
+            weight, product_id, kind = SUGGESTION.unpack_from(value, 0)
+            label = value[SUGGESTION.size:].decode('utf-8')
+            entries.append((key.decode('utf-8'), weight, label, KIND_NAMES[kind], product_id or None))
+        return entries
+
+
+def read_generation(path):
+    """
+    Generation of the snapshot at `path`, or 0 if there is none
+    """
+    try:
+        with open(path, 'rb') as file:
+            magic, _, _, generation, _ = HEADER.unpack(file.read(HEADER.size))
+    except (OSError, struct.error):
+        return 0
+    return generation if magic == MAGIC else 0
+
+
+def write_snapshot(path, suggest_entries, spelling, facets):
+    """
+    Write a new snapshot and atomically put it in place of the one at `path`.
+    `suggest_entries` are sorted SuggestIndex entries, `spelling` a SymSpell
+    and `facets` a {in_stock_only: facets} dict.
+    Returns the new generation and the size of each section.
+    """
+    built_at = time.time()
+    generation = read_generation(path) + 1
+    sections = {
+        'meta': json.dumps({
+            'spelling': {'max_distance': spelling.max_distance, 'prefix_length': spelling.prefix_length},
+        }).encode('utf-8'),
+        'suggest': _pack_table([
+            (key.encode('utf-8'), SUGGESTION.pack(weight, product_id or 0, KINDS[kind]) + label.encode('utf-8'))
+            for key, weight, label, kind, product_id in suggest_entries
+        ]),
+        'words': _pack_hash_table([
+            (word.encode('utf-8'), count.to_bytes(4, 'big')) for word, count in spelling.words.items()
+        ]),
+        'deletes': _pack_hash_table([
+            (variant.encode('utf-8'), '\n'.join(sorted(words)).encode('utf-8'))
+            for variant, words in spelling.deletes.items()
+        ]),
+        'facets': json.dumps({'all': facets[False], 'in_stock': facets[True]}).encode('utf-8'),
+    }
+
+    directory = []
+    offset = HEADER.size + SECTION.size * len(sections)
+    for name, data in sections.items():
+        directory.append(SECTION.pack(name.encode('ascii'), offset, len(data)))
+        offset += len(data)
+
+    # Readers keep the old file mapped; os.replace swaps the name to the new inode in one step
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.catalog-snapshot-')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(sections), generation, built_at))
+            file.write(b''.join(directory))
+            for data in sections.values():
+                file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return generation, {name: len(data) for name, data in sections.items()}
+
+
+class SnapshotLoader:
+    """
+    Per-process handle on the snapshot at settings.CATALOG_SNAPSHOT_PATH. The
+    file is checked every CATALOG_SNAPSHOT_CHECK_INTERVAL seconds and remapped
+    when a new one has been published. After a Product change in this process
+    the snapshot is out of date, so current() returns None and callers fall
+    back to their in-memory indexes until the next snapshot appears. They do
+    the same when the file cannot be read (truncated, corrupt, or written in
+    another format version).
+    """
+
+    def __init__(self):
+        self._snapshot = None
+        self._identity = None
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        path = settings.CATALOG_SNAPSHOT_PATH
+        if not path:
+            return None
+
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at > settings.CATALOG_SNAPSHOT_CHECK_INTERVAL:
+            with self._lock:
+                if self._checked_at is None or now - self._checked_at > settings.CATALOG_SNAPSHOT_CHECK_INTERVAL:
+                    self._refresh(path)
+                    self._checked_at = now
+
+        if self._snapshot is None or self._version != catalog_version():
+            return None
+        return self._snapshot
+
+    def _refresh(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._snapshot = self._identity = None
+            return
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if identity == self._identity:
+            return
+        # Whatever the outcome, this file is not read again until it is replaced
+        self._identity = identity
+        try:
+            snapshot = CatalogSnapshot(path)
+        except (OSError, ValueError, KeyError, struct.error):
+            logger.exception("Could not load catalog snapshot %s", path)
+            self._snapshot = None
+            return
+        # The previous mapping is released once no request is still reading it
+        self._snapshot = snapshot
+        self._version = catalog_version()
+
+    def reset(self):
+        with self._lock:
+            self._checked_at = None
+
+
+catalog_snapshot = SnapshotLoader()
@@ -0,0 +1,224 @@
+import heapq
+import math
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog import BackgroundRefresh
+from .chatbot_service import CATEGORY_MAPPINGS
+from .models import ChatMessage, Product
+from .snapshot import catalog_snapshot
+
+# Upper bound for keys starting with a given prefix
+PREFIX_END = '\uffff'
+
+
+class SuggestIndex:
+    """
+    Typeahead index kept as one sorted list of
+    (key, -weight, label, kind, product_id) tuples. A prefix lookup is two
+    bisects plus a scan of the matching range. Product names are indexed
+    under each word so "pro" finds "Apple MacBook Pro".
+
+    Product saves and deletes, and new chatbot recommendations (which raise
+    a product's popularity), write a new copy of the list, which is swapped
+    in together with a new result cache, so lookups never lock and never see
+    a list being changed. Every CATALOG_INDEX_MAX_AGE seconds the whole index
+    is rebuilt in the background to pick up changes made by other processes;
+    lookups keep using the current list meanwhile. While a catalog snapshot
+    is loaded, lookups read its suggest table instead.
+    """
+
+    def __init__(self):
+        # (sorted entries, {lookup: suggestions} computed from them); replaced, never changed
+        self._view = None
+        self._product_entries = {}
+        # Results read from catalog snapshots, keyed by snapshot generation
+        self._snapshot_results = {}
+        self._popularity = {}
+        self._built_at = 0
+        self._lock = threading.RLock()
+        self._refresh = BackgroundRefresh('suggest-refresh', self._refresh_expired)
+
+    def _ensure_built(self):
+        if self._view is None:
+            with self._lock:
+                if self._view is None:
+                    self._build()
+        elif time.monotonic() - self._built_at > settings.CATALOG_INDEX_MAX_AGE:
+            self._refresh.start()
+
+    def _refresh_expired(self):
+        with self._lock:
+            if time.monotonic() - self._built_at > settings.CATALOG_INDEX_MAX_AGE:
+                self._build()
+
+    def warm(self):
+        """
+        Build the in-memory index now unless a catalog snapshot is serving lookups
+        """
+        if catalog_snapshot.current() is None:
+            self._ensure_built()
+
+    def _build(self):
+        entries, self._product_entries = self.build_entries()
+        self._view = (entries, {})
+        self._built_at = time.monotonic()
+
+    def build_entries(self):
+        """
+        Sorted entries for the whole catalog, and the entries of each product
+        """
+        Through = ChatMessage.related_products.through
+        popularity = dict(
+            Through.objects.values('product_id').annotate(count=Count('pk')).values_list('product_id', 'count')
+        )
+        self._popularity = popularity
+
+        entries = []
+        product_entries = {}
+        category_counts = Counter()
+        for product in Product.objects.only('pk', 'name', 'category', 'rating'):
+            product_entries[product.pk] = self._entries_for(product)
+            entries.extend(product_entries[product.pk])
+            category_counts[product.category] += 1
+
+        for category, count in category_counts.items():
+            label = category.replace('-', ' ')
+            weight = math.log1p(count)
+            entries.append((label.lower(), -weight, label, 'category', None))
+        for term, categories in CATEGORY_MAPPINGS.items():
+            weight = math.log1p(sum(category_counts[category] for category in categories))
+            entries.append((term, -weight, term, 'category', None))
+
+        entries.sort()
+        return entries, product_entries
+
+    def _entries_for(self, product):
+        # Rating plus how often the chatbot has recommended the product
+        weight = product.rating + math.log1p(self._popularity.get(product.pk, 0))
+        words = product.name.lower().split()
+        return [
+            (' '.join(words[index:]), -weight, product.name, 'product', product.pk)
+            for index in range(len(words))
+        ]
+
+    def update_product(self, product):
+        with self._lock:
+            if self._view is None:
+                return
+            entries = self._without(self._view[0], product.pk)
+            product_entries = self._entries_for(product)
+            for entry in product_entries:
+                insort(entries, entry)
+            self._product_entries[product.pk] = product_entries
+            self._view = (entries, {})
+
+    def remove_product(self, product_pk):
+        with self._lock:
+            if self._view is None:
+                return
+            self._view = (self._without(self._view[0], product_pk), {})
+
+    def record_links(self, product_ids):
+        """
+        Raise the popularity of products the chatbot just recommended, one
+        recommendation per id in `product_ids`
+        """
+        with self._lock:
+            if self._view is None:
+                return
+            entries = list(self._view[0])
+            for product_pk, count in Counter(product_ids).items():
+                old_entries = self._product_entries.get(product_pk)
+                if not old_entries:
+                    continue
+                before = self._popularity.get(product_pk, 0)
+                self._popularity[product_pk] = before + count
+                gain = math.log1p(before + count) - math.log1p(before)
+                self._remove(entries, old_entries)
+                new_entries = [(key, weight - gain, *rest) for key, weight, *rest in old_entries]
+                for entry in new_entries:
+                    insort(entries, entry)
+                self._product_entries[product_pk] = new_entries
+            self._view = (entries, {})
+
+    def _without(self, entries, product_pk):
+        """
+        Copy of `entries` without the entries of the given product
+        """
+        entries = list(entries)
+        self._remove(entries, self._product_entries.pop(product_pk, []))
+        return entries
+
+    @staticmethod
+    def _remove(entries, removed):
+        for entry in removed:
+            index = bisect_left(entries, entry)
+            if index < len(entries) and entries[index] == entry:
+                del entries[index]
+
+    def suggest(self, prefix, limit=8):
+        """
+        Up to `limit` suggestions whose key starts with `prefix`, best weighted first
+        """
+        prefix = ' '.join(prefix.lower().split())
+        if not prefix:
+            return []
+        snapshot = catalog_snapshot.current()
+        if snapshot is not None:
+            entries, results = None, self._snapshot_results
+        else:
+            self._ensure_built()
+            # Entries and the results cached from them are read as one consistent pair
+            entries, results = self._view
+
+        cache_key = (snapshot and snapshot.generation, prefix, limit)
+        cached = results.get(cache_key)
+        if cached is not None:
+            return cached
+
+        if snapshot is not None:
+            candidates = snapshot.suggestions(prefix)
+        else:
+            start = bisect_left(entries, (prefix,))
+            end = bisect_left(entries, (prefix + PREFIX_END,), start)
+            candidates = entries[start:end]
+        # Keys of one product can share a prefix, so take some spare candidates for de-duplication
+        ranked = heapq.nsmallest(limit * 4, candidates, key=lambda entry: entry[1])
+
+        suggestions = []
+        seen = set()
+        for _, _, label, kind, product_id in ranked:
+            if (kind, label) in seen:
+                continue
+            seen.add((kind, label))
+            suggestions.append({'text': label, 'type': kind, 'product_id': product_id})
+            if len(suggestions) >= limit:
+                break
+
+        if len(results) >= 10000:
+            results.clear()
+        results[cache_key] = suggestions
+        return suggestions
+
+
+suggest_index = SuggestIndex()
+
+
+# Connected here rather than in signals.py so the index and the chatbot
+# modules it depends on are only imported once suggestions are first used
+@receiver(post_save, sender=Product)
+def update_suggestions(sender, instance, **kwargs):
+    suggest_index.update_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_suggestions(sender, instance, **kwargs):
+    suggest_index.remove_product(instance.pk)
@@ -0,0 +1,157 @@
+import atexit
+import logging
+import queue
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import ChatMessage, DeferredTask
+
+logger = logging.getLogger(__name__)
+
+# task name -> handler called with a list of JSON payloads
+_handlers = {}
+
+
+def task(name):
+    """
+    Register a batch handler for deferred work. Handlers receive every pending
+    payload of their task at once, so they can write them with bulk queries.
+    """
+    def register(handler):
+        _handlers[name] = handler
+        return handler
+    return register
+
+
+def run_tasks(tasks):
+    """
+    Run (name, payload) pairs, grouping payloads by task name
+    """
+    grouped = defaultdict(list)
+    for name, payload in tasks:
+        grouped[name].append(payload)
+    for name, payloads in grouped.items():
+        _handlers[name](payloads)
+
+
+class WorkQueue:
+    """
+    In-process queue for post-response work, served by a small pool of daemon
+    threads. Workers take up to `batch_size` items at a time. When the queue
+    is full, the caller runs its task inline instead of dropping it.
+    """
+
+    def __init__(self, maxsize, batch_size, workers):
+        self.batch_size = batch_size
+        self.workers = workers
+        self._queue = queue.Queue(maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = defaultdict(int)
+
+    def _count(self, name, amount=1):
+        # Updated from request threads and every worker
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def stats_snapshot(self):
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def put(self, name, payload):
+        self._start()
+        try:
+            self._queue.put_nowait((name, payload))
+            self._count('queued')
+        except queue.Full:
+            self._count('ran_inline')
+            run_tasks([(name, payload)])
+
+    def _start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'work-queue-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                run_tasks(batch)
+                self._count('completed', len(batch))
+            except Exception:
+                self._count('failed', len(batch))
+                logger.exception("Deferred task batch failed")
+            finally:
+                close_old_connections()
+                for _ in batch:
+                    self._queue.task_done()
+
+    def drain(self):
+        """
+        Block until every queued item has been processed
+        """
+        if self._threads:
+            self._queue.join()
+
+
+work_queue = WorkQueue(
+    maxsize=settings.TASK_QUEUE_MAX_SIZE,
+    batch_size=settings.TASK_QUEUE_BATCH_SIZE,
+    workers=settings.TASK_QUEUE_WORKERS,
+)
+atexit.register(work_queue.drain)
+
+
+def defer(name, payload):
+    """
+    Schedule non-critical work after the current transaction commits.
+
+    TASK_QUEUE_MODE selects where it runs: 'thread' (in-process work queue),
+    'durable' (stored as DeferredTask rows for `manage.py run_deferred_tasks`)
+    or 'sync' (immediately, e.g. for tests).
+    """
+    if name not in _handlers:
+        raise KeyError(f"Unknown deferred task '{name}'")
+
+    mode = settings.TASK_QUEUE_MODE
+    if mode == 'durable':
+        DeferredTask.objects.create(name=name, payload=payload)
+    elif mode == 'sync':
+        transaction.on_commit(lambda: run_tasks([(name, payload)]))
+    else:
+        transaction.on_commit(lambda: work_queue.put(name, payload))
+
+
+@task('link_related_products')
+def link_related_products(payloads):
+    Through = ChatMessage.related_products.through
+    # Messages deleted before the task ran (session reset or deleted) are skipped
+    existing = set(ChatMessage.objects.filter(
+        pk__in=[payload['message_id'] for payload in payloads]
+    ).values_list('pk', flat=True))
+    links = [
+        Through(chatmessage_id=payload['message_id'], product_id=product_id)
+        for payload in payloads
+        if payload['message_id'] in existing
+        for product_id in payload['product_ids']
+    ]
+    Through.objects.bulk_create(links, ignore_conflicts=True)
+
+    # Imported here; tasks load at startup and the index pulls in the chatbot
+    from .suggest import suggest_index
+    suggest_index.record_links([link.product_id for link in links])
@@ -0,0 +1,99 @@
+import calendar
+import datetime
+
+from django import template
+from django.utils import formats, timezone
+from django.utils.text import capfirst
+from django.utils.translation import gettext as _
+
+register = template.Library()
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+@register.inclusion_tag('admin/date_hierarchy.html')
+def bounded_date_hierarchy(cl):
+    """
+    Drop-in for the admin's {% date_hierarchy %}. Django finds the years,
+    months or days that have rows with a DISTINCT over every matching row;
+    this offers each period between the first and last matching row instead,
+    found with two single-row index lookups. Periods without rows may be
+    listed.
+    """
+    field_name = cl.date_hierarchy
+    year_field = f'{field_name}__year'
+    month_field = f'{field_name}__month'
+    day_field = f'{field_name}__day'
+    year_lookup = cl.params.get(year_field)
+    month_lookup = cl.params.get(month_field)
+    day_lookup = cl.params.get(day_field)
+
+    def link(filters):
+        return cl.get_query_string(filters, [f'{field_name}__'])
+
+    if year_lookup and month_lookup and day_lookup:
+        day = datetime.date(int(year_lookup), int(month_lookup), int(day_lookup))
+        return {
+            'show': True,
+            'back': {
+                'link': link({year_field: year_lookup, month_field: month_lookup}),
+                'title': capfirst(formats.date_format(day, 'YEAR_MONTH_FORMAT')),
+            },
+            'choices': [{'title': capfirst(formats.date_format(day, 'MONTH_DAY_FORMAT'))}],
+        }
+
+    # Two ORDER BY ... LIMIT 1 queries rather than one MIN/MAX aggregate, which
+    # databases only answer from the index when it is the sole aggregate
+    dates = cl.queryset.order_by(field_name).values_list(field_name, flat=True)
+    first, last = dates.first(), dates.last()
+    if isinstance(first, datetime.datetime) and timezone.is_aware(first):
+        first, last = timezone.localtime(first), timezone.localtime(last)
+    if first is not None and not year_lookup and first.year == last.year:
+        year_lookup = first.year
+        if first.month == last.month:
+            month_lookup = first.month
+
+    def within_bounds(start, end):
+        return first is not None and start <= _as_date(last) and end >= _as_date(first)
+
+    if year_lookup and month_lookup:
+        year, month = int(year_lookup), int(month_lookup)
+        days = [
+            datetime.date(year, month, day)
+            for day in range(1, calendar.monthrange(year, month)[1] + 1)
+        ]
+        return {
+            'show': True,
+            'back': {'link': link({year_field: year_lookup}), 'title': str(year_lookup)},
+            'choices': [
+                {
+                    'link': link({year_field: year_lookup, month_field: month_lookup, day_field: day.day}),
+                    'title': capfirst(formats.date_format(day, 'MONTH_DAY_FORMAT')),
+                }
+                for day in days if within_bounds(day, day)
+            ],
+        }
+    elif year_lookup:
+        year = int(year_lookup)
+        months = [datetime.date(year, month, 1) for month in range(1, 13)]
+        return {
+            'show': True,
+            'back': {'link': link({}), 'title': _('All dates')},
+            'choices': [
+                {
+                    'link': link({year_field: year_lookup, month_field: month.month}),
+                    'title': capfirst(formats.date_format(month, 'YEAR_MONTH_FORMAT')),
+                }
+                for month in months
+                if within_bounds(month, month.replace(day=calendar.monthrange(year, month.month)[1]))
+            ],
+        }
+    else:
+        years = range(first.year, last.year + 1) if first is not None else []
+        return {
+            'show': True,
+            'back': None,
+            'choices': [{'link': link({year_field: str(year)}), 'title': str(year)} for year in years],
+        }
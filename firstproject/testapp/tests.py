@@ -1,3 +1,1503 @@
-from django.test import TestCase
+import asyncio
+import contextvars
+import datetime
+import gzip
+import importlib
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipIf
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.admin import site
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+
+from firstproject.asgi import application
+
+from . import chatbot_service
+from .analytics import CountMinSketch, HeavyHitters, QueryAnalytics, QueryObservation, query_analytics
+from .archive import archive_session, rehydrate_session
+from .batch import process_chat_batch
+from .caching import get_chat_session, user_cache
+from .catalog import CatalogIndex, catalog_changed, catalog_version
+from .chatbot_service import get_chatbot, render_product_card, spelling_index
+from .export import message_batches, pyarrow
+from .facets import compute_facets
+from .fields import RAW, ZLIB, ZLIB_DICT, compress_text, decompress_text, dictionaries
+from .management.commands import export_chats
+from .management.commands.run_deferred_tasks import claim_tasks
+from .middleware import CompressionMiddleware, PrimaryPinningMiddleware
+from .models import ChatArchive, ChatMessage, ChatSession, CompressionDictionary, DeferredTask, Product
+from .renderers import FastJSONRenderer
+from .routers import PrimaryReplicaRouter
+from .serializers import ChatMessageSerializer, ProductSerializer
+from .snapshot import FORMAT_VERSION, MAGIC, CatalogSnapshot, SnapshotLoader, write_snapshot
+from .suggest import SuggestIndex
+from .tasks import WorkQueue, task
+from .throttling import ConcurrencyLimiter, LocalBucketStore
+from .touches import session_touches
+from .websocket import CLOSE_IDLE, CLOSE_REJECTED
 
 # Create your tests here.
+
+# Payloads run by the 'test_record' deferred task
+recorded_payloads = []
+
+
+@task('test_record')
+def record_payloads(payloads):
+    for payload in payloads:
+        if payload.get('fail'):
+            raise ValueError('bad payload')
+    recorded_payloads.extend(payloads)
+
+
+def create_product(**fields):
+    return Product.objects.create(**{
+        'name': 'Apple MacBook Pro',
+        'category': 'laptops',
+        'price': Decimal('1999.99'),
+        'description': 'A fast laptop',
+        'stock': 5,
+        'rating': 4.5,
+        **fields,
+    })
+
+
+@override_settings(QUERY_ANALYTICS=False)
+class ChatTestCase(TestCase):
+    """
+    Logged-in API client with a chat session. Session touches are written
+    through and queries are not counted, so nothing is left to a background
+    thread when the test database goes away.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='secret-password')
+        self.client.force_login(self.user)
+        self.session = ChatSession.objects.create(user=self.user, session_id='test-session')
+        patcher = mock.patch.object(session_touches, 'interval', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Primary keys are reused once a test's rows are rolled back
+        cache.clear()
+        user_cache.clear()
+
+    def messages_url(self, session_id=None):
+        return f'/api/chat/sessions/{session_id or self.session.session_id}/messages/'
+
+
+class PrimaryReplicaRouterTests(TestCase):
+    """
+    Routing is checked through the router and middleware directly; the test
+    database has no replica aliases to run queries against
+    """
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        patcher = mock.patch.object(PrimaryReplicaRouter, '_replicas', return_value=['replica1'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _route(self, request, action=None):
+        """
+        Run `request` through PrimaryPinningMiddleware and return where a
+        Product read made by the view (after `action`) would go
+        """
+        routes = []
+
+        def view(request):
+            if action:
+                action()
+            routes.append(self.router.db_for_read(Product))
+            return HttpResponse()
+
+        middleware = PrimaryPinningMiddleware(view)
+        request.resolver_match = resolve(request.path)
+        middleware.process_request(request)
+        middleware.process_view(request, view, (), {})
+        response = view(request)
+        middleware.process_response(request, response)
+        return routes[0]
+
+    def test_catalog_reads_outside_requests_use_replica(self):
+        self.assertEqual(self.router.db_for_read(Product), 'replica1')
+        self.assertEqual(self.router.db_for_read(ChatSession), 'default')
+
+    def test_safe_request_reads_from_replica(self):
+        self.assertEqual(self._route(RequestFactory().get('/api/products/')), 'replica1')
+
+    def test_unsafe_request_reads_from_primary(self):
+        self.assertEqual(self._route(RequestFactory().put('/api/products/1/')), 'default')
+
+    def test_write_pins_rest_of_request(self):
+        request = RequestFactory().get('/api/products/')
+        self.assertEqual(self._route(request, lambda: self.router.db_for_write(Product)), 'default')
+
+    def test_admin_reads_from_primary(self):
+        self.assertEqual(self._route(RequestFactory().get('/admin/testapp/product/1/change/')), 'default')
+
+    def test_pin_ends_with_request(self):
+        self._route(RequestFactory().post('/api/products/'))
+        self.assertEqual(self.router.db_for_read(Product), 'replica1')
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='secret-password')
+        self.session = ChatSession.objects.create(user=self.user, session_id='archived-session')
+        self.product = create_product()
+        ChatMessage.objects.create(session=self.session, message_type='user', content='show me laptops')
+        self.bot_message = ChatMessage.objects.create(
+            session=self.session, message_type='bot', content='Here are some laptops',
+            product_snapshot=[self.product.snapshot()],
+        )
+        self.bot_message.related_products.set([self.product])
+
+    def test_archive_and_rehydrate_round_trip(self):
+        before = list(self.session.messages.values_list('pk', 'message_type', 'product_snapshot'))
+        self.assertEqual(archive_session(self.session), 2)
+        self.assertFalse(ChatMessage.objects.filter(session=self.session).exists())
+        self.assertEqual(ChatArchive.objects.get(session=self.session).message_count, 2)
+        self.assertTrue(ChatSession.objects.get(pk=self.session.pk).is_archived)
+
+        self.assertEqual(rehydrate_session(self.session), 2)
+        self.assertEqual(list(self.session.messages.values_list('pk', 'message_type', 'product_snapshot')), before)
+        self.assertEqual([str(message.content) for message in self.session.messages.all()],
+                         ['show me laptops', 'Here are some laptops'])
+        self.assertEqual(list(ChatMessage.objects.get(pk=self.bot_message.pk).related_products.all()), [self.product])
+        self.assertFalse(ChatArchive.objects.filter(session=self.session).exists())
+        self.assertFalse(ChatSession.objects.get(pk=self.session.pk).is_archived)
+
+    def test_rehydrate_with_stale_session_restores_once(self):
+        archive_session(self.session)
+        # Two requests that loaded the session before either restored it
+        first = ChatSession.objects.get(pk=self.session.pk)
+        second = ChatSession.objects.get(pk=self.session.pk)
+
+        self.assertEqual(rehydrate_session(first), 2)
+        self.assertEqual(rehydrate_session(second), 0)
+        self.assertFalse(second.is_archived)
+        self.assertEqual(self.session.messages.count(), 2)
+
+    def test_archive_chats_command(self):
+        call_command('archive_chats', days=0, stdout=StringIO())
+        self.assertTrue(ChatSession.objects.get(pk=self.session.pk).is_archived)
+        self.assertEqual(ChatArchive.objects.count(), 1)
+        self.assertEqual(ChatMessage.objects.count(), 0)
+
+
+class ConcurrentRehydrateTests(TransactionTestCase):
+
+    def test_concurrent_rehydrates_restore_once(self):
+        user = User.objects.create_user('shopper', password='secret-password')
+        session = ChatSession.objects.create(user=user, session_id='archived-session')
+        for index in range(20):
+            ChatMessage.objects.create(session=session, message_type='user', content=f'message {index}')
+        archive_session(session)
+
+        barrier = threading.Barrier(2)
+        results = []
+
+        def load_history():
+            try:
+                stale = ChatSession.objects.get(pk=session.pk)
+                barrier.wait()
+                results.append(rehydrate_session(stale))
+            except Exception as exc:
+                results.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=load_history) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results, key=repr), [0, 20])
+        self.assertEqual(session.messages.count(), 20)
+
+
+class ProductSnapshotTests(ChatTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.product = create_product()
+
+    def test_snapshot_is_served_in_product_serializer_shape(self):
+        message = ChatMessage.objects.create(
+            session=self.session, message_type='bot', content='Laptops',
+            product_snapshot=[Product.objects.get(pk=self.product.pk).snapshot()],
+        )
+        related = ChatMessageSerializer(message).data['related_products']
+        self.assertEqual(related, [ProductSerializer(self.product).data])
+
+    def test_chat_responses_include_description(self):
+        response = self.client.post(self.messages_url(), {'content': 'show me laptops'}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        expected = [ProductSerializer(self.product).data]
+        self.assertEqual(response.json()['bot_message']['related_products'], expected)
+
+        history = self.client.get(self.messages_url()).json()
+        self.assertEqual(history[-1]['related_products'], expected)
+        self.assertEqual(history[-1]['related_products'][0]['description'], 'A fast laptop')
+
+    def test_migration_backfills_full_snapshots(self):
+        message = ChatMessage.objects.create(session=self.session, message_type='bot', content='Laptops')
+        message.related_products.add(self.product)
+        migration = importlib.import_module('testapp.migrations.0006_chatmessage_product_snapshot')
+        migration.backfill_product_snapshots(apps, None)
+
+        message.refresh_from_db()
+        self.assertEqual(set(message.product_snapshot[0]), set(self.product.snapshot()))
+        self.assertEqual(ChatMessageSerializer(message).data['related_products'], [ProductSerializer(self.product).data])
+
+
+class ProductCardCacheTests(TestCase):
+
+    def setUp(self):
+        self.product = create_product()
+
+    def card(self):
+        return render_product_card(Product.objects.get(pk=self.product.pk))
+
+    def test_save_rerenders_card(self):
+        self.assertIn('$1999.99', self.card())
+        self.product.price = Decimal('1499.00')
+        self.product.save()
+        self.assertIn('$1499.00', self.card())
+
+    def test_queryset_update_rerenders_card(self):
+        self.assertIn('Stock: 5 available', self.card())
+        version = catalog_version()
+        Product.objects.filter(pk=self.product.pk).update(stock=0)
+        self.assertIn('Out of stock', self.card())
+        self.assertGreater(catalog_version(), version)
+
+    def test_bulk_update_rerenders_card(self):
+        self.assertIn('Rating: 4.5/5.0', self.card())
+        product = Product.objects.get(pk=self.product.pk)
+        product.rating = 3.0
+        Product.objects.bulk_update([product], ['rating'])
+        self.assertIn('Rating: 3.0/5.0', self.card())
+
+
+class ChatBatchTests(ChatTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.product = create_product()
+
+    def test_batch_answers_each_message_in_order(self):
+        result = process_chat_batch(self.user, [
+            {'content': 'show me laptops', 'session_id': self.session.session_id},
+            {'content': 'Show me  LAPTOPS', 'session_id': self.session.session_id},
+            {'content': 'help', 'session_id': self.session.session_id},
+        ])
+        self.assertEqual(result['stats']['messages'], 3)
+        self.assertEqual(result['stats']['distinct_queries'], 2)
+        self.assertEqual([row['product_ids'] for row in result['results']], [[self.product.pk], [self.product.pk], []])
+
+        messages = list(self.session.messages.values_list('message_type', 'content'))
+        self.assertEqual([kind for kind, _ in messages], ['user', 'bot'] * 3)
+        self.assertEqual(str(messages[2][1]), 'Show me  LAPTOPS')
+        bot_message = ChatMessage.objects.get(pk=result['results'][0]['bot_message_id'])
+        self.assertEqual(list(bot_message.related_products.all()), [self.product])
+
+    def test_messages_without_session_share_a_new_one(self):
+        result = process_chat_batch(self.user, [{'content': 'hello'}, {'content': 'bye'}])
+        session_ids = {row['session_id'] for row in result['results']}
+        self.assertEqual(len(session_ids), 1)
+        self.assertEqual(ChatSession.objects.get(session_id=session_ids.pop()).messages.count(), 4)
+
+    def test_unknown_session_is_reported(self):
+        other = User.objects.create_user('other', password='secret-password')
+        foreign = ChatSession.objects.create(user=other, session_id='foreign-session')
+        result = process_chat_batch(self.user, [{'content': 'hello', 'session_id': foreign.session_id}])
+        self.assertEqual(result['results'], [{'session_id': foreign.session_id, 'error': 'Session not found'}])
+        self.assertEqual(foreign.messages.count(), 0)
+
+    def test_chatbot_answers_the_text_as_sent(self):
+        with mock.patch.object(chatbot_service.ChatbotService, 'generate_response',
+                               return_value=('Hi', [])) as generate_response:
+            process_chat_batch(self.user, [{'content': 'Hello  THERE'}, {'content': 'hello there'}])
+        generate_response.assert_called_once_with('Hello  THERE', self.user, count=2)
+
+    def test_chat_batch_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'messages.jsonl')
+            output = os.path.join(directory, 'results.jsonl')
+            with open(source, 'w', encoding='utf-8') as f:
+                f.write('show me laptops\n\n')
+                f.write(json.dumps({'content': 'help', 'session_id': self.session.session_id}) + '\n')
+                f.write('Show me LAPTOPS\n')
+            stdout = StringIO()
+            call_command('chat_batch', source, user='shopper', chunk_size=2, output=output, stdout=stdout)
+            with open(output, encoding='utf-8') as f:
+                results = [json.loads(line) for line in f]
+
+        self.assertIn('Processed 3 message(s)', stdout.getvalue())
+        self.assertEqual([row['product_ids'] for row in results], [[self.product.pk], [], [self.product.pk]])
+        self.assertEqual(results[1]['session_id'], self.session.session_id)
+        # Lines without a session share one new session
+        self.assertEqual(results[0]['session_id'], results[2]['session_id'])
+        self.assertNotEqual(results[0]['session_id'], self.session.session_id)
+
+        with self.assertRaisesMessage(CommandError, "User 'nobody' does not exist"):
+            call_command('chat_batch', source, user='nobody', stdout=StringIO())
+
+    def test_batch_endpoint(self):
+        response = self.client.post('/api/chat/batch/', {'messages': [
+            {'content': 'show me laptops', 'session_id': self.session.session_id},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['results'][0]['product_ids'], [self.product.pk])
+
+        response = self.client.post('/api/chat/batch/', {'messages': []}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CachingTests(ChatTestCase):
+
+    def test_archived_history_is_restored_after_cached_lookup(self):
+        self.client.post(self.messages_url(), {'content': 'hello'}, content_type='application/json')
+        self.assertEqual(len(self.client.get(self.messages_url()).json()), 2)
+
+        call_command('archive_chats', days=0, stdout=StringIO())
+        self.assertTrue(ChatSession.objects.get(pk=self.session.pk).is_archived)
+
+        history = self.client.get(self.messages_url()).json()
+        self.assertEqual([message['content'] for message in history][0], 'hello')
+        self.assertEqual(len(history), 2)
+
+    def test_cached_session_needs_no_query(self):
+        self.client.post(self.messages_url(), {'content': 'hello'}, content_type='application/json')
+        self.assertEqual(len(self.client.get(self.messages_url()).json()), 2)
+        # Only the messages are read
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.client.get(self.messages_url()).json()), 2)
+
+    def test_reset_and_archive_drop_the_cached_session(self):
+        ChatMessage.objects.create(session=self.session, message_type='user', content='hello')
+        self.assertFalse(get_chat_session(self.user, self.session.session_id).is_archived)
+        archive_session(ChatSession.objects.get(pk=self.session.pk))
+        self.assertTrue(get_chat_session(self.user, self.session.session_id).is_archived)
+
+        self.client.post(f'/api/chat/sessions/{self.session.session_id}/reset/')
+        self.assertFalse(get_chat_session(self.user, self.session.session_id).is_archived)
+
+    def test_session_deleted_elsewhere_is_not_found(self):
+        self.assertEqual(get_chat_session(self.user, self.session.session_id), self.session)
+        # A bulk delete, e.g. from the admin, still sends post_delete for each session
+        ChatSession.objects.filter(pk=self.session.pk).delete()
+        self.assertIsNone(get_chat_session(self.user, self.session.session_id))
+        self.assertEqual(self.client.get(self.messages_url()).status_code, 404)
+
+    def test_other_users_session_is_not_found(self):
+        other = User.objects.create_user('other', password='secret-password')
+        self.assertIsNone(get_chat_session(other, self.session.session_id))
+        self.assertEqual(get_chat_session(self.user, self.session.session_id), self.session)
+        self.assertIsNone(get_chat_session(other, self.session.session_id))
+
+    def test_cached_user_needs_no_query(self):
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/auth/profile/').json()['user']['username'], 'shopper')
+
+    def test_password_change_invalidates_cached_user(self):
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 200)
+        self.user.set_password('another-password')
+        self.user.save()
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 403)
+
+
+class TokenBucketTests(ChatTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = LocalBucketStore()
+        patcher = mock.patch('testapp.throttling.bucket_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_refill(self):
+        with mock.patch('testapp.throttling.time.monotonic', return_value=100.0):
+            self.assertEqual([self.store.take('key', 3, 2)[0] for _ in range(4)], [True, True, True, False])
+            self.assertEqual(self.store.take('key', 3, 2), (False, 0.5))
+        with mock.patch('testapp.throttling.time.monotonic', return_value=100.5):
+            self.assertEqual(self.store.take('key', 3, 2), (True, 0))
+            self.assertFalse(self.store.take('key', 3, 2)[0])
+        # An idle bucket refills to its capacity, not beyond
+        with mock.patch('testapp.throttling.time.monotonic', return_value=1000.0):
+            self.assertEqual([self.store.take('key', 3, 2)[0] for _ in range(4)], [True, True, True, False])
+
+    @override_settings(RATE_LIMITS={
+        'chat': {'capacity': 1, 'refill_per_second': 0.001},
+        'chat_history': {'capacity': 2, 'refill_per_second': 0.001},
+    })
+    def test_history_reads_do_not_spend_the_chat_budget(self):
+        self.assertEqual(self.client.get(self.messages_url()).status_code, 200)
+        self.assertEqual(self.client.get(self.messages_url()).status_code, 200)
+        self.assertEqual(self.client.get(self.messages_url()).status_code, 429)
+
+        response = self.client.post(self.messages_url(), {'content': 'hello'}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(self.messages_url(), {'content': 'hello'}, content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    @override_settings(RATE_LIMITS={'product_search': {'capacity': 3, 'refill_per_second': 0.001}})
+    def test_forged_forwarded_for_shares_one_bucket(self):
+        self.client.logout()
+        statuses = [
+            self.client.post('/api/products/search/', {'query': 'laptop'}, content_type='application/json',
+                             HTTP_X_FORWARDED_FOR=f'10.0.0.{n}').status_code
+            for n in range(5)
+        ]
+        self.assertEqual(statuses, [200, 200, 200, 429, 429])
+        self.assertEqual(len(self.store), 1)
+
+    def test_full_buckets_are_dropped(self):
+        with mock.patch('testapp.throttling.time.monotonic', return_value=100.0):
+            store = LocalBucketStore(sweep_interval=10)
+            for n in range(100):
+                store.take(f'client {n}', 3, 1)
+            for _ in range(20):
+                store.take('busy', 30, 1)
+            self.assertEqual(len(store), 101)
+        # The one-off clients refilled after a few seconds; 'busy' needs 20
+        with mock.patch('testapp.throttling.time.monotonic', return_value=110.0):
+            store.take('late', 3, 1)
+            self.assertEqual(len(store), 2)
+            self.assertEqual(store.take('busy', 30, 1), (True, 0))
+
+
+class DeferredTaskTests(TestCase):
+
+    def setUp(self):
+        recorded_payloads.clear()
+        DeferredTask.objects.bulk_create([DeferredTask(name='test_record', payload={'n': n}) for n in range(5)])
+
+    def test_claims_do_not_overlap(self):
+        first_claim, first = claim_tasks(batch_size=3, max_attempts=5, lease=60)
+        second_claim, second = claim_tasks(batch_size=3, max_attempts=5, lease=60)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertNotEqual(first_claim, second_claim)
+        self.assertFalse({task.pk for task in first} & {task.pk for task in second})
+        self.assertEqual(claim_tasks(batch_size=3, max_attempts=5, lease=60), ('', []))
+
+    def test_expired_claim_is_taken_again(self):
+        claim, batch = claim_tasks(batch_size=5, max_attempts=5, lease=-1)
+        self.assertEqual(len(batch), 5)
+        new_claim, batch = claim_tasks(batch_size=5, max_attempts=5, lease=60)
+        self.assertEqual(len(batch), 5)
+        # The runner whose lease ran out can no longer delete the rows
+        DeferredTask.objects.filter(claim=claim).delete()
+        self.assertEqual(DeferredTask.objects.filter(claim=new_claim).count(), 5)
+
+    def test_runner_runs_each_task_once(self):
+        DeferredTask.objects.create(name='test_record', payload={'n': 5, 'fail': True})
+        call_command('run_deferred_tasks', batch_size=4, max_attempts=3, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(sorted(payload['n'] for payload in recorded_payloads), [0, 1, 2, 3, 4])
+
+        # Released after each failure and retried until it runs out of attempts
+        failed = DeferredTask.objects.get()
+        self.assertEqual((failed.attempts, failed.claim, failed.claimed_until), (3, '', None))
+        self.assertIn('bad payload', failed.last_error)
+
+    def test_queue_stats_are_counted_from_many_threads(self):
+        work_queue = WorkQueue(maxsize=1, batch_size=1, workers=1)
+        threads = [
+            threading.Thread(target=lambda: [work_queue._count('completed') for _ in range(10000)])
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(work_queue.stats_snapshot(), {'completed': 80000})
+
+
+class SessionTouchTests(ChatTestCase):
+
+    def test_buffer_writes_the_newest_touch_per_session(self):
+        other = ChatSession.objects.create(user=self.user, session_id='other-session')
+        moments = [timezone.now() + datetime.timedelta(minutes=minutes) for minutes in range(3)]
+        with mock.patch.object(session_touches, 'interval', 60):
+            session_touches.touch(self.session.pk, moments[2])
+            session_touches.touch(self.session.pk, moments[0])
+            session_touches.touch(other.pk, moments[1])
+            self.assertNotEqual(ChatSession.objects.get(pk=self.session.pk).updated_at, moments[2])
+            with self.assertNumQueries(1):
+                session_touches.flush()
+        self.assertEqual(ChatSession.objects.get(pk=self.session.pk).updated_at, moments[2])
+        self.assertEqual(ChatSession.objects.get(pk=other.pk).updated_at, moments[1])
+
+
+class CompressedTextFieldTests(ChatTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(self.forget_dictionaries)
+        self.forget_dictionaries()
+
+    def forget_dictionaries(self):
+        dictionaries.reset()
+        dictionaries._by_id.clear()
+
+    def stored(self, message):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT content FROM testapp_chatmessage WHERE id = %s', [message.pk])
+            return bytes(cursor.fetchone()[0])
+
+    def reload(self, message):
+        return ChatMessage.objects.get(pk=message.pk).content
+
+    def test_round_trip_of_each_format(self):
+        short = 'hi there'
+        long = 'Here are the laptops I found for you:\n' + '- Apple MacBook Pro, $1999.99\n' * 20
+        dictionary = CompressionDictionary.objects.create(
+            data=b'Here are the laptops I found for you:\n', sample_count=1, is_active=True
+        )
+        self.assertEqual(compress_text(short)[:1], RAW)
+        self.assertEqual(compress_text(long, dictionary=None)[:1], ZLIB)
+        self.assertEqual(compress_text(long)[:1], ZLIB_DICT)
+
+        for content, tag in [(short, RAW), (long, ZLIB_DICT), ('ünïcødé ' * 40, ZLIB_DICT)]:
+            message = ChatMessage.objects.create(session=self.session, message_type='bot', content=content)
+            self.assertEqual(self.stored(message)[:1], tag)
+            if tag == ZLIB_DICT:
+                self.assertEqual(struct.unpack('>I', self.stored(message)[1:5]), (dictionary.pk,))
+            self.assertEqual(self.reload(message), content)
+            self.assertEqual(str(ChatMessage.objects.values_list('content', flat=True).get(pk=message.pk)), content)
+
+        dictionary.is_active = False
+        dictionary.save()
+        self.forget_dictionaries()
+        message = ChatMessage.objects.create(session=self.session, message_type='bot', content=long)
+        self.assertEqual(self.stored(message)[:1], ZLIB)
+        self.assertLess(len(self.stored(message)), len(long))
+        self.assertEqual(self.reload(message), long)
+
+    def test_old_messages_read_after_dictionary_rotation(self):
+        text = 'Great choice! Here is what I found in laptops:\n' * 5
+        first = CompressionDictionary.objects.create(data=b'found in laptops', sample_count=1, is_active=True)
+        old = ChatMessage.objects.create(session=self.session, message_type='bot', content=text)
+
+        CompressionDictionary.objects.filter(pk=first.pk).update(is_active=False)
+        second = CompressionDictionary.objects.create(data=b'Great choice! Here is', sample_count=1, is_active=True)
+        self.forget_dictionaries()
+        new = ChatMessage.objects.create(session=self.session, message_type='bot', content=text)
+
+        self.assertEqual(struct.unpack('>I', self.stored(old)[1:5]), (first.pk,))
+        self.assertEqual(struct.unpack('>I', self.stored(new)[1:5]), (second.pk,))
+        # A fresh process reads each message with the dictionary it was written with
+        self.forget_dictionaries()
+        self.assertEqual(self.reload(old), text)
+        self.assertEqual(self.reload(new), text)
+
+    def test_legacy_plain_text_is_read_as_is(self):
+        self.assertEqual(decompress_text('stored as text'), 'stored as text')
+        self.assertEqual(decompress_text(memoryview('plain bytes ✓'.encode('utf-8'))), 'plain bytes ✓')
+
+        message = ChatMessage.objects.create(session=self.session, message_type='user', content='placeholder')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE testapp_chatmessage SET content = %s WHERE id = %s',
+                [connection.Database.Binary('written before compression'.encode('utf-8')), message.pk],
+            )
+        self.assertEqual(self.reload(message), 'written before compression')
+
+
+class CompressContentMigrationTests(TransactionTestCase):
+
+    migrate_from = [('testapp', '0008_deferred_task')]
+    migrate_to = [('testapp', '0009_compressed_message_content')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_existing_content_survives(self):
+        old_apps = self.migrate(self.migrate_from)
+        user = old_apps.get_model('auth', 'User').objects.create(username='shopper')
+        session = old_apps.get_model('testapp', 'ChatSession').objects.create(user=user, session_id='old-session')
+        Message = old_apps.get_model('testapp', 'ChatMessage')
+        contents = ['hello', 'Here are some laptops:\n' + '- Apple MacBook Pro\n' * 30, '']
+        pks = [Message.objects.create(session=session, message_type='user', content=content).pk for content in contents]
+
+        new_apps = self.migrate(self.migrate_to)
+        Message = new_apps.get_model('testapp', 'ChatMessage')
+        self.assertEqual([Message.objects.get(pk=pk).content for pk in pks], contents)
+        self.assertEqual([ChatMessage.objects.get(pk=pk).content for pk in pks], contents)
+
+        old_apps = self.migrate(self.migrate_from)
+        Message = old_apps.get_model('testapp', 'ChatMessage')
+        self.assertEqual([Message.objects.get(pk=pk).content for pk in pks], contents)
+
+
+class SpellingCorrectionTests(ChatTestCase):
+
+    def setUp(self):
+        super().setUp()
+        create_product()
+        create_product(name='Dinner Plate', category='kitchen-accessories',
+                       description='Other colour options, cheap to replace', price=Decimal('9.99'))
+        create_product(name='Wireless Mouse', category='mobile-accessories', description='Quiet clicks')
+
+    def test_typos_are_corrected(self):
+        self.assertEqual(spelling_index.correct('Show me LAPTPOS'), 'Show me laptops')
+        self.assertEqual(spelling_index.correct('a wireles mouse'), 'a wireless mouse')
+
+    def test_dictionary_words_are_kept_as_written(self):
+        for text in ['cheaper options please', 'I need a gift for Mother', 'Stories for my nieces', 'PLATES under $20']:
+            self.assertEqual(spelling_index.correct(text), text)
+
+    def test_corrected_text_is_only_used_for_retrieval(self):
+        with mock.patch.object(query_analytics, 'record') as record:
+            response, products = get_chatbot().generate_response('I NEED a wireles mouse', self.user)
+        self.assertEqual([product.name for product in products], ['Wireless Mouse'])
+        observation = record.call_args.args[0]
+        self.assertEqual((observation.query, observation.terms), ('i need a wireles mouse', ['wireles', 'mouse']))
+
+        with mock.patch.object(query_analytics, 'record'):
+            response, products = get_chatbot().generate_response('find a blendr', self.user)
+        self.assertEqual(products, [])
+        self.assertIn("matching 'blendr'", response)
+
+
+class FacetTests(TestCase):
+
+    def setUp(self):
+        Product.objects.bulk_create([
+            Product(name=f'Laptop {n}', category='laptops', price=Decimal('999.00'), description='Laptop',
+                    stock=5, rating=4.6)
+            for n in range(25)
+        ])
+        create_product(name='Plain Shirt', category='mens-shirts', price=Decimal('20.00'), description='Cotton',
+                       stock=0, rating=3.2)
+        create_product(name='Steel Watch', category='mens-watches', price=Decimal('75.00'), description='Steel',
+                       stock=2, rating=4.0)
+        # bulk_create sends no signals
+        catalog_changed()
+
+    def search(self, **data):
+        response = self.client.post('/api/products/search/', data, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_facets_count_the_whole_match_set(self):
+        with self.assertNumQueries(2):
+            facets = compute_facets(Product.objects.all())
+        self.assertEqual(facets['total'], 27)
+        self.assertEqual(facets['categories'], [
+            {'value': 'laptops', 'count': 25}, {'value': 'mens-shirts', 'count': 1}, {'value': 'mens-watches', 'count': 1},
+        ])
+        self.assertEqual([bucket['count'] for bucket in facets['price']], [1, 1, 0, 25])
+        self.assertEqual([band['count'] for band in facets['rating']], [25, 26, 27])
+        self.assertEqual(facets['stock'], {'in_stock': 26, 'out_of_stock': 1})
+
+        result = self.search(query='laptop')
+        self.assertEqual(result['count'], 20)
+        self.assertEqual(result['facets']['total'], 25)
+
+    def test_filtered_and_unfiltered_searches(self):
+        result = self.search(max_price='100')
+        self.assertEqual(result['facets']['total'], 1)
+        self.assertEqual(result['facets']['categories'], [{'value': 'mens-watches', 'count': 1}])
+
+        self.assertEqual(self.search()['facets'], compute_facets(Product.objects.filter(stock__gt=0)))
+        self.assertEqual(self.search(in_stock_only=False)['facets']['total'], 27)
+        self.assertNotIn('facets', self.search(query='laptop', include_facets=False))
+
+    def test_catalog_facets_follow_product_changes(self):
+        self.assertEqual(self.search()['facets']['total'], 26)
+        create_product(name='Desk Lamp', category='home-decoration', price=Decimal('30.00'))
+        facets = self.search()['facets']
+        self.assertEqual(facets['total'], 27)
+        self.assertIn({'value': 'home-decoration', 'count': 1}, facets['categories'])
+
+
+class SuggestIndexTests(TestCase):
+
+    def setUp(self):
+        self.index = SuggestIndex()
+        self.product = create_product()
+
+    def test_suggestions_follow_product_changes(self):
+        self.assertEqual(self.index.suggest('pro'), [
+            {'text': 'Apple MacBook Pro', 'type': 'product', 'product_id': self.product.pk},
+        ])
+        self.product.name = 'Apple MacBook Air'
+        self.index.update_product(self.product)
+        self.assertEqual(self.index.suggest('pro'), [])
+        self.assertEqual(len(self.index.suggest('air')), 1)
+        self.assertEqual([row['text'] for row in self.index.suggest('air')], ['Apple MacBook Air'])
+        self.index.remove_product(self.product.pk)
+        self.assertEqual(self.index.suggest('air'), [])
+
+    def test_lookups_during_updates_see_whole_lists(self):
+        self.index.suggest('apple')
+        entries, results = self.index._view
+        self.product.name = 'Apple Watch'
+        self.index.update_product(self.product)
+        # Readers holding the old view keep a consistent list and cache
+        self.assertEqual([entry[2] for entry in entries if entry[0] == 'pro'], ['Apple MacBook Pro'])
+        self.assertIn((None, 'apple', 8), results)
+        self.assertEqual(self.index._view[1], {})
+
+        errors = []
+        stop = threading.Event()
+
+        def read():
+            while not stop.is_set():
+                try:
+                    texts = {row['text'] for row in self.index.suggest('apple')}
+                    if len(texts) != 1:
+                        errors.append(texts)
+                except Exception as exc:
+                    errors.append(exc)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        for n in range(300):
+            self.product.name = f'Apple Model {n}'
+            self.index.update_product(self.product)
+        stop.set()
+        for reader in readers:
+            reader.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.index.suggest('apple'), [
+            {'text': 'Apple Model 299', 'type': 'product', 'product_id': self.product.pk},
+        ])
+
+
+    def test_recommendations_raise_popularity(self):
+        other = create_product(name='Apple Pro Display', rating=4.6)
+        self.assertEqual([row['text'] for row in self.index.suggest('pro')], ['Apple Pro Display', 'Apple MacBook Pro'])
+        self.index.record_links([self.product.pk] * 3)
+        self.assertEqual([row['text'] for row in self.index.suggest('pro')], ['Apple MacBook Pro', 'Apple Pro Display'])
+        self.assertEqual(self.index._popularity, {self.product.pk: 3})
+        self.assertNotIn(other.pk, self.index._popularity)
+
+    def test_expired_index_is_rebuilt_in_the_background(self):
+        self.assertEqual(len(self.index.suggest('pro')), 1)
+        building = threading.Event()
+        release = threading.Event()
+        # Built here: the background thread's connection cannot see this test's uncommitted rows
+        Product.objects.filter(pk=self.product.pk).update(name='Apple MacBook Air')
+        rebuilt = self.index.build_entries()
+
+        def slow_build_entries():
+            building.set()
+            release.wait(10)
+            return rebuilt
+
+        with override_settings(CATALOG_INDEX_MAX_AGE=-1), \
+                mock.patch.object(self.index, 'build_entries', slow_build_entries):
+            # Served from the current list while the rebuild waits
+            self.assertEqual(len(self.index.suggest('pro')), 1)
+            self.assertTrue(building.wait(10))
+            self.assertEqual(len(self.index.suggest('pro')), 1)
+            release.set()
+            self.index._refresh.thread.join(10)
+        self.assertEqual(self.index.suggest('pro'), [])
+        self.assertEqual(len(self.index.suggest('air')), 1)
+
+
+class CatalogIndexTests(TestCase):
+
+    class Counter(CatalogIndex):
+        def __init__(self):
+            super().__init__()
+            self.builds = 0
+            self.release = threading.Event()
+
+        def build(self):
+            if self.builds:
+                self.release.wait(10)
+            self.builds += 1
+            return self.builds
+
+    def test_expired_index_is_rebuilt_in_the_background(self):
+        index = self.Counter()
+        self.assertEqual(index.get(), 1)
+        with override_settings(CATALOG_INDEX_MAX_AGE=-1):
+            self.assertEqual(index.get(), 1)
+            self.assertEqual(index.get(), 1)
+            index.release.set()
+            index._refresh.thread.join(10)
+        self.assertEqual(index.get(), 2)
+
+    def test_local_product_changes_rebuild_before_the_lookup(self):
+        index = self.Counter()
+        index.release.set()
+        self.assertEqual(index.get(), 1)
+        catalog_changed()
+        self.assertEqual(index.get(), 2)
+
+
+class CatalogSnapshotTests(TestCase):
+
+    def setUp(self):
+        self.product = create_product()
+        create_product(name='Plain Shirt', category='mens-shirts', description='Cotton shirt')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'catalog.snapshot')
+        call_command('build_catalog_snapshot', path=self.path, stdout=StringIO())
+        self.loader = SnapshotLoader()
+        settings_patch = override_settings(CATALOG_SNAPSHOT_PATH=self.path, CATALOG_SNAPSHOT_CHECK_INTERVAL=-1)
+        settings_patch.enable()
+        self.addCleanup(settings_patch.disable)
+
+    def publish(self, data):
+        with open(self.path + '.new', 'wb') as file:
+            file.write(data)
+        os.replace(self.path + '.new', self.path)
+
+    def test_round_trip(self):
+        snapshot = CatalogSnapshot(self.path)
+        entries, _ = SuggestIndex().build_entries()
+        for prefix in ['pro', 'apple', 'mens', 'z']:
+            expected = [entry for entry in entries if entry[0].startswith(prefix)]
+            self.assertEqual(snapshot.suggestions(prefix), expected)
+
+        spelling = spelling_index.build()
+        self.assertEqual(len(snapshot.words), len(spelling.words))
+        self.assertTrue(all(snapshot.words[word] == count for word, count in spelling.words.items()))
+        self.assertTrue(all(sorted(snapshot.deletes[key]) == sorted(words) for key, words in spelling.deletes.items()))
+        self.assertNotIn('laptpo', snapshot.words)
+        self.assertEqual(snapshot.facets[False], compute_facets(Product.objects.all()))
+        self.assertEqual(snapshot.generation, 1)
+
+    def test_large_product_ids(self):
+        product_id = 2 ** 40 + 7
+        write_snapshot(self.path, [('widget', -4.5, 'Widget', 'product', product_id)], spelling_index.build(),
+                       {False: {}, True: {}})
+        self.assertEqual(CatalogSnapshot(self.path).suggestions('wid'), [('widget', -4.5, 'Widget', 'product', product_id)])
+
+    def test_unreadable_files_fall_back_to_rebuilt_indexes(self):
+        self.assertEqual(self.loader.current().generation, 1)
+        with open(self.path, 'rb') as file:
+            data = file.read()
+
+        index = SuggestIndex()
+        with mock.patch('testapp.suggest.catalog_snapshot', self.loader):
+            for unreadable in [data[:len(data) // 2], data[:10], b'', data.replace(MAGIC, b'NOTASNAP', 1),
+                               data[:8] + struct.pack('>H', FORMAT_VERSION - 1) + data[10:]]:
+                self.publish(unreadable)
+                with self.assertLogs('testapp.snapshot', 'ERROR'):
+                    self.assertIsNone(self.loader.current())
+                self.assertEqual([row['text'] for row in index.suggest('pro')], ['Apple MacBook Pro'])
+
+            self.publish(data)
+            self.assertEqual(self.loader.current().generation, 1)
+
+    def test_product_change_makes_snapshot_stale(self):
+        self.assertIsNotNone(self.loader.current())
+        self.product.name = 'Apple MacBook Air'
+        self.product.save()
+        self.assertIsNone(self.loader.current())
+        index = SuggestIndex()
+        with mock.patch('testapp.suggest.catalog_snapshot', self.loader):
+            self.assertEqual([row['text'] for row in index.suggest('air')], ['Apple MacBook Air'])
+
+        call_command('build_catalog_snapshot', path=self.path, stdout=StringIO())
+        snapshot = self.loader.current()
+        self.assertEqual(snapshot.generation, 2)
+        self.assertEqual([entry[2] for entry in snapshot.suggestions('air')], ['Apple MacBook Air'])
+
+
+class StartupTests(TestCase):
+
+    def test_chatbot_is_built_once_under_concurrency(self):
+        built = []
+
+        class SlowChatbot:
+            def __init__(self):
+                time.sleep(0.05)
+                built.append(self)
+
+        results = []
+        with mock.patch.object(chatbot_service, '_chatbot', None), \
+                mock.patch.object(chatbot_service, 'ChatbotService', SlowChatbot):
+            threads = [threading.Thread(target=lambda: results.append(get_chatbot())) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(built), 1)
+        self.assertEqual(results, built * 8)
+
+    def test_loading_the_application_does_not_build_the_chatbot(self):
+        script = (
+            "import sys\n"
+            "from firstproject.asgi import application\n"
+            "from django.urls import get_resolver\n"
+            "get_resolver().url_patterns\n"
+            "lazy = ['testapp.chat', 'testapp.chatbot_service', 'testapp.fuzzy', 'testapp.snapshot', 'testapp.suggest']\n"
+            "print(','.join(name for name in lazy if name in sys.modules))\n"
+        )
+        environment = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'firstproject.settings', 'STARTUP_WARMUP': ''}
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, env=environment,
+            capture_output=True, text=True, timeout=60,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '')
+
+
+class ResponseEncodingTests(TestCase):
+
+    data = {
+        'price': Decimal('19.90'),
+        'at': datetime.datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=datetime.timezone.utc),
+        'local': datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=5))),
+        'day': datetime.date(2024, 1, 2),
+        'id': uuid.UUID(int=5),
+        'label': gettext_lazy('Laptops'),
+        'text': 'Café ☕ <b>  ',
+        'nested': [{1: None, 'rating': 4.5, 'flags': (True, False)}],
+    }
+
+    def test_fast_renderer_matches_drf(self):
+        self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        self.assertIn(b'\\u2028\\u2029', FastJSONRenderer().render(self.data))
+        huge = {'count': 2 ** 70}
+        self.assertEqual(FastJSONRenderer().render(huge), JSONRenderer().render(huge))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+        with mock.patch('testapp.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+
+        indented = FastJSONRenderer().render(self.data, 'application/json; indent=2')
+        self.assertEqual(indented, JSONRenderer().render(self.data, 'application/json; indent=2'))
+
+    def compress(self, path='/api/products/', body=b'{"name": "laptop"}' * 100, encoding='gzip', **headers):
+        request = RequestFactory().get(path, HTTP_ACCEPT_ENCODING=encoding)
+        response = HttpResponse(body, content_type='application/json', headers=headers)
+        return CompressionMiddleware(lambda request: response).process_response(request, response)
+
+    def test_large_api_responses_are_compressed(self):
+        body = b'{"name": "laptop"}' * 100
+        response = self.compress(body=body, ETag='"v1"')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), body)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['ETag'], 'W/"v1"')
+
+    def test_responses_left_uncompressed(self):
+        for response in [
+            self.compress(body=b'{}'),
+            self.compress(path='/admin/'),
+            self.compress(encoding='identity'),
+            self.compress(encoding='gzip;q=0, identity'),
+            self.compress(body=os.urandom(4096)),
+        ]:
+            self.assertFalse(response.has_header('Content-Encoding'))
+
+        with mock.patch('testapp.middleware.brotli', None):
+            self.assertEqual(self.compress(encoding='br, gzip;q=0.5')['Content-Encoding'], 'gzip')
+
+    def test_api_client_gets_compressed_products(self):
+        Product.objects.bulk_create([
+            Product(name=f'Laptop {n}', category='laptops', price=Decimal('999.00'), description='Laptop' * 10,
+                    stock=5, rating=4.5)
+            for n in range(20)
+        ])
+        plain = self.client.get('/api/products/')
+        compressed = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(compressed.content)), plain.json())
+
+
+class WebSocketClient:
+    """
+    Drives the ASGI application's WebSocket handling in process
+    """
+
+    def __init__(self, path, headers):
+        self.inbox = asyncio.Queue()
+        self.outbox = asyncio.Queue()
+        scope = {'type': 'websocket', 'path': path, 'headers': headers, 'subprotocols': []}
+        # A fresh context, as for a connection accepted by a server
+        self.task = asyncio.create_task(
+            application(scope, self.inbox.get, self.outbox.put), context=contextvars.Context()
+        )
+
+    async def connect(self):
+        await self.inbox.put({'type': 'websocket.connect'})
+        return await self.receive()
+
+    async def send(self, frame):
+        await self.inbox.put({'type': 'websocket.receive', 'text': json.dumps(frame)})
+
+    async def receive(self):
+        return await asyncio.wait_for(self.outbox.get(), 10)
+
+    async def receive_json(self):
+        message = await self.receive()
+        self.assert_type(message, 'websocket.send')
+        return json.loads(message['text'])
+
+    def assert_type(self, message, expected):
+        if message['type'] != expected:
+            raise AssertionError(f"Expected {expected}, got {message}")
+
+    async def close(self):
+        await self.inbox.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(self.task, 10)
+
+
+@override_settings(QUERY_ANALYTICS=False)
+class WebSocketTests(TransactionTestCase):
+    """
+    Socket handlers use their own database connections, so the rows they
+    read must be committed
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='secret-password')
+        self.session = ChatSession.objects.create(user=self.user, session_id='socket-session')
+        self.product = create_product()
+        self.client.force_login(self.user)
+        for patcher in [
+            mock.patch.object(session_touches, 'interval', 0),
+            mock.patch('testapp.websocket.bucket_store', LocalBucketStore()),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache.clear()
+        user_cache.clear()
+
+    def socket(self, session_id='socket-session', cookie=True):
+        headers = [(b'host', b'testserver')]
+        if cookie:
+            cookie_value = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+            headers.append((b'cookie', f'{settings.SESSION_COOKIE_NAME}={cookie_value}'.encode('latin-1')))
+        return WebSocketClient(f'/ws/chat/{session_id}/', headers)
+
+    async def test_unauthenticated_and_foreign_sockets_are_rejected(self):
+        other = await User.objects.acreate_user('other', password='secret-password')
+        await ChatSession.objects.acreate(user=other, session_id='foreign-session')
+        for socket in [self.socket(cookie=False), self.socket('foreign-session'), self.socket('missing-session')]:
+            self.assertEqual(await socket.connect(), {'type': 'websocket.close', 'code': CLOSE_REJECTED})
+            await asyncio.wait_for(socket.task, 10)
+
+    async def test_message_round_trip(self):
+        socket = self.socket()
+        self.assertEqual((await socket.connect())['type'], 'websocket.accept')
+
+        await socket.send({'type': 'ping'})
+        self.assertEqual(await socket.receive_json(), {'type': 'pong'})
+
+        await socket.send({'content': 'show me laptops'})
+        user_frame = await socket.receive_json()
+        bot_frame = await socket.receive_json()
+        self.assertEqual((user_frame['type'], user_frame['message']['content']), ('user_message', 'show me laptops'))
+        self.assertEqual(bot_frame['type'], 'bot_message')
+        self.assertEqual([product['id'] for product in bot_frame['message']['related_products']], [self.product.pk])
+
+        await socket.send({'content': ''})
+        self.assertEqual((await socket.receive_json())['type'], 'error')
+        await socket.close()
+        self.assertEqual(await ChatMessage.objects.filter(session=self.session).acount(), 2)
+
+    async def test_archived_session_is_restored_when_the_socket_opens(self):
+        await ChatMessage.objects.acreate(session=self.session, message_type='user', content='hello before')
+        await sync_to_async(archive_session)(self.session)
+
+        socket = self.socket()
+        self.assertEqual((await socket.connect())['type'], 'websocket.accept')
+        await socket.send({'content': 'hello again'})
+        await socket.receive_json()
+        await socket.receive_json()
+        await socket.close()
+
+        session = await ChatSession.objects.aget(pk=self.session.pk)
+        self.assertFalse(session.is_archived)
+        self.assertFalse(await ChatArchive.objects.filter(session=session).aexists())
+        contents = [str(message.content) async for message in ChatMessage.objects.filter(session=session)]
+        self.assertEqual(contents[0], 'hello before')
+        self.assertEqual(contents[1], 'hello again')
+
+    async def test_full_queue_stops_reading(self):
+        release = threading.Event()
+
+        def answer(user, session, text):
+            release.wait(10)
+            return [{'type': 'pong'}]
+
+        with self.settings(WEBSOCKET_MAX_PENDING=2), mock.patch('testapp.websocket._answer', answer):
+            socket = self.socket()
+            self.assertEqual((await socket.connect())['type'], 'websocket.accept')
+            for _ in range(5):
+                await socket.send({'type': 'ping'})
+            await asyncio.sleep(0.2)
+            # One frame is being answered, two are queued, one waits to be queued and one is unread
+            self.assertEqual(socket.inbox.qsize(), 1)
+
+            release.set()
+            for _ in range(5):
+                self.assertEqual(await socket.receive_json(), {'type': 'pong'})
+            self.assertEqual(socket.inbox.qsize(), 0)
+            await socket.close()
+
+    async def test_idle_socket_is_closed(self):
+        with self.settings(WEBSOCKET_IDLE_TIMEOUT=0.2):
+            socket = self.socket()
+            self.assertEqual((await socket.connect())['type'], 'websocket.accept')
+            await socket.send({'type': 'ping'})
+            self.assertEqual(await socket.receive_json(), {'type': 'pong'})
+            self.assertEqual(await socket.receive(), {'type': 'websocket.close', 'code': CLOSE_IDLE})
+            await asyncio.wait_for(socket.task, 10)
+
+    async def test_many_sockets_share_threads(self):
+        threads_before = threading.active_count()
+        with self.settings(RATE_LIMITS={}):
+            sockets = [self.socket() for _ in range(50)]
+            accepted = await asyncio.gather(*[socket.connect() for socket in sockets])
+            self.assertEqual({message['type'] for message in accepted}, {'websocket.accept'})
+
+            for socket in sockets:
+                await socket.send({'content': 'show me laptops'})
+            for socket in sockets:
+                self.assertEqual((await socket.receive_json())['type'], 'user_message')
+                self.assertEqual((await socket.receive_json())['type'], 'bot_message')
+            # Open sockets do not each hold a thread (and its database connection)
+            self.assertLess(threading.active_count() - threads_before, 10)
+            await asyncio.gather(*[socket.close() for socket in sockets])
+        self.assertEqual(await ChatMessage.objects.filter(session=self.session).acount(), 100)
+
+
+class AdminPagingTests(TestCase):
+
+    def setUp(self):
+        admin_user = User.objects.create_superuser('admin', password='secret-password')
+        self.client.force_login(admin_user)
+        self.products = [
+            create_product(name=f'Product {n}', category='laptops' if n % 2 else 'beauty') for n in range(7)
+        ]
+        patcher = mock.patch.object(site._registry[Product], 'list_per_page', 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def changelist(self, query=''):
+        response = self.client.get(f'/admin/testapp/product/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def test_keyset_pages_walk_every_row_newest_first(self):
+        seen = []
+        query = ''
+        for page in range(3):
+            cl = self.changelist(query)
+            self.assertTrue(cl.keyset)
+            self.assertEqual(bool(cl.first_page_url), page > 0)
+            seen.extend(product.pk for product in cl.result_list)
+            query = cl.next_page_url
+        self.assertIsNone(query)
+        self.assertEqual(seen, sorted((product.pk for product in self.products), reverse=True))
+
+    def test_links_from_later_pages_start_from_the_newest_rows(self):
+        cl = self.changelist(self.changelist().next_page_url)
+        self.assertNotIn('after=', cl.get_query_string({'o': '1'}))
+        self.assertNotIn('after=', cl.get_query_string({'category__exact': 'beauty'}))
+        self.assertNotIn('after=', cl.first_page_url)
+
+        cl = self.changelist('?category__exact=beauty')
+        self.assertEqual([product.name for product in cl.result_list], ['Product 6', 'Product 4', 'Product 2'])
+        self.assertIn('category__exact=beauty', cl.next_page_url)
+        cl = self.changelist(cl.next_page_url)
+        self.assertEqual([product.name for product in cl.result_list], ['Product 0'])
+
+    def test_sorted_lists_use_numbered_pages(self):
+        cl = self.changelist('?o=1&p=2')
+        self.assertFalse(cl.keyset)
+        self.assertEqual(cl.paginator.num_pages, 3)
+        self.assertEqual([product.name for product in cl.result_list], ['Product 3', 'Product 4', 'Product 5'])
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=5)
+    def test_counts_stop_at_the_limit(self):
+        response = self.client.get('/admin/testapp/product/')
+        self.assertTrue(response.context['cl'].paginator.capped)
+        self.assertContains(response, 'More than 5 products')
+        response = self.client.get('/admin/testapp/product/?category__exact=beauty')
+        self.assertContains(response, '4 products')
+
+    def test_date_drill_down_covers_the_matching_range(self):
+        user = User.objects.create_user('shopper', password='secret-password')
+        for session_id, created_at in [
+            ('old', datetime.datetime(2023, 11, 5, 12)),
+            ('new', datetime.datetime(2024, 2, 20, 12)),
+            ('newest', datetime.datetime(2024, 4, 1, 12)),
+        ]:
+            ChatSession.objects.create(user=user, session_id=session_id)
+            ChatSession.objects.filter(session_id=session_id).update(created_at=timezone.make_aware(created_at))
+
+        response = self.client.get('/admin/testapp/chatsession/')
+        self.assertEqual([choice['title'] for choice in response.context['choices']], ['2023', '2024'])
+        # Every month between the first and last matching row, including March, which has none
+        response = self.client.get('/admin/testapp/chatsession/?created_at__year=2024')
+        self.assertEqual(
+            [choice['title'] for choice in response.context['choices']],
+            ['February 2024', 'March 2024', 'April 2024'],
+        )
+
+
+@override_settings(QUERY_ANALYTICS=False)
+class ChatExportStreamingTests(TestCase):
+
+    def setUp(self):
+        staff = User.objects.create_user('staff', password='secret-password', is_staff=True)
+        session = ChatSession.objects.create(user=staff, session_id='export-session')
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=session, message_type='user', content=f'message {n}') for n in range(5)
+        ])
+        self.client.force_login(staff)
+        self.async_client.force_login(staff)
+        patcher = mock.patch('testapp.middleware.concurrency_limiter', ConcurrencyLimiter({'/api/': 1}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def rows(self, content):
+        return [json.loads(line)['content'] for line in content.decode('utf-8').splitlines()]
+
+    def test_stream_holds_its_concurrency_slot_until_closed(self):
+        response = self.client.get('/api/admin/chats/export/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.is_async)
+        self.assertEqual(self.client.get('/api/products/').status_code, 429)
+
+        self.assertEqual(self.rows(b''.join(response.streaming_content)), [f'message {n}' for n in range(5)])
+        self.assertEqual(self.client.get('/api/products/').status_code, 200)
+
+    async def test_asgi_requests_get_an_async_stream(self):
+        response = await self.async_client.get('/api/admin/chats/export/', {'message_type': 'user'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.assertEqual((await self.async_client.get('/api/products/')).status_code, 429)
+
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(self.rows(content), [f'message {n}' for n in range(5)])
+        self.assertEqual((await self.async_client.get('/api/products/')).status_code, 200)
+
+
+@override_settings(QUERY_ANALYTICS=True)
+class QueryAnalyticsTests(ChatTestCase):
+
+    def analytics(self, interval=3600):
+        return QueryAnalytics(top_k=10, width=256, depth=4, interval=interval, min_count=1)
+
+    def written_counts(self, analytics):
+        with mock.patch('testapp.analytics.defer') as defer:
+            analytics.flush()
+        return {(kind, key): count for kind, key, count in defer.call_args.args[1]['counts']}
+
+    def test_sketch_never_undercounts_and_overcount_is_bounded(self):
+        sketch = CountMinSketch(width=64, depth=4)
+        counts = {f'query {n}': 1 + 1000 // (n + 1) for n in range(500)}
+        for key, count in counts.items():
+            sketch.add(key, count)
+        total = sum(counts.values())
+
+        errors = [sketch.estimate(key) - count for key, count in counts.items()]
+        self.assertGreaterEqual(min(errors), 0)
+        # Each estimate is within e * total / width with probability 1 - e ** -depth
+        over_bound = sum(error > 2.72 * total / 64 for error in errors)
+        self.assertLessEqual(over_bound, len(counts) * 2.72 ** -4)
+
+    def test_heavy_hitters_evict_the_smallest_key(self):
+        heavy_hitters = HeavyHitters(capacity=2)
+        heavy_hitters.offer('a', 5)
+        heavy_hitters.offer('b', 3)
+        heavy_hitters.offer('c', 4)
+        self.assertEqual(heavy_hitters.top(), [('a', 5), ('c', 4)])
+
+        heavy_hitters.offer('d', 4)
+        heavy_hitters.offer('c', 6)
+        self.assertEqual(heavy_hitters.top(), [('c', 6), ('a', 5)])
+        heavy_hitters.offer('e', 5)
+        self.assertEqual(heavy_hitters.top(), [('c', 6), ('a', 5)])
+        heavy_hitters.offer('e', 7)
+        self.assertEqual(heavy_hitters.top(), [('e', 7), ('c', 6)])
+
+    def test_window_is_written_on_a_timer(self):
+        analytics = self.analytics(interval=0.05)
+        self.addCleanup(analytics.stop)
+        written = threading.Event()
+        with mock.patch('testapp.analytics.defer', side_effect=lambda *args: written.set()) as defer:
+            analytics.record(QueryObservation('hello'), [])
+            self.assertTrue(written.wait(5))
+        counts = defer.call_args.args[1]['counts']
+        self.assertIn(['query', 'hello', 1], counts)
+
+    def test_stop_ends_the_flush_thread(self):
+        analytics = self.analytics(interval=0.05)
+        analytics.record(QueryObservation('hello'), [])
+        thread = analytics._thread
+        analytics.stop()
+        self.assertFalse(thread.is_alive())
+        # Counting still works, but only an explicit flush writes
+        analytics.record(QueryObservation('hello'), [])
+        self.assertIs(analytics._thread, thread)
+        self.assertEqual(self.written_counts(analytics)['query', 'hello'], 2)
+
+    def test_batch_counts_every_message(self):
+        create_product()
+        analytics = self.analytics()
+        with mock.patch('testapp.chatbot_service.query_analytics', analytics):
+            process_chat_batch(self.user, [
+                {'content': 'show me laptops'},
+                {'content': 'Show me  LAPTOPS'},
+                {'content': 'help'},
+            ])
+        counts = self.written_counts(analytics)
+        self.assertEqual(counts['query', 'show me laptops'], 2)
+        self.assertEqual(counts['query', 'help'], 1)
+        self.assertEqual(counts['intent', 'help'], 1)
+
+
+class ChatExportCommandTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.product = create_product()
+        self.sessions = []
+        for username in ['alice', 'bob']:
+            user = User.objects.create(username=username)
+            session = ChatSession.objects.create(user=user, session_id=f'{username}-session')
+            self.sessions.append(session)
+            for day in range(1, 6):
+                moment = timezone.make_aware(datetime.datetime(2024, 1, day, 12))
+                ChatMessage.objects.create(session=session, message_type='user', content=f'{username} {day}',
+                                           timestamp=moment)
+                bot = ChatMessage.objects.create(session=session, message_type='bot', content=f'reply {day}',
+                                                 timestamp=moment)
+                bot.related_products.add(self.product)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def export(self, output, **options):
+        call_command('export_chats', output=self.path(output), stdout=StringIO(), **options)
+        with open(self.path(output), 'rb') as f:
+            return f.read()
+
+    def rows(self, output, **options):
+        return [json.loads(line) for line in self.export(output, **options).decode('utf-8').splitlines()]
+
+    def interrupted(self, batches_before_failure):
+        """
+        message_batches that fail after yielding `batches_before_failure` batches
+        """
+        def batches(**kwargs):
+            for index, batch in enumerate(message_batches(**kwargs)):
+                if index == batches_before_failure:
+                    raise RuntimeError('connection lost')
+                yield batch
+        return mock.patch.object(export_chats, 'message_batches', batches)
+
+    def resume(self, export_format):
+        options = {'format': export_format, 'chunk_size': 3, 'cursor': self.path('export.cursor')}
+        with self.interrupted(2), self.assertRaises(RuntimeError):
+            self.export('export', **options)
+        # A batch cut off after the last checkpoint
+        with open(self.path('export'), 'ab') as f:
+            f.write(b'{"id": 999, "partial')
+        return self.export('export', **options)
+
+    def test_interrupted_export_resumes_from_the_cursor(self):
+        self.assertEqual(self.resume('jsonl'), self.export('complete', chunk_size=3))
+        with open(self.path('export.cursor')) as f:
+            state = json.load(f)['state']
+        self.assertEqual((state['rows'], state['after']), (20, ChatMessage.objects.order_by('pk').last().pk))
+
+    def test_resumed_csv_has_one_header(self):
+        content = self.resume('csv')
+        self.assertEqual(content, self.export('complete', format='csv', chunk_size=3))
+        self.assertEqual(content.count(b'id,session_id,user'), 1)
+        self.assertEqual(len(content.decode('utf-8').splitlines()), 21)
+
+    def test_cursor_of_another_export_is_rejected(self):
+        self.export('export', cursor=self.path('export.cursor'))
+        with self.assertRaisesMessage(CommandError, 'belongs to a different export'):
+            self.export('export', cursor=self.path('export.cursor'), user='alice')
+
+    def test_filters(self):
+        rows = self.rows('filtered', start='2024-01-02', end='2024-01-04', user='alice', message_type='user')
+        self.assertEqual([row['content'] for row in rows], ['alice 2', 'alice 3'])
+        self.assertEqual({(row['user'], row['session_id']) for row in rows}, {('alice', 'alice-session')})
+
+        bot_rows = self.rows('bot', message_type='bot', user='bob')
+        self.assertEqual(len(bot_rows), 5)
+        self.assertEqual({tuple(row['related_products']) for row in bot_rows}, {(self.product.pk,)})
+
+    def test_archived_messages_are_exported_separately(self):
+        archive_session(self.sessions[0])
+        self.assertEqual({row['user'] for row in self.rows('hot')}, {'bob'})
+
+        rows = self.rows('archived', archived=True, start='2024-01-03')
+        self.assertEqual([row['content'] for row in rows], [
+            'alice 3', 'reply 3', 'alice 4', 'reply 4', 'alice 5', 'reply 5',
+        ])
+        self.assertEqual(rows[1]['related_products'], [self.product.pk])
+
+    def test_queries_do_not_grow_with_rows(self):
+        def queries(user):
+            with CaptureQueriesContext(connection) as context:
+                self.export('export', user=user)
+            return len(context)
+
+        small = queries('alice')
+        for day in range(6, 30):
+            bot = ChatMessage.objects.create(session=self.sessions[1], message_type='bot', content=f'reply {day}')
+            bot.related_products.add(self.product)
+        self.assertEqual(queries('bob'), small)
+
+    @skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_parts(self):
+        output = self.path('parquet')
+        call_command('export_chats', output=output, format='parquet', chunk_size=4, rows_per_file=8,
+                     cursor=self.path('parquet.cursor'), stdout=StringIO())
+        self.assertEqual(sorted(os.listdir(output)), [f'part-0000{n}.parquet' for n in range(3)])
+        ids = list(ChatMessage.objects.order_by('pk').values_list('pk', flat=True))
+        self.assertEqual(pyarrow.parquet.read_table(output).column('id').to_pylist(), ids)
+
+    @skipIf(pyarrow is not None, 'pyarrow is installed')
+    def test_parquet_needs_pyarrow(self):
+        with self.assertRaisesMessage(CommandError, 'pip install pyarrow'):
+            self.export('parquet', format='parquet')
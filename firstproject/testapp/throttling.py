@@ -0,0 +1,191 @@
+import math
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+class LimiterCounters:
+    """
+    Thread-safe counters for the rate and concurrency limiters, exposed at
+    /api/admin/limits/ so budgets can be tuned from real traffic
+    """
+
+    def __init__(self):
+        self._counts = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def increment(self, scope, name, amount=1):
+        with self._lock:
+            self._counts[scope][name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return {scope: dict(counts) for scope, counts in self._counts.items()}
+
+
+counters = LimiterCounters()
+
+
+class LocalBucketStore:
+    """
+    Token buckets kept in process memory. A bucket that has refilled to its
+    capacity is the same as no bucket, so every `sweep_interval` seconds
+    full buckets are dropped and memory only holds recently active clients.
+    """
+
+    def __init__(self, sweep_interval=10):
+        self.sweep_interval = sweep_interval
+        # key -> (tokens, updated, full_at)
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def take(self, key, capacity, refill_rate):
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / refill_rate)
+        return allowed, 0 if allowed else (1 - tokens) / refill_rate
+
+    def _sweep(self, now):
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+        self._next_sweep = now + self.sweep_interval
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class CacheBucketStore:
+    """
+    Token buckets kept in the Django cache, shared by every process using it.
+    Read-modify-write is not atomic, so concurrent requests may occasionally
+    spend the same token; the budget is approximate under contention.
+    """
+
+    def take(self, key, capacity, refill_rate):
+        now = time.time()
+        cache_key = f'ratelimit:{key}'
+        tokens, updated = cache.get(cache_key, (capacity, now))
+        tokens = min(capacity, tokens + max(0, now - updated) * refill_rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        # An untouched bucket is full again after capacity / refill_rate seconds
+        cache.set(cache_key, (tokens, now), timeout=math.ceil(capacity / refill_rate) + 1)
+        return allowed, 0 if allowed else (1 - tokens) / refill_rate
+
+
+bucket_store = CacheBucketStore() if settings.RATE_LIMIT_BACKEND == 'cache' else LocalBucketStore()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token-bucket throttle with a budget per scope (settings.RATE_LIMITS) and
+    per client: the user id when authenticated, the client IP otherwise.
+    Only requests whose method is in `methods` are charged; None charges all.
+    X-Forwarded-For is only trusted when REST_FRAMEWORK['NUM_PROXIES'] says
+    how many proxies append to it; otherwise clients could pick any bucket.
+    """
+    scope = None
+    methods = None
+
+    def allow_request(self, request, view):
+        if self.methods is not None and request.method not in self.methods:
+            return True
+        budget = settings.RATE_LIMITS.get(self.scope)
+        if not budget:
+            return True
+
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+
+        allowed, self.wait_time = bucket_store.take(
+            f'{self.scope}:{ident}', budget['capacity'], budget['refill_per_second']
+        )
+        counters.increment(self.scope, 'allowed' if allowed else 'throttled')
+        return allowed
+
+    def get_ident(self, request):
+        if api_settings.NUM_PROXIES is None:
+            return request.META.get('REMOTE_ADDR')
+        return super().get_ident(request)
+
+    def wait(self):
+        return self.wait_time
+
+
+class ProductListThrottle(TokenBucketThrottle):
+    scope = 'product_list'
+
+
+class ProductSearchThrottle(TokenBucketThrottle):
+    scope = 'product_search'
+
+
+class ProductSuggestThrottle(TokenBucketThrottle):
+    scope = 'product_suggest'
+
+
+class ChatThrottle(TokenBucketThrottle):
+    scope = 'chat'
+    methods = {'POST'}
+
+
+class ChatHistoryThrottle(TokenBucketThrottle):
+    scope = 'chat_history'
+    methods = SAFE_METHODS
+
+
+class ChatBatchThrottle(TokenBucketThrottle):
+    scope = 'chat_batch'
+
+
+class ConcurrencyLimiter:
+    """
+    Caps in-flight requests per path prefix (settings.CONCURRENCY_LIMITS).
+    Requests over the cap are rejected immediately instead of queueing on the
+    database.
+    """
+
+    def __init__(self, limits):
+        # Longest prefix first so the most specific limit wins
+        self._limits = [
+            (prefix, threading.BoundedSemaphore(limit))
+            for prefix, limit in sorted(limits.items(), key=lambda item: -len(item[0]))
+        ]
+
+    def acquire(self, path):
+        """
+        Return the prefix whose slot was taken, '' when no limit applies, or None when shed
+        """
+        for prefix, semaphore in self._limits:
+            if path.startswith(prefix):
+                if semaphore.acquire(blocking=False):
+                    counters.increment(prefix, 'admitted')
+                    return prefix
+                counters.increment(prefix, 'shed')
+                return None
+        return ''
+
+    def release(self, prefix):
+        for limit_prefix, semaphore in self._limits:
+            if limit_prefix == prefix:
+                semaphore.release()
+                return
+
+
+concurrency_limiter = ConcurrencyLimiter(settings.CONCURRENCY_LIMITS)
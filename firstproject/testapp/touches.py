@@ -0,0 +1,69 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, When
+
+from .models import ChatSession
+
+logger = logging.getLogger(__name__)
+
+
+class SessionTouchBuffer:
+    """
+    Coalesces ChatSession.updated_at bumps. Touches are kept in memory and
+    written every `interval` seconds with a single UPDATE for all touched
+    sessions, so session ordering lags by at most about one interval.
+    An interval of 0 writes each touch immediately.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def touch(self, session_pk, touched_at):
+        if self.interval <= 0:
+            write_session_touches({session_pk: touched_at})
+            return
+        with self._lock:
+            current = self._pending.get(session_pk)
+            if current is None or current < touched_at:
+                self._pending[session_pk] = touched_at
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='session-touches', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to write session touches")
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            write_session_touches(pending)
+
+
+def write_session_touches(latest):
+    """
+    Set updated_at for many sessions in one UPDATE; `latest` maps session pk to timestamp
+    """
+    ChatSession.objects.filter(pk__in=latest).update(updated_at=Case(
+        *[When(pk=pk, then=touched_at) for pk, touched_at in latest.items()],
+        default='updated_at',
+    ))
+
+
+session_touches = SessionTouchBuffer(settings.SESSION_TOUCH_FLUSH_INTERVAL)
+atexit.register(session_touches.flush)
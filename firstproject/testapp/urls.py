@@ -6,6 +6,7 @@ urlpatterns = [
     path('api/products/', views.ProductListCreateView.as_view(), name='product-list-create'),
     path('api/products/<int:pk>/', views.ProductRetrieveUpdateDestroyView.as_view(), name='product-detail'),
     path('api/products/search/', views.product_search, name='product-search'),
+    path('api/products/suggest/', views.product_suggest, name='product-suggest'),
     
     # Authentication endpoints
     path('api/auth/signup/', views.UserRegistrationView.as_view(), name='user-signup'),
@@ -15,7 +16,12 @@ urlpatterns = [
     
     # Chat endpoints
     path('api/chat/sessions/', views.chat_sessions, name='chat-sessions'),
+    path('api/chat/batch/', views.chat_batch, name='chat-batch'),
     path('api/chat/sessions/<str:session_id>/', views.chat_session_detail, name='chat-session-detail'),
     path('api/chat/sessions/<str:session_id>/messages/', views.chat_messages, name='chat-messages'),
     path('api/chat/sessions/<str:session_id>/reset/', views.reset_chat_session, name='reset-chat-session'),
+
+    # Operational endpoints
+    path('api/admin/limits/', views.limiter_stats, name='limiter-stats'),
+    path('api/admin/chats/export/', views.chat_export, name='chat-export'),
 ] 
\ No newline at end of file
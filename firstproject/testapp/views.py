@@ -4,13 +4,15 @@ from django.contrib import messages
 from .forms import SignupForm
 from django.http import HttpResponse
 from django.http import JsonResponse
+from django.http import StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.views.decorators.csrf import csrf_exempt
 import json
 from django.contrib.auth.models import User
 from rest_framework import generics, status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from django.utils.decorators import method_decorator
 from django.db.models import Q
 from django.utils import timezone
@@ -25,9 +27,26 @@ from .serializers import (
     ChatSessionSerializer,
     ChatMessageSerializer,
     ChatMessageCreateSerializer,
+    ChatBatchSerializer,
     ProductSearchSerializer
 )
-from .chatbot_service import ChatbotService
+from .archive import rehydrate_session
+from .export import (
+    CONTENT_TYPES, EXPORT_FORMATS, astream_export, check_format, message_batches, parse_export_time, stream_export,
+)
+from .caching import get_chat_session, forget_chat_session
+from .throttling import (
+    counters as limiter_counters,
+    ProductListThrottle,
+    ProductSearchThrottle,
+    ProductSuggestThrottle,
+    ChatThrottle,
+    ChatHistoryThrottle,
+    ChatBatchThrottle
+)
+
+# The chatbot, its spelling and typeahead indexes and the catalog snapshot are
+# imported inside the views that use them, so loading the URLconf stays cheap
 
 def signup_view(request):
     if request.method == 'POST':
@@ -73,6 +92,7 @@ class ProductListCreateView(generics.ListCreateAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [ProductListThrottle]
 
     def get_queryset(self):
         queryset = Product.objects.all()
@@ -168,13 +188,16 @@ def chat_sessions(request):
         )
         
         # Create welcome message
-        chatbot = ChatbotService()
-        welcome_response, _ = chatbot.generate_response("hello", request.user)
+        from .chat import product_snapshot
+        from .chatbot_service import get_chatbot
+        chatbot = get_chatbot()
+        welcome_response, _ = chatbot.generate_response("hello", request.user, track=False)
         
         ChatMessage.objects.create(
             session=session,
             message_type='bot',
-            content=welcome_response
+            content=welcome_response,
+            product_snapshot=product_snapshot([])
         )
         
         serializer = ChatSessionSerializer(session)
@@ -183,12 +206,13 @@ def chat_sessions(request):
 @api_view(['GET', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def chat_session_detail(request, session_id):
-    try:
-        session = ChatSession.objects.get(session_id=session_id, user=request.user)
-    except ChatSession.DoesNotExist:
+    session = get_chat_session(request.user, session_id)
+    if session is None:
         return Response({'error': 'Session not found'}, status=status.HTTP_404_NOT_FOUND)
     
     if request.method == 'GET':
+        # Opening an archived session restores its messages into the hot table
+        rehydrate_session(session)
         serializer = ChatSessionSerializer(session)
         return Response(serializer.data)
     
@@ -198,13 +222,14 @@ def chat_session_detail(request, session_id):
 
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([ChatThrottle, ChatHistoryThrottle])
 def chat_messages(request, session_id):
-    try:
-        session = ChatSession.objects.get(session_id=session_id, user=request.user)
-    except ChatSession.DoesNotExist:
+    session = get_chat_session(request.user, session_id)
+    if session is None:
         return Response({'error': 'Session not found'}, status=status.HTTP_404_NOT_FOUND)
     
     if request.method == 'GET':
+        rehydrate_session(session)
         messages = session.messages.all()
         serializer = ChatMessageSerializer(messages, many=True)
         return Response(serializer.data)
@@ -212,35 +237,11 @@ def chat_messages(request, session_id):
     elif request.method == 'POST':
         serializer = ChatMessageCreateSerializer(data=request.data)
         if serializer.is_valid():
-            # Save user message
-            user_message = ChatMessage.objects.create(
-                session=session,
-                message_type='user',
-                content=serializer.validated_data['content']
-            )
-            
-            # Generate bot response
-            chatbot = ChatbotService()
-            bot_response, related_products = chatbot.generate_response(
-                serializer.validated_data['content'], 
-                request.user
+            from .chat import post_chat_message
+            user_message, bot_message = post_chat_message(
+                session, request.user, serializer.validated_data['content']
             )
             
-            # Save bot message
-            bot_message = ChatMessage.objects.create(
-                session=session,
-                message_type='bot',
-                content=bot_response
-            )
-            
-            # Add related products if any
-            if related_products:
-                bot_message.related_products.set(related_products)
-            
-            # Update session timestamp
-            session.updated_at = timezone.now()
-            session.save()
-            
             # Return both messages
             user_data = ChatMessageSerializer(user_message).data
             bot_data = ChatMessageSerializer(bot_message).data
@@ -256,28 +257,49 @@ def chat_messages(request, session_id):
 @permission_classes([IsAuthenticated])
 @csrf_exempt
 def reset_chat_session(request, session_id):
-    try:
-        session = ChatSession.objects.get(session_id=session_id, user=request.user)
-    except ChatSession.DoesNotExist:
+    session = get_chat_session(request.user, session_id)
+    if session is None:
         return Response({'error': 'Session not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    # Delete all messages in the session
+    forget_chat_session(session)
+
+    # Delete all messages in the session, including archived ones
     session.messages.all().delete()
+    if session.is_archived:
+        session.archives.all().delete()
+        session.is_archived = False
+        session.save(update_fields=['is_archived'])
     
     # Create new welcome message
-    chatbot = ChatbotService()
-    welcome_response, _ = chatbot.generate_response("hello", request.user)
+    from .chat import product_snapshot
+    from .chatbot_service import get_chatbot
+    chatbot = get_chatbot()
+    welcome_response, _ = chatbot.generate_response("hello", request.user, track=False)
     
     ChatMessage.objects.create(
         session=session,
         message_type='bot',
-        content=welcome_response
+        content=welcome_response,
+        product_snapshot=product_snapshot([])
     )
     
     return Response({'message': 'Chat session reset successfully'}, status=status.HTTP_200_OK)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@throttle_classes([ChatBatchThrottle])
+def chat_batch(request):
+    serializer = ChatBatchSerializer(data=request.data)
+    if serializer.is_valid():
+        from .batch import process_chat_batch
+        result = process_chat_batch(request.user, serializer.validated_data['messages'])
+        return Response(result, status=status.HTTP_201_CREATED)
+
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([ProductSearchThrottle])
 @csrf_exempt
 def product_search(request):
     serializer = ProductSearchSerializer(data=request.data)
@@ -314,16 +336,79 @@ def product_search(request):
         if in_stock_only:
             products = products.filter(stock__gt=0)
         
+        # Facets describe the whole match set, not just the first page
+        facets = None
+        if serializer.validated_data.get('include_facets', True):
+            from .facets import catalog_facets, compute_facets
+            if any([query, category, min_price, max_price, min_rating]):
+                facets = compute_facets(products)
+            else:
+                facets = catalog_facets.for_catalog(in_stock_only)
+        
         products = products[:20]  # Limit results
         serializer = ProductSerializer(products, many=True)
         
-        return Response({
+        response_data = {
             'count': len(products),
             'results': serializer.data
-        })
+        }
+        if facets is not None:
+            response_data['facets'] = facets
+        return Response(response_data)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@throttle_classes([ProductSuggestThrottle])
+def product_suggest(request):
+    query = request.query_params.get('q', '')
+    try:
+        limit = min(max(int(request.query_params.get('limit', 8)), 1), 20)
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    from .suggest import suggest_index
+    return Response({
+        'query': query,
+        'suggestions': suggest_index.suggest(query[:100], limit)
+    })
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def limiter_stats(request):
+    return Response(limiter_counters.snapshot())
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def chat_export(request):
+    params = request.query_params
+    # Not ?format=, which DRF reserves for choosing a renderer
+    export_format = params.get('output', 'jsonl')
+    if export_format not in EXPORT_FORMATS:
+        return Response({'error': f"output must be one of {', '.join(EXPORT_FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+    message_type = params.get('message_type') or None
+    if message_type and message_type not in dict(ChatMessage.MESSAGE_TYPES):
+        return Response({'error': 'Unknown message_type'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        after = int(params.get('after', 0))
+    except ValueError:
+        return Response({'error': 'after must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        check_format(export_format)
+        batches = message_batches(
+            start=parse_export_time(params['start']) if params.get('start') else None,
+            end=parse_export_time(params['end']) if params.get('end') else None,
+            user=params.get('user') or None,
+            message_type=message_type,
+            after=after,
+        )
+    except (ImportError, ValueError) as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
 
+    chunks = stream_export(export_format, batches)
+    if isinstance(request._request, ASGIRequest):
+        chunks = astream_export(chunks)
+    response = StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="chats.{export_format}"'
+    return response
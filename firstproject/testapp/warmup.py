@@ -0,0 +1,40 @@
+import logging
+import time
+
+from django.db import connections
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+
+def warmup():
+    """
+    Do the work the first requests would otherwise pay for: load the URLconf
+    (views, serializers, DRF), build the chatbot and catalog indexes and
+    replay the most frequent recent queries.
+    Called from wsgi.py/asgi.py when settings.STARTUP_WARMUP is set.
+    """
+    started = time.perf_counter()
+
+    # Resolving the URLconf imports every view module
+    get_resolver().url_patterns
+
+    from .analytics import prewarm
+    from .chatbot_service import get_chatbot, product_categories, spelling_index
+    from .facets import catalog_facets
+    from .suggest import suggest_index
+
+    get_chatbot()
+    product_categories.get()
+    spelling_index.get()
+    suggest_index.warm()
+    catalog_facets.for_catalog(False)
+    # Answers and typeahead results for what users asked most recently
+    queries, prefixes = prewarm()
+
+    # Servers that fork after loading the app must not share these sockets
+    connections.close_all()
+    logger.info(
+        "Warmup finished in %.0f ms (%d popular queries, %d typeahead prefixes)",
+        (time.perf_counter() - started) * 1000, queries, prefixes,
+    )
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import re
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpRequest
+from django.http.cookie import parse_cookie
+
+from .archive import rehydrate_session
+from .caching import get_cached_user, get_chat_session
+from .renderers import FastJSONRenderer
+from .serializers import ChatMessageCreateSerializer, ChatMessageSerializer
+from .throttling import bucket_store, concurrency_limiter, counters
+
+logger = logging.getLogger(__name__)
+
+PATH_RE = re.compile(r'^/ws/chat/(?P<session_id>[^/]+)/$')
+
+# Application close codes (4000-4999). A close sent before the handshake is
+# accepted makes the server answer the upgrade with 403 instead.
+CLOSE_REJECTED = 4403
+CLOSE_IDLE = 4408
+
+_renderer = FastJSONRenderer()
+
+
+def _origin_allowed(headers):
+    """
+    Browsers always send Origin; only same-host and CORS-allowed pages may open a socket with the user's cookies
+    """
+    origin = headers.get('origin')
+    if origin is None:
+        return True
+    return origin in settings.CORS_ALLOWED_ORIGINS or urlsplit(origin).netloc == headers.get('host')
+
+
+def _authenticate(headers, session_id):
+    """
+    Resolve the user from the session cookie and their ChatSession, or (None, None).
+    An archived session is restored first, as when its history is opened over HTTP.
+    """
+    engine = import_module(settings.SESSION_ENGINE)
+    request = HttpRequest()
+    request.session = engine.SessionStore(parse_cookie(headers.get('cookie', '')).get(settings.SESSION_COOKIE_NAME))
+    user = get_cached_user(request)
+    if not user.is_authenticated:
+        return None, None
+    session = get_chat_session(user, session_id)
+    if session is not None:
+        rehydrate_session(session)
+    return user, session
+
+
+def _run_db(func, *args):
+    """
+    Run `func` like a request would: connections past CONN_MAX_AGE or broken
+    are closed before and after, so sockets hold no connection between frames
+    """
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def _answer(user, session, text):
+    """
+    Handle one client frame and return the frames to send back
+    """
+    try:
+        payload = json.loads(text)
+    except ValueError:
+        return [{'type': 'error', 'error': 'Frames must be JSON objects'}]
+    if not isinstance(payload, dict):
+        return [{'type': 'error', 'error': 'Frames must be JSON objects'}]
+    if payload.get('type') == 'ping':
+        return [{'type': 'pong'}]
+
+    serializer = ChatMessageCreateSerializer(data=payload)
+    if not serializer.is_valid():
+        return [{'type': 'error', 'error': serializer.errors}]
+
+    # Same bucket as ChatThrottle, so both transports share the user's budget
+    budget = settings.RATE_LIMITS.get('chat')
+    if budget:
+        allowed, wait = bucket_store.take(f'chat:user:{user.pk}', budget['capacity'], budget['refill_per_second'])
+        counters.increment('chat', 'allowed' if allowed else 'throttled')
+        if not allowed:
+            return [{'type': 'error', 'error': 'Too many messages', 'retry_after': round(wait, 2)}]
+
+    # Imported on first message so loading the ASGI application does not build the chatbot
+    from .chat import post_chat_message
+    user_message, bot_message = post_chat_message(session, user, serializer.validated_data['content'])
+    return [
+        {'type': 'user_message', 'message': ChatMessageSerializer(user_message).data},
+        {'type': 'bot_message', 'message': ChatMessageSerializer(bot_message).data},
+    ]
+
+
+class ChatSocket:
+    """
+    One WebSocket connection to /ws/chat/<session_id>/. The user and their
+    ChatSession are resolved once when the socket opens. Each client frame
+    {"content": "..."} is answered with a user_message frame and a bot_message
+    frame carrying the product cards.
+
+    Frames are handled one at a time in order. At most WEBSOCKET_MAX_PENDING
+    frames wait in the queue; beyond that the socket stops reading, so a fast
+    client is slowed down by the server's flow control. Sockets with no
+    client frame for WEBSOCKET_IDLE_TIMEOUT seconds are closed.
+
+    Database work runs in asgiref's shared thread-sensitive executor, one
+    frame at a time, so open sockets cost no thread or connection each.
+    """
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.pending = asyncio.Queue(maxsize=settings.WEBSOCKET_MAX_PENDING)
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+
+        match = PATH_RE.match(self.scope['path'])
+        headers = {
+            name.decode('latin-1').lower(): value.decode('latin-1')
+            for name, value in self.scope.get('headers', [])
+        }
+        if match is None or not _origin_allowed(headers):
+            await self.send({'type': 'websocket.close', 'code': CLOSE_REJECTED})
+            return
+
+        slot = concurrency_limiter.acquire(self.scope['path'])
+        if slot is None:
+            await self.send({'type': 'websocket.close', 'code': CLOSE_REJECTED})
+            return
+        try:
+            await self._serve(headers, match.group('session_id'))
+        finally:
+            if slot:
+                concurrency_limiter.release(slot)
+
+    async def _serve(self, headers, session_id):
+        user, session = await sync_to_async(_run_db)(_authenticate, headers, session_id)
+        if session is None:
+            await self.send({'type': 'websocket.close', 'code': CLOSE_REJECTED})
+            return
+        await self.send({'type': 'websocket.accept'})
+
+        worker = asyncio.create_task(self._process(user, session))
+        try:
+            await self._read()
+        finally:
+            worker.cancel()
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+
+    async def _read(self):
+        while True:
+            try:
+                message = await asyncio.wait_for(self.receive(), settings.WEBSOCKET_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                await self.send({'type': 'websocket.close', 'code': CLOSE_IDLE})
+                return
+            if message['type'] == 'websocket.disconnect':
+                return
+            if message['type'] == 'websocket.receive':
+                text = message.get('text')
+                if text is None:
+                    text = (message.get('bytes') or b'').decode('utf-8', 'replace')
+                await self.pending.put(text)
+
+    async def _process(self, user, session):
+        while True:
+            text = await self.pending.get()
+            try:
+                frames = await sync_to_async(_run_db)(_answer, user, session, text)
+            except Exception:
+                logger.exception("Chat socket failed to answer a frame")
+                frames = [{'type': 'error', 'error': 'Internal error'}]
+            for frame in frames:
+                await self.send({'type': 'websocket.send', 'text': _renderer.render(frame).decode('utf-8')})
+
+
+async def chat_websocket(scope, receive, send):
+    await ChatSocket(scope, receive, send).run()